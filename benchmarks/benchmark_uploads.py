@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端對端上傳效能量測
+啟動本機模擬伺服器（或連到指定的伺服器），以主程式實際的壓縮與上傳程式碼
+跑過不同的檔案大小、檔案數量、壓縮模式與並行數，輸出吞吐量與延遲百分位數。
+
+用法：
+    python benchmarks/benchmark_uploads.py
+    python benchmarks/benchmark_uploads.py --sizes 1 64 --counts 4 --modes none split zip --concurrency 1 4 \\
+        --latency 0.02 --bandwidth 40 --error-rate 0.02 --rate-limit 0.02 --json results.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from mock_katfile_server import MockConfig, start_server
+
+MODES = ('none', 'split', 'zip', '7z')
+
+
+class NullDispatcher:
+    """不需要介面時的 UIDispatcher 替代品（狀態更新直接丟棄）"""
+
+    def status(self, index, text):
+        pass
+
+    def step(self, count=1):
+        pass
+
+
+def load_uploader_class():
+    """載入主程式（須在設定 KATFILE_BASE_URL 之後才匯入）"""
+    import katfile_uploader_enhanced
+    return katfile_uploader_enhanced
+
+
+class Setting:
+    """與 tk 變數相同介面的設定值（Tcl 變數無法在沒有 mainloop 的背景執行緒讀取）"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+def make_headless_uploader(app, settings, event_dir, verbose=False):
+    """建立不開視窗的上傳器：沿用主程式的上傳、分割與壓縮方法"""
+
+    class HeadlessUploader(app.KatFileUploaderEnhanced):
+        def __init__(self):
+            self.api_key = Setting(settings['api_key'])
+            self.compress_format = Setting(settings['compress_format'])
+            self.compress_password = Setting(settings['password'])
+            self.compress_level = Setting(str(settings['level']))
+            self.enable_split = Setting(False)
+            self.split_size = Setting(str(settings['split_mb']))
+            self.split_unit = Setting("MB")
+            self.parallel_uploads = Setting("1")
+            self.upload_block_kb = Setting(str(settings.get('block_kb', app.UPLOAD_BLOCK_SIZE // 1024)))
+            self.digest_md5 = Setting(False)
+            self.digest_sha256 = Setting(settings['sha256'])
+            self.event_log = app.EventLog(event_dir)
+            self.ui = NullDispatcher()
+            self.is_uploading = True
+            self.setup_session()
+
+        def log(self, message):
+            if verbose:
+                print(message)
+
+    return HeadlessUploader()
+
+
+def percentile(values, pct):
+    """最近秩法百分位數"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def make_files(directory, size_mb, count, compressible):
+    """產生測試檔案（同一組大小與數量只產生一次）"""
+    directory = Path(directory) / f"{size_mb}MB-x{count}"
+    if directory.exists():
+        return sorted(directory.iterdir())
+    directory.mkdir(parents=True)
+    block = 1024 * 1024
+    paths = []
+    for n in range(count):
+        path = directory / f"bench_{n:04d}.bin"
+        text_block = (f"{n:08d} katfile benchmark line\n".encode('ascii') * (block // 32 + 1))[:block]
+        with open(path, 'wb') as f:
+            for _ in range(size_mb):
+                f.write(text_block if compressible else os.urandom(block))
+        paths.append(path)
+    return paths
+
+
+def run_scenario(app, uploader, paths, mode, concurrency, scratch_dir):
+    """執行一組情境，回傳量測結果"""
+    app.METRICS.reset()
+    latencies = []
+    failures = 0
+    source_bytes = sum(path.stat().st_size for path in paths)
+
+    uploader.compress_format.set(mode if mode in ('zip', '7z') else 'zip')
+    uploader.enable_split.set(mode == 'split')
+    uploader.parallel_uploads.set(str(concurrency))
+    uploader.event_log.open_run()
+
+    def upload_one(path):
+        started = time.perf_counter()
+        entry = app.FileEntry.from_path(str(path))
+        if mode in ('zip', '7z'):
+            job_dir = Path(tempfile.mkdtemp(dir=scratch_dir))
+            try:
+                archives = uploader.compress_file(entry.path, job_dir)
+                ok = bool(archives) and all(
+                    uploader.upload_single_file(app.FileEntry.from_path(archive), 0,
+                                                uploader.get_digest_names())
+                    for archive in archives)
+            finally:
+                shutil.rmtree(job_dir, ignore_errors=True)
+        else:
+            ok = bool(uploader.upload_single_file(entry, 0, uploader.get_digest_names()))
+        return ok, time.perf_counter() - started
+
+    wall_started = time.perf_counter()
+    if mode == 'split':
+        # 與主程式相同：檔案依序處理，每個檔案的分割以 concurrency 並行上傳
+        split_bytes = int(uploader.split_size.get()) * 1024 * 1024
+        for path in paths:
+            started = time.perf_counter()
+            entry = app.FileEntry.from_path(str(path))
+            parts = app.plan_virtual_parts(entry.path, split_bytes)
+            links = uploader.upload_virtual_parts(0, parts, 0)
+            latencies.append(time.perf_counter() - started)
+            failures += 0 if all(links) else 1
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="量測") as pool:
+            for ok, seconds in pool.map(upload_one, paths):
+                latencies.append(seconds)
+                failures += 0 if ok else 1
+    wall = time.perf_counter() - wall_started
+    uploader.event_log.close_run()
+
+    counters = app.METRICS.snapshot()['counters']
+    mb = 1024 * 1024
+    return {
+        'files': len(paths),
+        'size_mb': paths[0].stat().st_size / mb if paths else 0,
+        'mode': mode,
+        'concurrency': concurrency,
+        'wall_seconds': round(wall, 3),
+        'throughput_mb_s': round(source_bytes / mb / wall, 2) if wall else 0.0,
+        'wire_mb_s': round(counters.get('upload_bytes', 0) / mb / wall, 2) if wall else 0.0,
+        'latency_p50': round(percentile(latencies, 50), 3),
+        'latency_p90': round(percentile(latencies, 90), 3),
+        'latency_p99': round(percentile(latencies, 99), 3),
+        'failures': failures,
+        'retries': counters.get('upload_retries', 0) + counters.get('link_retries', 0),
+        'stages': app.METRICS.summary()['stages']
+    }
+
+
+def print_table(results):
+    columns = (('files', "檔案數", "{:>6}"), ('size_mb', "大小MB", "{:>7.1f}"), ('mode', "模式", "{:>6}"),
+               ('concurrency', "並行", "{:>4}"), ('throughput_mb_s', "MB/s", "{:>8.2f}"),
+               ('wire_mb_s', "傳輸MB/s", "{:>9.2f}"), ('latency_p50', "p50秒", "{:>7.3f}"),
+               ('latency_p90', "p90秒", "{:>7.3f}"), ('latency_p99', "p99秒", "{:>7.3f}"),
+               ('failures', "失敗", "{:>4}"), ('retries', "重試", "{:>4}"))
+    print("  ".join(title for _, title, _ in columns))
+    for result in results:
+        print("  ".join(fmt.format(result[key]) for key, _, fmt in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端對端上傳效能量測（使用本機模擬伺服器）")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 16], help="檔案大小（MB）")
+    parser.add_argument('--counts', type=int, nargs='+', default=[8], help="每組情境的檔案數量")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['none', 'split', 'zip'],
+                        help="none=直接上傳、split=虛擬分割並行上傳、zip/7z=先壓縮再上傳")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4], help="並行上傳數")
+    parser.add_argument('--split-mb', type=int, default=4, help="split 模式的分割大小（MB）")
+    parser.add_argument('--level', type=int, default=1, help="壓縮等級（0-9）")
+    parser.add_argument('--block-kb', type=int, default=1024, help="上傳區塊大小（KB）")
+    parser.add_argument('--password', default="", help="壓縮密碼")
+    parser.add_argument('--no-sha256', action='store_true', help="上傳時不計算 SHA-256")
+    parser.add_argument('--compressible', action='store_true', help="產生可壓縮的文字內容（預設為亂數）")
+    parser.add_argument('--server', help="使用已啟動的伺服器（例如 http://127.0.0.1:8765），不啟動內建模擬伺服器")
+    parser.add_argument('--latency', type=float, default=0.0, help="模擬伺服器每個請求的延遲（秒）")
+    parser.add_argument('--bandwidth', type=float, default=0.0, help="模擬伺服器每個連線的頻寬（MB/s，0 不限）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="模擬伺服器回應 500 的機率")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="模擬伺服器回應 429 的機率")
+    parser.add_argument('--seed', type=int, default=1, help="錯誤注入的亂數種子")
+    parser.add_argument('--work-dir', help="測試檔案與暫存目錄（預設為臨時目錄，結束後刪除）")
+    parser.add_argument('--json', help="把結果寫入 JSON 檔")
+    parser.add_argument('--profile', help="以效能分析模式執行，結果寫入此目錄（pstats、collapsed 堆疊、記憶體配置）")
+    parser.add_argument('--verbose', action='store_true', help="顯示上傳日誌")
+    args = parser.parse_args()
+
+    server = None
+    if args.server:
+        base_url = args.server.rstrip('/')
+    else:
+        config = MockConfig(args.latency, args.bandwidth * 1024 * 1024, args.error_rate, args.rate_limit,
+                            seed=args.seed)
+        server = start_server(config)
+        base_url = server.base_url
+    os.environ['KATFILE_BASE_URL'] = base_url
+    app = load_uploader_class()
+
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="katfile_bench_"))
+    scratch_dir = work_dir / "scratch"
+    scratch_dir.mkdir(parents=True, exist_ok=True)
+    settings = {'api_key': 'benchmark', 'compress_format': 'zip', 'password': args.password, 'level': args.level,
+                'split_mb': args.split_mb, 'sha256': not args.no_sha256, 'block_kb': args.block_kb}
+    uploader = make_headless_uploader(app, settings, work_dir / "events", args.verbose)
+
+    print(f"🧪 伺服器: {base_url}　工作目錄: {work_dir}")
+    results = []
+    profiler = None
+    if args.profile:
+        uploader.profile_dir = Path(args.profile)
+        profiler = uploader.start_profiler()
+    try:
+        for size_mb in args.sizes:
+            for count in args.counts:
+                paths = make_files(work_dir / "data", size_mb, count, args.compressible)
+                for mode in args.modes:
+                    for concurrency in args.concurrency:
+                        result = run_scenario(app, uploader, paths, mode, concurrency, scratch_dir)
+                        results.append(result)
+                        print(f"  {mode:>5} {count}×{size_mb}MB 並行{concurrency}: "
+                              f"{result['throughput_mb_s']:.2f} MB/s, p50 {result['latency_p50']:.3f}s, "
+                              f"p99 {result['latency_p99']:.3f}s, 失敗 {result['failures']}")
+    finally:
+        if profiler is not None:
+            print(f"🔬 效能分析結果: {profiler.stop()}")
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print()
+    print_table(results)
+    summary = {'server': base_url, 'results': results}
+    if server is not None:
+        summary['server_stats'] = server.state.stats()
+        print()
+        print(f"伺服器統計: {json.dumps(server.state.stats()['by_status'], ensure_ascii=False)}")
+        server.shutdown()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"📄 結果已寫入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大檔案記憶體回歸測試
+產生數 GB 的稀疏測試檔，對本機模擬伺服器（只接收、不儲存）分別執行壓縮、分割與上傳路徑，
+記錄每條路徑的最高 RSS 與 tracemalloc 最高值；超過「區塊大小 × 倍數」的上限時以非零狀態結束。
+
+每條路徑在獨立的子程序中執行，RSS 不會互相影響。
+
+用法：
+    python benchmarks/memory_harness.py
+    python benchmarks/memory_harness.py --size-gb 4 --paths split upload upload-parts --ceiling-blocks 16 --json memory.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+PATHS = ('split', 'compress-zip', 'compress-7z', 'upload', 'upload-parts')
+
+
+def peak_rss_bytes():
+    """目前程序到目前為止的最高 RSS（不支援的平台回傳 None）"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 為單位，macOS 以位元組為單位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def make_sparse_file(path, size):
+    """建立稀疏測試檔：大部分為空洞，每 256 MB 寫入 1 MB 亂數，避免內容過於單純"""
+    path = Path(path)
+    if path.exists() and path.stat().st_size == size:
+        return path
+    stride = 256 * 1024 * 1024
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        for offset in range(0, size, stride):
+            f.seek(offset)
+            f.write(os.urandom(min(1024 * 1024, size - offset)))
+    return path
+
+
+def run_path(name, source, work_dir, split_mb):
+    """在子程序中執行一條路徑，回傳 (tracemalloc 最高值, RSS 增加量, 秒數)"""
+    from benchmark_uploads import make_headless_uploader, load_uploader_class
+
+    app = load_uploader_class()
+    settings = {'api_key': 'memory', 'compress_format': 'zip', 'password': '', 'level': 1,
+                'split_mb': split_mb, 'sha256': True}
+    uploader = make_headless_uploader(app, settings, Path(work_dir) / "events")
+    uploader.parallel_uploads.set("4")
+    entry = app.FileEntry.from_path(str(source))
+
+    rss_before = peak_rss_bytes()
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    if name == 'split':
+        parts = uploader.split_file(source, split_mb, Path(work_dir) / "parts", ('sha256',), {})
+        for part in parts:
+            if part != Path(source):
+                part.unlink()
+        ok = len(parts) > 1
+    elif name.startswith('compress-'):
+        uploader.compress_format.set(name.split('-', 1)[1])
+        archives = uploader.compress_file(source, work_dir, {})
+        ok = bool(archives)
+        for archive in archives or ():
+            os.remove(archive)
+    elif name == 'upload':
+        ok = bool(uploader.upload_single_file(entry, 0, ('sha256',)))
+    else:
+        parts = app.plan_virtual_parts(entry.path, split_mb * 1024 * 1024)
+        ok = all(uploader.upload_virtual_parts(0, parts, 0))
+
+    seconds = time.perf_counter() - started
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = peak_rss_bytes()
+    rss_growth = rss_after - rss_before if rss_before is not None else None
+    return {'ok': ok, 'traced_peak': traced_peak, 'rss_growth': rss_growth, 'seconds': round(seconds, 2)}
+
+
+def child_main(args):
+    result = run_path(args.child, args.source, args.work_dir, args.split_mb)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="大檔案壓縮／分割／上傳路徑的記憶體回歸測試")
+    parser.add_argument('--size-gb', type=float, default=2.0, help="測試檔大小（GB）")
+    parser.add_argument('--paths', nargs='+', choices=PATHS, default=['split', 'compress-zip', 'upload', 'upload-parts'],
+                        help="要測試的路徑（compress-7z 在大檔案上很慢，預設不執行）")
+    parser.add_argument('--split-mb', type=int, default=512, help="分割大小（MB）")
+    parser.add_argument('--ceiling-blocks', type=float, default=16,
+                        help="tracemalloc 上限：區塊大小（UPLOAD_BLOCK_SIZE）的倍數")
+    parser.add_argument('--rss-overhead-mb', type=float, default=64,
+                        help="RSS 上限額外允許的固定用量（MB），RSS 上限 = 區塊上限 + 此值")
+    parser.add_argument('--work-dir', help="測試檔目錄（預設為臨時目錄，結束後刪除）")
+    parser.add_argument('--json', help="把結果寫入 JSON 檔")
+    # 子程序內部使用
+    parser.add_argument('--child', choices=PATHS, help=argparse.SUPPRESS)
+    parser.add_argument('--source', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child_main(args)
+        return 0
+
+    from mock_katfile_server import start_server
+    server = start_server()
+    env = dict(os.environ, KATFILE_BASE_URL=server.base_url)
+
+    import katfile_uploader_enhanced as app
+    block_size = app.UPLOAD_BLOCK_SIZE
+    traced_ceiling = int(block_size * args.ceiling_blocks)
+    rss_ceiling = traced_ceiling + int(args.rss_overhead_mb * 1024 * 1024)
+
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="katfile_memory_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    source = make_sparse_file(work_dir / "sparse_source.bin", int(args.size_gb * 1024 ** 3))
+    print(f"🧪 測試檔: {source}（{app.format_file_size(source.stat().st_size)}）　區塊: {app.format_file_size(block_size)}")
+    print(f"   上限: tracemalloc {app.format_file_size(traced_ceiling)}，RSS 增加 {app.format_file_size(rss_ceiling)}")
+
+    results = []
+    failed = False
+    try:
+        for name in args.paths:
+            command = [sys.executable, __file__, '--child', name, '--source', str(source),
+                       '--work-dir', str(work_dir), '--split-mb', str(args.split_mb)]
+            completed = subprocess.run(command, env=env, capture_output=True, text=True)
+            if completed.returncode != 0:
+                result = {'ok': False, 'error': completed.stderr.strip().splitlines()[-1:] or ["子程序失敗"]}
+            else:
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+            result['path'] = name
+
+            problems = []
+            if not result.get('ok'):
+                problems.append("執行失敗")
+            if result.get('traced_peak', 0) > traced_ceiling:
+                problems.append("tracemalloc 超過上限")
+            if result.get('rss_growth') is not None and result['rss_growth'] > rss_ceiling:
+                problems.append("RSS 超過上限")
+            result['passed'] = not problems
+            result['problems'] = problems
+            failed = failed or bool(problems)
+            results.append(result)
+
+            rss = app.format_file_size(result['rss_growth']) if result.get('rss_growth') is not None else "N/A"
+            status = "✅" if not problems else "❌ " + "、".join(problems)
+            print(f"  {name:>12}: tracemalloc 最高 {app.format_file_size(result.get('traced_peak', 0)):>10}，"
+                  f"RSS 增加 {rss:>10}，{result.get('seconds', 0)} 秒  {status}")
+    finally:
+        server.shutdown()
+        if not args.work_dir:
+            for path in sorted(work_dir.rglob('*'), reverse=True):
+                path.rmdir() if path.is_dir() else path.unlink()
+            work_dir.rmdir()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'block_size': block_size, 'traced_ceiling': traced_ceiling, 'rss_ceiling': rss_ceiling,
+                       'size': int(args.size_gb * 1024 ** 3), 'results': results}, f, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
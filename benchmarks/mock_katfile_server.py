@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本機 KatFile 模擬伺服器
+實作上傳工具會呼叫的 API，可設定延遲、頻寬、錯誤率與 429 比例，
+用來在不連到 katfile.cloud 的情況下做端對端測試與效能量測。
+
+用法：
+    python benchmarks/mock_katfile_server.py --port 8765 --latency 0.05 --bandwidth 50
+    KATFILE_BASE_URL=http://127.0.0.1:8765 python katfile_uploader_enhanced.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, quote
+
+
+class MockConfig:
+    """模擬伺服器的行為設定"""
+
+    def __init__(self, latency=0.0, bandwidth=0.0, error_rate=0.0, rate_limit=0.0, retry_after=0,
+                 seed=None):
+        self.latency = latency          # 每個請求額外延遲（秒）
+        self.bandwidth = bandwidth      # 每個上傳連線的頻寬上限（位元組/秒，0 表示不限）
+        self.error_rate = error_rate    # 回應 HTTP 500 的機率
+        self.rate_limit = rate_limit    # 回應 HTTP 429 的機率
+        self.retry_after = retry_after  # 429 回應的 Retry-After 秒數
+        self.random = random.Random(seed)
+
+
+class MockState:
+    """伺服器端的檔案、資料夾與請求統計"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}     # file_code -> {'name', 'size', 'md5', 'fld_id'}
+        self.folders = {}   # fld_id -> {'fld_id', 'name', 'parent_id'}
+        self.requests = {}  # (端點, HTTP 狀態) -> 次數
+        self.bytes_received = 0
+        self._next_folder = 1
+
+    def count(self, endpoint, status):
+        with self.lock:
+            key = (endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def add_folder(self, name, parent_id=0):
+        with self.lock:
+            fld_id = self._next_folder
+            self._next_folder += 1
+            self.folders[fld_id] = {'fld_id': fld_id, 'name': name, 'parent_id': parent_id}
+            return fld_id
+
+    def stats(self):
+        with self.lock:
+            by_status = {}
+            for (endpoint, status), count in self.requests.items():
+                by_status[str(status)] = by_status.get(str(status), 0) + count
+            return {
+                'files': len(self.files),
+                'bytes_received': self.bytes_received,
+                'requests': sum(self.requests.values()),
+                'by_status': by_status,
+                'by_endpoint': {f"{endpoint} {status}": count
+                                for (endpoint, status), count in sorted(self.requests.items())}
+            }
+
+
+class MockKatFileHandler(BaseHTTPRequestHandler):
+    """KatFile API 的模擬實作"""
+
+    protocol_version = 'HTTP/1.1'
+    UPLOAD_PATH = '/cgi-bin/upload.cgi'
+    READ_BLOCK = 64 * 1024
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    @property
+    def config(self):
+        return self.server.config
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send_json(self, endpoint, payload, status=200, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.state.count(endpoint, status)
+
+    def _inject_fault(self, endpoint):
+        """依設定的機率回應 429 或 500；有回應時回傳 True"""
+        roll = self.config.random.random()
+        if roll < self.config.rate_limit:
+            self._send_json(endpoint, {'msg': 'Too many requests', 'status': 429}, status=429,
+                            headers={'Retry-After': str(self.config.retry_after)})
+            return True
+        if roll < self.config.rate_limit + self.config.error_rate:
+            self._send_json(endpoint, {'msg': 'Internal error', 'status': 500}, status=500)
+            return True
+        return False
+
+    def do_GET(self):
+        if self.config.latency:
+            time.sleep(self.config.latency)
+
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        handler = self.API_ROUTES.get(url.path)
+        if handler is None:
+            self._send_json(url.path, {'msg': 'Not found', 'status': 404}, status=404)
+            return
+        if self._inject_fault(url.path):
+            return
+        if not params.get('key'):
+            self._send_json(url.path, {'msg': 'Invalid key', 'status': 403})
+            return
+        handler(self, params)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != self.UPLOAD_PATH:
+            self.close_connection = True
+            self._send_json(url.path, {'msg': 'Not found', 'status': 404}, status=404)
+            return
+        if self.config.latency:
+            time.sleep(self.config.latency)
+
+        try:
+            name, size, md5 = self._receive_multipart()
+        except ValueError as e:
+            self.close_connection = True
+            self._send_json(url.path, {'msg': str(e), 'status': 400}, status=400)
+            return
+
+        # 錯誤在收完內容後才注入，模擬傳輸完成卻被伺服器拒絕的情況
+        if self._inject_fault(url.path):
+            return
+
+        file_code = uuid.uuid4().hex[:12]
+        with self.state.lock:
+            self.state.files[file_code] = {'name': name, 'size': size, 'md5': md5, 'fld_id': 0}
+        self._send_json(url.path, [{'file_code': file_code, 'file_status': 'OK'}])
+
+    def _receive_multipart(self):
+        """串流接收 multipart 上傳（依設定的頻寬限速），回傳 (檔名, 大小, MD5)"""
+        content_type = self.headers.get('Content-Type', '')
+        length = int(self.headers.get('Content-Length') or 0)
+        if 'boundary=' not in content_type or not length:
+            raise ValueError('需要含 boundary 與 Content-Length 的 multipart 請求')
+        boundary = content_type.split('boundary=', 1)[1].strip().strip('"').encode('ascii')
+        tail_length = len(b'\r\n--' + boundary + b'--\r\n')
+
+        md5 = hashlib.md5()
+        head = b''
+        name = None
+        file_size = None
+        hashed = 0
+        received = 0
+        started = time.monotonic()
+
+        while received < length:
+            chunk = self.rfile.read(min(self.READ_BLOCK, length - received))
+            if not chunk:
+                raise ValueError('上傳內容不完整')
+            received += len(chunk)
+
+            if file_size is None:
+                # 尚未找到檔案欄位的標頭
+                head += chunk
+                marker = head.find(b'filename="')
+                header_end = head.find(b'\r\n\r\n', marker) if marker >= 0 else -1
+                if header_end < 0:
+                    if len(head) > 1024 * 1024:
+                        raise ValueError('找不到檔案欄位')
+                    continue
+                name_end = head.index(b'"', marker + len(b'filename="'))
+                name = head[marker + len(b'filename="'):name_end].decode('utf-8', 'replace')
+                data_start = header_end + 4
+                file_size = length - data_start - tail_length
+                chunk = head[data_start:]
+                head = b''
+
+            data = chunk[:max(0, file_size - hashed)]
+            md5.update(data)
+            hashed += len(data)
+
+            if self.config.bandwidth:
+                ahead = received / self.config.bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+        if file_size is None or file_size < 0:
+            raise ValueError('找不到檔案欄位')
+        with self.state.lock:
+            self.state.bytes_received += received
+        return name, file_size, md5.hexdigest()
+
+    # --- API 端點 ---
+
+    def api_account_info(self, params):
+        with self.state.lock:
+            used = sum(info['size'] for info in self.state.files.values())
+        self._send_json('/api/account/info', {
+            'msg': 'OK', 'status': 200,
+            'result': {'email': 'mock@example.com', 'balance': '0.00', 'premium_expire': '2099-12-31 00:00:00',
+                       'storage_used': used, 'storage_left': 10 * 1024 ** 4 - used}
+        })
+
+    def api_upload_server(self, params):
+        host, port = self.server.server_address[:2]
+        self._send_json('/api/upload/server', {
+            'msg': 'OK', 'status': 200,
+            'result': f"http://{host}:{port}{self.UPLOAD_PATH}",
+            'sess_id': uuid.uuid4().hex
+        })
+
+    def api_set_folder(self, params):
+        file_code = params.get('file_code', '')
+        fld_id = int(params.get('fld_id') or 0)
+        with self.state.lock:
+            info = self.state.files.get(file_code)
+            known_folder = fld_id == 0 or fld_id in self.state.folders
+            if info is not None and known_folder:
+                info['fld_id'] = fld_id
+        if info is None or not known_folder:
+            self._send_json('/api/file/set_folder', {'msg': 'Invalid file or folder', 'status': 404})
+        else:
+            self._send_json('/api/file/set_folder', {'msg': 'OK', 'status': 200})
+
+    def api_direct_link(self, params):
+        file_code = params.get('file_code', '')
+        with self.state.lock:
+            info = self.state.files.get(file_code)
+        if info is None:
+            self._send_json('/api/file/direct_link', {'msg': 'Invalid file code', 'status': 404})
+            return
+        host, port = self.server.server_address[:2]
+        self._send_json('/api/file/direct_link', {
+            'msg': 'OK', 'status': 200,
+            'result': {'url': f"http://{host}:{port}/d/{file_code}/{quote(info['name'])}", 'size': info['size']}
+        })
+
+    def api_file_info(self, params):
+        results = []
+        with self.state.lock:
+            for file_code in params.get('file_code', '').split(','):
+                info = self.state.files.get(file_code)
+                if info is None:
+                    results.append({'filecode': file_code, 'status': 404})
+                else:
+                    results.append({'filecode': file_code, 'status': 200, 'name': info['name'],
+                                    'size': info['size'], 'hash': info['md5']})
+        self._send_json('/api/file/info', {'msg': 'OK', 'status': 200, 'result': results})
+
+    def api_folder_list(self, params):
+        fld_id = int(params.get('fld_id') or 0)
+        with self.state.lock:
+            folders = [dict(folder) for folder in self.state.folders.values() if folder['parent_id'] == fld_id]
+            files = [{'file_code': code, 'name': info['name'], 'size': info['size']}
+                     for code, info in self.state.files.items() if info['fld_id'] == fld_id]
+        self._send_json('/api/folder/list', {'msg': 'OK', 'status': 200,
+                                             'result': {'folders': folders, 'files': files}})
+
+    def api_folder_create(self, params):
+        name = params.get('name', '').strip()
+        if not name:
+            self._send_json('/api/folder/create', {'msg': 'Folder name required', 'status': 400})
+            return
+        fld_id = self.state.add_folder(name, int(params.get('parent_id') or 0))
+        self._send_json('/api/folder/create', {'msg': 'OK', 'status': 200, 'result': {'fld_id': fld_id}})
+
+    API_ROUTES = {
+        '/api/account/info': api_account_info,
+        '/api/upload/server': api_upload_server,
+        '/api/file/set_folder': api_set_folder,
+        '/api/file/direct_link': api_direct_link,
+        '/api/file/info': api_file_info,
+        '/api/folder/list': api_folder_list,
+        '/api/folder/create': api_folder_create,
+    }
+
+
+class MockKatFileServer(ThreadingHTTPServer):
+    """每個連線一個執行緒的模擬伺服器"""
+
+    daemon_threads = True
+
+    def __init__(self, address, config=None, verbose=False):
+        super().__init__(address, MockKatFileHandler)
+        self.config = config or MockConfig()
+        self.state = MockState()
+        self.verbose = verbose
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(config=None, host='127.0.0.1', port=0, verbose=False):
+    """在背景執行緒啟動模擬伺服器（port=0 時自動選擇可用埠），回傳伺服器物件"""
+    server = MockKatFileServer((host, port), config, verbose)
+    threading.Thread(target=server.serve_forever, name="模擬伺服器", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機 KatFile 模擬伺服器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="每個請求的額外延遲（秒）")
+    parser.add_argument('--bandwidth', type=float, default=0.0, help="每個上傳連線的頻寬上限（MB/s，0 表示不限）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="回應 HTTP 500 的機率（0-1）")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="回應 HTTP 429 的機率（0-1）")
+    parser.add_argument('--retry-after', type=int, default=0, help="429 回應的 Retry-After 秒數")
+    parser.add_argument('--seed', type=int, default=None, help="錯誤注入的亂數種子")
+    parser.add_argument('--verbose', action='store_true', help="顯示每個請求")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.bandwidth * 1024 * 1024, args.error_rate, args.rate_limit,
+                        args.retry_after, args.seed)
+    server = MockKatFileServer((args.host, args.port), config, args.verbose)
+    print(f"🧪 模擬伺服器已啟動: {server.base_url}")
+    print(f"   KATFILE_BASE_URL={server.base_url} python katfile_uploader_enhanced.py")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.state.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,20 +12,2782 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import urllib3
 import json
+import socket
+import ssl
+import sys
+import cProfile
+import pstats
+import tracemalloc
+import dis
+import logging
+from logging.handlers import RotatingFileHandler
+import csv
+import sqlite3
+import html
+import io
+import copy
 import os
+import re
+import fnmatch
 import tempfile
 import threading
+import queue
+import heapq
 import time
+from string import Template
 from datetime import datetime
-from urllib.parse import quote
+from collections import deque
+from bisect import bisect_left
+from contextlib import contextmanager
+from urllib.parse import quote, urlencode, urlsplit
 from pathlib import Path
 import zipfile
 import py7zr
-from docx import Document
-from docx.shared import Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml.shared import OxmlElement, qn
+from xml.sax.saxutils import escape as xml_escape, quoteattr
 import shutil
+import hashlib
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# KatFile 網站位址（可用環境變數 KATFILE_BASE_URL 指向本機模擬伺服器做測試或效能量測）
+KATFILE_SITE = os.environ.get('KATFILE_BASE_URL', 'https://katfile.cloud').rstrip('/')
+KATFILE_API = f"{KATFILE_SITE}/api"
+
+# 串流上傳時每次從磁碟讀取的區塊大小（可由網路診斷調整，見 get_upload_block_size）
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
+# 網路診斷時測試的上傳區塊大小與並行數
+PROBE_BLOCK_SIZES = (256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+PROBE_CONCURRENCY = (1, 2, 4, 8)
+# 上傳速度測試每個連線的資料量上限，以及整次測試最多送出的資料量（執行前會顯示並要求確認）
+PROBE_MAX_PAYLOAD = 4 * 1024 * 1024
+PROBE_MAX_TOTAL = 1024 * 1024 + (len(PROBE_BLOCK_SIZES) + sum(PROBE_CONCURRENCY[1:])) * PROBE_MAX_PAYLOAD
+
+# 檔案列表每頁顯示的列數（只建立目前頁面的列，選取大量檔案時介面仍保持流暢）
+FILE_LIST_PAGE_SIZE = 500
+
+# 遠端資料夾節點的快取時間（秒）：展開節點時超過此時間才重新向伺服器查詢子資料夾
+FOLDER_CACHE_TTL = 300
+
+# 校驗不符的遠端檔案會移到根目錄下的這個資料夾，等待手動確認刪除
+QUARANTINE_FOLDER_NAME = "⚠️ 校驗失敗"
+
+# 上傳歷史頁面最多顯示的列數（匯出報告時不受此限制）
+HISTORY_DISPLAY_ROWS = 1000
+
+# 可選的校驗碼演算法（hashlib 名稱 -> 顯示名稱）
+DIGEST_LABELS = {'md5': 'MD5', 'sha256': 'SHA-256'}
+
+
+class MetricsRegistry:
+    """輕量的執行期指標：計數器、量測值、各階段耗時的直方圖、各工作執行緒目前的狀態，以及每秒上傳位元組的滾動序列
+
+    所有方法都可以在任何執行緒呼叫；儀表板定時讀取 snapshot()，批次結束時匯出為
+    Prometheus textfile（prometheus_text）與 JSON 摘要（summary）。
+    """
+
+    # 直方圖的上界（秒），最後一格為 +Inf
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+    def __init__(self, window_seconds=120):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}  # 階段 -> {'buckets', 'sum', 'count', 'max'}
+            self.workers = {}  # 執行緒名稱 -> (狀態, 開始時間)
+            self._bytes = deque(maxlen=self.window_seconds)  # [整數秒, 位元組數]
+            self.started_at = time.time()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, stage, seconds):
+        """記錄一次階段耗時"""
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = {'buckets': [0] * (len(self.BUCKETS) + 1),
+                                                      'sum': 0.0, 'count': 0, 'max': 0.0}
+            histogram['buckets'][bisect_left(self.BUCKETS, seconds)] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+            histogram['max'] = max(histogram['max'], seconds)
+
+    @contextmanager
+    def timed(self, stage):
+        """量測 with 區塊的耗時（發生例外時也會記錄）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def add_bytes(self, nbytes, name='upload_bytes'):
+        """記錄已送出的上傳位元組（計入總量與每秒序列）"""
+        second = int(time.time())
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + nbytes
+            if self._bytes and self._bytes[-1][0] == second:
+                self._bytes[-1][1] += nbytes
+            else:
+                self._bytes.append([second, nbytes])
+
+    def set_state(self, state, name=None):
+        """設定目前執行緒（或指定名稱的工作）的狀態；state 為 None 時移除"""
+        name = name or threading.current_thread().name
+        with self._lock:
+            if state is None:
+                self.workers.pop(name, None)
+            else:
+                self.workers[name] = (state, time.time())
+
+    @contextmanager
+    def stage(self, state):
+        """在 with 區塊內把目前執行緒標記為 state，結束後恢復原本的狀態"""
+        name = threading.current_thread().name
+        with self._lock:
+            previous = self.workers.get(name)
+        self.set_state(state)
+        try:
+            yield
+        finally:
+            with self._lock:
+                if previous is None:
+                    self.workers.pop(name, None)
+                else:
+                    self.workers[name] = previous
+
+    def throughput_series(self, seconds=60):
+        """最近 seconds 秒每秒的上傳速度（MB/s），最舊的在前"""
+        now = int(time.time())
+        with self._lock:
+            by_second = {second: nbytes for second, nbytes in self._bytes}
+        # 目前這一秒尚未結束，不列入
+        return [by_second.get(second, 0) / (1024 * 1024) for second in range(now - seconds, now)]
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {stage: dict(histogram, buckets=list(histogram['buckets']))
+                               for stage, histogram in self.histograms.items()},
+                'workers': {name: (state, now - since) for name, (state, since) in self.workers.items()},
+                'uptime': now - self.started_at
+            }
+
+    def _quantile(self, histogram, q):
+        """由直方圖估計分位數（取所在區間的上界，不超過最大值）"""
+        target = q * histogram['count']
+        cumulative = 0
+        for bound, count in zip(self.BUCKETS + (histogram['max'],), histogram['buckets']):
+            cumulative += count
+            if cumulative >= target:
+                return min(bound, histogram['max'])
+        return histogram['max']
+
+    def summary(self):
+        """JSON 摘要：計數器、量測值與各階段的次數、總耗時、平均、p50／p95 與最大值"""
+        snapshot = self.snapshot()
+        stages = {}
+        for stage, histogram in sorted(snapshot['histograms'].items()):
+            count = histogram['count']
+            stages[stage] = {
+                'count': count,
+                'total_seconds': round(histogram['sum'], 4),
+                'avg_seconds': round(histogram['sum'] / count, 4) if count else 0.0,
+                'p50_seconds': round(self._quantile(histogram, 0.5), 4),
+                'p95_seconds': round(self._quantile(histogram, 0.95), 4),
+                'max_seconds': round(histogram['max'], 4)
+            }
+        return {
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'uptime_seconds': round(snapshot['uptime'], 3),
+            'counters': snapshot['counters'],
+            'gauges': snapshot['gauges'],
+            'stages': stages
+        }
+
+    def prometheus_text(self, prefix='katfile_uploader'):
+        """Prometheus textfile 格式（供 node_exporter 的 textfile collector 讀取）"""
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Duration of each upload pipeline stage.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(snapshot['histograms'].items()):
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + ('+Inf',), histogram['buckets']):
+                cumulative += count
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+
+        lines.append(f"# TYPE {prefix}_batch_timestamp_seconds gauge")
+        lines.append(f"{prefix}_batch_timestamp_seconds {time.time():.0f}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+
+class StreamDigests:
+    """在資料串流經過時計算雜湊值；只接受從頭開始的循序資料，倒回開頭時自動重算"""
+
+    def __init__(self, names=()):
+        self.names = tuple(names)
+        self.reset()
+
+    def reset(self):
+        self._hashers = {name: hashlib.new(name) for name in self.names}
+        self.hashed = 0
+
+    def update_at(self, offset, data):
+        """offset 為這段資料在串流中的位置；非循序的資料會被忽略"""
+        if self._hashers and offset == self.hashed:
+            for hasher in self._hashers.values():
+                hasher.update(data)
+            self.hashed += len(data)
+
+    def rewind_to(self, offset):
+        """串流被倒回已計算過的位置時重設"""
+        if offset < self.hashed:
+            self.reset()
+
+    def hexdigests(self, expected_size):
+        """取得雜湊值（僅在整個串流都已讀取時有效）"""
+        if not self._hashers or self.hashed != expected_size:
+            return {}
+        return {name: hasher.hexdigest() for name, hasher in self._hashers.items()}
+
+
+class HashingReader(io.BufferedIOBase):
+    """讀取時同時計算雜湊值的檔案包裝（壓縮時用來取得原檔雜湊，不必再讀一次）"""
+
+    def __init__(self, path, digests=()):
+        super().__init__()
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self.digests = StreamDigests(digests)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        offset = self._file.tell()
+        data = self._file.read(size)
+        self.digests.update_at(offset, data)
+        return data
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        result = self._file.seek(pos, whence)
+        self.digests.rewind_to(result)
+        return result
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+    def hexdigests(self):
+        return self.digests.hexdigests(self.size)
+
+
+def format_checksums(checksums):
+    """將校驗碼整理成多行文字；checksums 為 [{'name': 檔名, 'md5': ..., 'sha256': ...}, ...]"""
+    lines = []
+    for entry in checksums or []:
+        for name, label in DIGEST_LABELS.items():
+            if entry.get(name):
+                prefix = f"{entry['name']} " if len(checksums) > 1 else ""
+                lines.append(f"{prefix}{label}: {entry[name]}")
+    return "\n".join(lines)
+
+
+class ByteRangeReader:
+    """原始檔案中某一段位元組範圍的唯讀視圖（可定位，不產生暫存檔）"""
+
+    def __init__(self, path, offset=0, length=None):
+        self.path = str(path)
+        self._file = open(self.path, 'rb')
+        file_size = os.fstat(self._file.fileno()).st_size
+        self.offset = min(offset, file_size)
+        available = file_size - self.offset
+        self.length = available if length is None else min(length, available)
+        self._pos = 0
+
+    def __len__(self):
+        return self.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, size=-1):
+        remaining = self.length - self._pos
+        if remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        self._file.seek(self.offset + self._pos)
+        data = self._file.read(size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self._pos
+        elif whence == os.SEEK_END:
+            pos += self.length
+        self._pos = max(0, min(pos, self.length))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._file.close()
+
+
+class MultipartFileStream:
+    """以串流方式產生 multipart/form-data 上傳內容，檔案不需整個載入記憶體
+
+    上傳的同時計算指定的雜湊值；若請求被重送而倒回開頭，雜湊會自動重新計算。
+    以 as_body() 交給 requests，每次送到 socket 的大小才是 block_size。
+    """
+
+    def __init__(self, fields, file_field, filename, fileobj, size,
+                 content_type='application/octet-stream', digests=(), block_size=UPLOAD_BLOCK_SIZE, on_read=None):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+
+        head = b''.join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+            for name, value in fields.items()
+        )
+        safe_name = filename.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+        head += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{safe_name}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+        self._head = head
+        self._tail = tail
+        self._file = fileobj
+        self._file_size = size
+        self._file_start = len(head)
+        self._file_end = len(head) + size
+        self._length = self._file_end + len(tail)
+        self._pos = 0
+        self._block_size = block_size
+        self._buffer = b''
+        self._buffer_start = 0
+        self._on_read = on_read
+
+        self.digests = StreamDigests(digests)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self._block_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self._pos
+        elif whence == os.SEEK_END:
+            pos += self._length
+        self._pos = max(0, min(pos, self._length))
+        self.digests.rewind_to(self._pos - self._file_start)
+        return self._pos
+
+    def _read_file(self, offset, size):
+        """從檔案區段讀取資料（以 block_size 為單位向磁碟讀取）"""
+        buffer_offset = offset - self._buffer_start
+        if not 0 <= buffer_offset < len(self._buffer):
+            self._file.seek(offset)
+            self._buffer = self._file.read(max(self._block_size, size))
+            self._buffer_start = offset
+            buffer_offset = 0
+            if not self._buffer:
+                raise IOError("檔案在上傳過程中被截斷")
+        data = self._buffer[buffer_offset:buffer_offset + size]
+
+        # 只在循序讀取時更新雜湊，避免重送時重複計算
+        self.digests.update_at(offset, data)
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length - self._pos
+        chunks = []
+        while size > 0 and self._pos < self._length:
+            if self._pos < self._file_start:
+                data = self._head[self._pos:self._pos + size]
+            elif self._pos < self._file_end:
+                want = min(size, self._file_end - self._pos)
+                data = self._read_file(self._pos - self._file_start, want)
+            else:
+                tail_pos = self._pos - self._file_end
+                data = self._tail[tail_pos:tail_pos + size]
+            chunks.append(data)
+            self._pos += len(data)
+            size -= len(data)
+        result = b''.join(chunks)
+        if self._on_read and result:
+            self._on_read(len(result))
+        return result
+
+    def hexdigests(self):
+        """取得上傳內容的雜湊值（僅在整個檔案都已送出時有效）"""
+        return self.digests.hexdigests(self._file_size)
+
+    def as_body(self):
+        """作為請求內容：urllib3 遇到有 read() 的物件會自行以 16 KB 讀取送出，改用迭代才會以 block_size 寫入 socket"""
+        return _BlockBody(self)
+
+
+class _BlockBody:
+    """MultipartFileStream 的可迭代檢視（不提供 read）；保留長度與 seek/tell，重送時仍能倒回"""
+
+    __slots__ = ('_stream',)
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __len__(self):
+        return len(self._stream)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def tell(self):
+        return self._stream.tell()
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        return self._stream.seek(pos, whence)
+
+
+def format_file_size(size):
+    """格式化檔案大小"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} TB"
+
+
+class FileEntry:
+    """一個要上傳的檔案；上傳後的雜湊、檔案代碼與位元組數也記在同一個物件上，各階段共用不另複製"""
+
+    __slots__ = ('path', 'name', 'size', 'digests', 'source_digests', 'file_code', 'bytes_sent', 'server_size')
+
+    def __init__(self, path, name, size):
+        self.path = path
+        self.name = name
+        self.size = size
+        self.digests = {}
+        self.source_digests = {}
+        self.file_code = None
+        self.bytes_sent = None
+        self.server_size = None
+
+    @classmethod
+    def from_path(cls, path, name=None):
+        path = str(path)
+        return cls(path, name or os.path.basename(path), os.path.getsize(path))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.path!r}, {self.name!r}, {self.size})"
+
+
+class FilePart(FileEntry):
+    """原檔案中的一段位元組範圍（虛擬分割）"""
+
+    __slots__ = ('offset', 'part')
+
+    def __init__(self, path, name, size, offset, part):
+        super().__init__(path, name, size)
+        self.offset = offset
+        self.part = part
+
+
+class UploadResult:
+    """一個原檔案的上傳結果；大小與時間保存原始值，顯示時才格式化"""
+
+    __slots__ = ('name', 'size', 'uploaded_at', 'status', 'download_links', 'checksums', 'source_checksums',
+                 'record_job', 'history_id')
+
+    def __init__(self, name, size, status, download_links=(), checksums=None, source_checksums=None,
+                 uploaded_at=None):
+        self.name = name
+        self.size = size
+        self.uploaded_at = time.time() if uploaded_at is None else uploaded_at
+        self.status = status
+        self.download_links = list(download_links)
+        self.checksums = checksums or []
+        self.source_checksums = source_checksums or {}
+        self.record_job = None
+        self.history_id = None
+
+    @property
+    def filesize(self):
+        return format_file_size(self.size)
+
+    @property
+    def upload_time(self):
+        return datetime.fromtimestamp(self.uploaded_at).strftime('%Y-%m-%d %H:%M:%S')
+
+    @property
+    def download_link(self):
+        """顯示用的下載連結（多個分割時顯示數量）"""
+        if len(self.download_links) == 1:
+            return self.download_links[0]
+        if self.download_links:
+            return f"{len(self.download_links)} 個分割檔案"
+        return 'N/A'
+
+
+def plan_virtual_parts(file_path, part_size):
+    """依分割大小規劃虛擬分割檔案（每個分割只是原始檔案的位元組範圍）"""
+    file_path = Path(file_path)
+    file_size = file_path.stat().st_size
+    parts = []
+    offset = 0
+    index = 1
+    while offset < file_size:
+        length = min(part_size, file_size - offset)
+        parts.append(FilePart(str(file_path), f"{file_path.name}.part{index:03d}", length, offset, index))
+        offset += length
+        index += 1
+    return parts
+
+
+def write_parts_manifest(file_info, parts, download_links, part_size):
+    """寫入分割清單（記錄各分割的位移與雜湊，供下載後重組）"""
+    source = Path(file_info.path)
+    manifest = {
+        'source': source.name,
+        'size': sum(part.size for part in parts),
+        'part_size': part_size,
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'parts': [
+            {
+                'index': part.part,
+                'name': part.name,
+                'offset': part.offset,
+                'length': part.size,
+                'sha256': part.digests.get('sha256', ''),
+                'download_link': link
+            }
+            for part, link in zip(parts, download_links)
+        ]
+    }
+    manifest_path = source.parent / f"{source.name}.parts.json"
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest_path
+
+
+def process_alive(pid):
+    """檢查指定PID的程序是否仍在執行"""
+    if pid <= 0:
+        return False
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ScratchLease:
+    """一筆暫存空間配額（對應一個專用的暫存子目錄）"""
+
+    def __init__(self, manager, directory, nbytes):
+        self.manager = manager
+        self.directory = directory
+        self.nbytes = nbytes
+        self.released = False
+
+    def resize(self, nbytes):
+        """依實際佔用調整配額（例如壓縮完成、分割暫存檔刪除後）"""
+        self.manager._resize(self, nbytes)
+
+    def release(self):
+        """刪除暫存子目錄並歸還配額"""
+        self.manager._release(self)
+
+
+class ScratchSpaceManager:
+    """暫存空間管理：可設定位置與容量上限，空間不足時暫停新的壓縮工作直到先前的檔案被釋放"""
+
+    SESSION_PREFIX = "session-"
+    OWNER_FILE = "owner.pid"
+
+    def __init__(self, root_dir, quota_bytes, min_free_bytes=256 * 1024 * 1024, reclaim=None):
+        self.root_dir = Path(root_dir)
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        # reclaim(nbytes)：磁碟空間不足時請同一目錄下的壓縮檔快取淘汰項目，回傳是否有釋放
+        self.reclaim = reclaim
+        self.session_dir = None
+        self._reserved = 0
+        self._lease_count = 0
+        self._cond = threading.Condition()
+        METRICS.set_gauge('scratch_quota', quota_bytes)
+        METRICS.set_gauge('scratch_reserved', 0)
+
+    @property
+    def reserved_bytes(self):
+        return self._reserved
+
+    def cleanup_stale_sessions(self):
+        """清除已結束（或當機）的程序遺留的工作階段目錄，回傳釋放的位元組數
+
+        只刪除本管理器建立的 session-* 目錄（含 owner.pid）；暫存目錄可由使用者指定，
+        其中的其他檔案與資料夾一律不動。
+        """
+        if not self.root_dir.exists():
+            return 0
+
+        freed = 0
+        for entry in self.root_dir.iterdir():
+            if not entry.is_dir() or entry.is_symlink() or not entry.name.startswith(self.SESSION_PREFIX):
+                continue
+            try:
+                pid = int((entry / self.OWNER_FILE).read_text().strip())
+            except (OSError, ValueError):
+                # 沒有 owner.pid 的目錄不是由本程式建立的
+                continue
+            if pid != os.getpid() and process_alive(pid):
+                continue
+            freed += self._tree_size(entry)
+            shutil.rmtree(entry, ignore_errors=True)
+        return freed
+
+    def open_session(self):
+        """建立本次上傳的工作階段目錄"""
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.session_dir = self.root_dir / f"{self.SESSION_PREFIX}{os.getpid()}-{stamp}"
+        self.session_dir.mkdir(exist_ok=True)
+        (self.session_dir / self.OWNER_FILE).write_text(str(os.getpid()))
+        return self.session_dir
+
+    def close_session(self):
+        """刪除工作階段目錄（包含尚未釋放的暫存檔）"""
+        with self._cond:
+            if self.session_dir is not None:
+                shutil.rmtree(self.session_dir, ignore_errors=True)
+                self.session_dir = None
+            self._reserved = 0
+            self._cond.notify_all()
+
+    def _free_disk_bytes(self):
+        try:
+            return shutil.disk_usage(self.root_dir).free
+        except OSError:
+            return 0
+
+    def _has_free_space(self, nbytes):
+        if self._free_disk_bytes() - nbytes >= self.min_free_bytes:
+            return True
+        if self.reclaim is not None and self.reclaim(nbytes):
+            return self._free_disk_bytes() - nbytes >= self.min_free_bytes
+        return False
+
+    def _admissible(self, nbytes):
+        if self._reserved == 0:
+            # 沒有其他暫存檔時一定放行，避免單一超大檔案永遠等待
+            return True
+        if self._reserved + nbytes > self.quota_bytes:
+            return False
+        return self._has_free_space(nbytes)
+
+    def reserve(self, nbytes, should_continue=lambda: True):
+        """申請暫存空間；配額不足時阻塞等待，若 should_continue() 變為 False 則回傳 None"""
+        with self._cond:
+            while not self._admissible(nbytes):
+                if not should_continue():
+                    return None
+                self._cond.wait(timeout=1.0)
+
+            if self._reserved == 0 and not self._has_free_space(nbytes):
+                raise OSError(f"暫存空間不足：{self.root_dir} 可用空間少於所需的 {nbytes} 位元組")
+
+            self._reserved += nbytes
+            self._lease_count += 1
+            METRICS.set_gauge('scratch_reserved', self._reserved)
+            directory = self.session_dir / f"job{self._lease_count:05d}"
+
+        directory.mkdir(parents=True, exist_ok=True)
+        return ScratchLease(self, directory, nbytes)
+
+    def _resize(self, lease, nbytes):
+        with self._cond:
+            if lease.released:
+                return
+            self._reserved += nbytes - lease.nbytes
+            lease.nbytes = nbytes
+            METRICS.set_gauge('scratch_reserved', self._reserved)
+            self._cond.notify_all()
+
+    def _release(self, lease):
+        with self._cond:
+            if lease.released:
+                return
+            lease.released = True
+            self._reserved = max(0, self._reserved - lease.nbytes)
+            METRICS.set_gauge('scratch_reserved', self._reserved)
+            self._cond.notify_all()
+        shutil.rmtree(lease.directory, ignore_errors=True)
+
+    @staticmethod
+    def _tree_size(path):
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, name))
+                except OSError:
+                    pass
+        return total
+
+
+class CachedArchive:
+    """快取中的壓縮檔（使用期間不會被淘汰）"""
+
+    def __init__(self, cache, key, files):
+        self.cache = cache
+        self.key = key
+        self.files = files
+        self.released = False
+
+    def release(self):
+        """結束使用（檔案保留在快取中）"""
+        if not self.released:
+            self.released = True
+            self.cache._unpin(self.key)
+
+
+class ArchiveCache:
+    """已完成壓縮檔的磁碟快取：以來源檔案與壓縮設定為鍵，依容量上限做 LRU 淘汰
+
+    除了容量上限，磁碟可用空間低於 min_free_bytes 時也會淘汰（快取與暫存檔位於同一個暫存目錄）。
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, root_dir, budget_bytes, min_free_bytes=256 * 1024 * 1024):
+        self.root_dir = Path(root_dir)
+        self.budget_bytes = budget_bytes
+        self.min_free_bytes = min_free_bytes
+        self._lock = threading.Lock()
+        self._pins = {}
+        self._entries = self._load_index()
+
+    @staticmethod
+    def make_key(source_path, archive_format, level, password, split_bytes):
+        """以（來源路徑、大小、修改時間、格式、等級、密碼雜湊、分割大小）產生快取鍵"""
+        source_path = Path(source_path).resolve()
+        stat = source_path.stat()
+        password_hash = hashlib.sha256(password.encode('utf-8')).hexdigest() if password else ''
+        material = json.dumps([
+            str(source_path), stat.st_size, stat.st_mtime_ns,
+            archive_format, level, password_hash, split_bytes
+        ])
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()[:32]
+
+    def _load_index(self):
+        try:
+            with open(self.root_dir / self.INDEX_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        index_path = self.root_dir / self.INDEX_FILE
+        tmp_path = index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, ensure_ascii=False)
+        os.replace(tmp_path, index_path)
+
+    @property
+    def used_bytes(self):
+        return sum(entry['size'] for entry in self._entries.values())
+
+    def lookup(self, key):
+        """查詢快取；命中時回傳 CachedArchive（已釘選），否則回傳 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry_dir = self.root_dir / key
+            files = [str(entry_dir / name) for name in entry['files']]
+            if not all(os.path.exists(path) for path in files):
+                # 快取檔案已被外部刪除
+                self._drop(key)
+                self._save_index()
+                return None
+            # last_used 只記在記憶體，淘汰或 close() 時才寫回索引
+            entry['last_used'] = time.time()
+            self._pins[key] = self._pins.get(key, 0) + 1
+            return CachedArchive(self, key, files)
+
+    def store(self, key, files, metadata=None):
+        """將剛壓縮完成的檔案移入快取，回傳 CachedArchive（已釘選）"""
+        entry_dir = self.root_dir / key
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            entry_dir.mkdir(parents=True, exist_ok=True)
+            names = []
+            total = 0
+            for path in files:
+                target = entry_dir / Path(path).name
+                shutil.move(str(path), str(target))
+                names.append(target.name)
+                total += target.stat().st_size
+            self._entries[key] = {
+                'files': names,
+                'size': total,
+                'last_used': time.time(),
+                'metadata': metadata or {}
+            }
+            self._pins[key] = self._pins.get(key, 0) + 1
+            self._evict()
+            self._save_index()
+            return CachedArchive(self, key, [str(entry_dir / name) for name in names])
+
+    def metadata(self, key):
+        """取得快取項目附帶的資訊"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return dict(entry.get('metadata', {})) if entry else {}
+
+    def _unpin(self, key):
+        with self._lock:
+            count = self._pins.get(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+            else:
+                self._pins.pop(key, None)
+            if self._evict():
+                self._save_index()
+
+    def reclaim(self, nbytes):
+        """淘汰未使用的項目，直到磁碟可用空間足以再寫入 nbytes（供暫存空間管理呼叫），回傳是否有釋放"""
+        with self._lock:
+            freed = self._evict(nbytes)
+            if freed:
+                self._save_index()
+            return freed
+
+    def close(self):
+        """把記憶體中的使用時間寫回索引"""
+        with self._lock:
+            if self._entries:
+                self._save_index()
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        shutil.rmtree(self.root_dir / key, ignore_errors=True)
+
+    def _free_disk_bytes(self):
+        try:
+            return shutil.disk_usage(self.root_dir).free
+        except OSError:
+            return None
+
+    def _evict(self, extra_bytes=0):
+        """超過容量上限或磁碟可用空間不足時，從最久未使用且未被釘選的項目開始淘汰；回傳是否有淘汰"""
+        used = self.used_bytes
+        free = self._free_disk_bytes()
+        floor = self.min_free_bytes + extra_bytes
+
+        def over():
+            return used > self.budget_bytes or (free is not None and free < floor)
+
+        if not over():
+            return False
+        evicted = False
+        for key in sorted(self._entries, key=lambda k: self._entries[k]['last_used']):
+            if not over():
+                break
+            if key in self._pins:
+                continue
+            size = self._entries[key]['size']
+            used -= size
+            if free is not None:
+                free += size
+            self._drop(key)
+            evicted = True
+        return evicted
+
+
+def parse_server_size(value):
+    """伺服器回報的檔案大小轉為整數；缺少或不是數字時回傳 None（大小未知，不可當成 0 比對）"""
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+class UploadVerifier:
+    """上傳後完整性校驗：在背景批次查詢伺服器上的檔案資訊，比對大小（及伺服器提供的雜湊）
+
+    fetch_info(file_codes) 回傳 {file_code: info}；每筆校驗完成時呼叫
+    on_result(item, status, detail)，status 為 'ok'、'mismatch' 或 'unknown'。
+    伺服器尚無檔案資訊時，以遞增的間隔（retry_delay、2 倍、4 倍…）重新查詢。
+    耗時的後續處理（重新上傳）以 run_async() 交給工作池，不會擋住其他檔案的校驗。
+    """
+
+    def __init__(self, fetch_info, on_result, batch_size=20, max_wait=2.0, max_checks=4, retry_delay=3.0,
+                 workers=2):
+        self._fetch_info = fetch_info
+        self._on_result = on_result
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_checks = max_checks
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue()
+        self._delayed = []  # (not_before, 序號, item)，只在校驗執行緒中存取
+        self._delayed_count = 0
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="重新上傳")
+        self._thread = threading.Thread(target=self._run, name="校驗", daemon=True)
+        self._thread.start()
+        METRICS.set_gauge('queue_verify', 0)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def submit(self, item):
+        """加入待校驗項目（需包含 file_code 與 expected_size）"""
+        with self._cond:
+            self._pending += 1
+            METRICS.set_gauge('queue_verify', self._pending)
+        self._queue.put(item)
+
+    def wait_idle(self, timeout=None):
+        """等待所有項目校驗完成（包含校驗失敗後重新上傳的項目）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(0.5 if remaining is None else min(0.5, remaining))
+        return True
+
+    def run_async(self, fn, *args):
+        """在工作池執行耗時的處理（例如重新上傳）；完成前 wait_idle() 不會返回"""
+        with self._cond:
+            self._pending += 1
+        future = self._pool.submit(fn, *args)
+        future.add_done_callback(lambda _: self._done())
+
+    def _done(self):
+        with self._cond:
+            self._pending -= 1
+            METRICS.set_gauge('queue_verify', self._pending)
+            self._cond.notify_all()
+
+    def stop(self):
+        self._queue.put(None)
+        self._pool.shutdown(wait=False)
+
+    def _take_due(self, batch):
+        """把已到重新查詢時間的項目加入批次"""
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now and len(batch) < self.batch_size:
+            batch.append(heapq.heappop(self._delayed)[2])
+
+    def _run(self):
+        running = True
+        while running:
+            batch = []
+            self._take_due(batch)
+            if not batch:
+                timeout = max(0.0, self._delayed[0][0] - time.monotonic()) if self._delayed else None
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    break
+                batch.append(item)
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self._take_due(batch)
+            with METRICS.stage("校驗中"):
+                self._verify_batch(batch)
+
+    def _verify_batch(self, batch):
+        try:
+            with METRICS.timed('verify_fetch'):
+                infos = self._fetch_info([item['file_code'] for item in batch])
+        except Exception:
+            infos = None
+
+        for item in batch:
+            info = infos.get(item['file_code']) if infos else None
+            if info is None:
+                item['checks'] = item.get('checks', 0) + 1
+                if item['checks'] < self.max_checks:
+                    # 伺服器可能尚未完成處理，間隔加倍後再查
+                    not_before = time.monotonic() + self.retry_delay * 2 ** (item['checks'] - 1)
+                    self._delayed_count += 1
+                    heapq.heappush(self._delayed, (not_before, self._delayed_count, item))
+                    continue
+                # 查不到檔案資訊時退回使用上傳時 direct_link 回報的大小
+                if item.get('server_size') is not None:
+                    info = {'size': item['server_size']}
+
+            if info is None:
+                status, detail = 'unknown', "無法取得伺服器檔案資訊"
+            else:
+                detail = self.compare(item, info)
+                status = 'mismatch' if detail else 'ok'
+            if status == 'mismatch':
+                METRICS.inc('verify_mismatches')
+
+            try:
+                self._on_result(item, status, detail)
+            finally:
+                self._done()
+
+    @staticmethod
+    def compare(item, info):
+        """比對本機與伺服器的檔案資訊，不符時回傳說明文字"""
+        size = parse_server_size(info.get('size'))
+        if size is not None and size != item['expected_size']:
+            return f"大小不符（伺服器 {size} 位元組，本機 {item['expected_size']} 位元組）"
+
+        local_digests = item.get('digests', {})
+        for name, label in DIGEST_LABELS.items():
+            remote = info.get(name) or (info.get('hash') if name == 'md5' else None)
+            local = local_digests.get(name)
+            if remote and local and str(remote).lower() != local.lower():
+                return f"{label} 不符"
+        return None
+
+
+HYPERLINK_RELTYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink"
+
+
+def build_hyperlink(part, url, text):
+    """建立超連結元素（藍色底線文字），呼叫端負責放到段落中的位置"""
+    from docx.oxml.shared import OxmlElement, qn
+    
+    hyperlink = OxmlElement('w:hyperlink')
+    hyperlink.set(qn('r:id'), part.relate_to(url, HYPERLINK_RELTYPE, is_external=True))
+    
+    run = OxmlElement('w:r')
+    rPr = OxmlElement('w:rPr')
+    color = OxmlElement('w:color')
+    color.set(qn('w:val'), '0000FF')  # 藍色
+    underline = OxmlElement('w:u')
+    underline.set(qn('w:val'), 'single')
+    rPr.append(color)
+    rPr.append(underline)
+    run.append(rPr)
+    
+    text_elem = OxmlElement('w:t')
+    text_elem.text = text
+    run.append(text_elem)
+    
+    hyperlink.append(run)
+    return hyperlink
+
+
+class TemplatePlaceholderIndex:
+    """Word範本的預留位置索引
+
+    範本只掃描一次，記錄每個 {欄位} 所在段落的路徑以及起訖的 run 與字元位置
+    （可跨越多個 run）。填入時直接依路徑找到段落，只修改涉及的 run，
+    成本與預留位置數量成正比，而不是與文件大小成正比。
+    """
+
+    PATTERN = re.compile(r'\{([^{}\r\n]+)\}')
+    LINK_KEY = "檔案名稱+網址的超連結"
+
+    def __init__(self, document):
+        from docx.oxml.shared import qn
+        self.entries = []
+        body = document.element.body
+        for paragraph in body.iter(qn('w:p')):
+            runs = [child for child in paragraph if child.tag == qn('w:r')]
+            texts = [self._run_text(run) for run in runs]
+            full_text = ''.join(texts)
+            if '{' not in full_text:
+                continue
+
+            # 字元位置 -> (run 索引, run 內位置)
+            starts = []
+            position = 0
+            for text in texts:
+                starts.append(position)
+                position += len(text)
+
+            def locate(offset, is_end):
+                for n in range(len(texts) - 1, -1, -1):
+                    if starts[n] < offset or (not is_end and starts[n] == offset and texts[n]):
+                        return n, offset - starts[n]
+                return 0, offset
+
+            locations = []
+            for match in self.PATTERN.finditer(full_text):
+                start_run, start_offset = locate(match.start(), False)
+                end_run, end_offset = locate(match.end(), True)
+                locations.append((match.group(1), start_run, start_offset, end_run, end_offset))
+            if locations:
+                self.entries.append((self._element_path(body, paragraph), locations))
+
+    def __len__(self):
+        return sum(len(locations) for _, locations in self.entries)
+
+    @staticmethod
+    def _run_text(run):
+        from docx.oxml.shared import qn
+        return ''.join(t.text or '' for t in run.iter(qn('w:t')))
+
+    @staticmethod
+    def _set_run_text(run, text):
+        from docx.oxml.shared import OxmlElement, qn
+        text_elements = list(run.iter(qn('w:t')))
+        if not text_elements:
+            text_elements = [OxmlElement('w:t')]
+            run.append(text_elements[0])
+        text_elements[0].text = text
+        text_elements[0].set('{http://www.w3.org/XML/1998/namespace}space', 'preserve')
+        for extra in text_elements[1:]:
+            extra.getparent().remove(extra)
+
+    @staticmethod
+    def _element_path(root, element):
+        path = []
+        while element is not root:
+            parent = element.getparent()
+            path.append(parent.index(element))
+            element = parent
+        return tuple(reversed(path))
+
+    @staticmethod
+    def _resolve(root, path):
+        element = root
+        for position in path:
+            element = element[position]
+        return element
+
+    def fill(self, document, values, links=()):
+        """把欄位值填入 document（必須是建立索引的範本的副本）
+
+        values 為 {欄位名稱: 文字}；{檔案名稱+網址的超連結} 會以 links 中的
+        (顯示文字, 網址) 插入超連結。索引中未知的欄位保持原樣。
+        """
+        from docx.oxml.shared import OxmlElement, qn
+        body = document.element.body
+        part = document.part
+        for path, locations in self.entries:
+            paragraph = self._resolve(body, path)
+            runs = [child for child in paragraph if child.tag == qn('w:r')]
+
+            # 由後往前處理，前面的位置不會因替換而改變
+            for key, start_run, start_offset, end_run, end_offset in reversed(locations):
+                if key != self.LINK_KEY and key not in values:
+                    continue
+
+                first = runs[start_run]
+                last = runs[end_run]
+                prefix = self._run_text(first)[:start_offset]
+                suffix = self._run_text(last)[end_offset:]
+                for middle in runs[start_run + 1:end_run]:
+                    self._set_run_text(middle, '')
+
+                if key == self.LINK_KEY:
+                    self._set_run_text(first, prefix)
+                    if end_run == start_run:
+                        last = copy.deepcopy(first)
+                        first.addnext(last)
+                    self._set_run_text(last, suffix)
+
+                    anchor = first
+                    for n, (text, url) in enumerate(links):
+                        if n:
+                            line_break = OxmlElement('w:r')
+                            line_break.append(OxmlElement('w:br'))
+                            anchor.addnext(line_break)
+                            anchor = line_break
+                        hyperlink = build_hyperlink(part, url, text)
+                        anchor.addnext(hyperlink)
+                        anchor = hyperlink
+                elif end_run == start_run:
+                    self._set_run_text(first, prefix + values[key] + suffix)
+                else:
+                    self._set_run_text(first, prefix + values[key])
+                    self._set_run_text(last, suffix)
+
+
+class WordTemplateCache:
+    """Word範本快取：每個範本只開啟並解析一次，之後以記憶體中的副本產生每份文件
+
+    範本檔案的修改時間改變時會自動重新載入；path 為 None 時快取 python-docx 的預設空白文件。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _entry(self, path):
+        from docx import Document
+        mtime = os.stat(path).st_mtime_ns if path else None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry['mtime'] != mtime:
+                entry = {'mtime': mtime, 'document': Document(path), 'index': None}
+                self._entries[path] = entry
+            return entry
+
+    def new_document(self, path=None):
+        """取得範本的獨立副本（修改副本不會影響快取中的範本）"""
+        entry = self._entry(path)
+        with self._lock:
+            return copy.deepcopy(entry['document'])
+
+    def placeholders(self, path):
+        """取得範本的預留位置索引（與範本一起快取）"""
+        entry = self._entry(path)
+        with self._lock:
+            if entry['index'] is None:
+                entry['index'] = TemplatePlaceholderIndex(entry['document'])
+            return entry['index']
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+WORD_TEMPLATE_CACHE = WordTemplateCache()
+
+
+def add_hyperlink(paragraph, url, text):
+    """在段落末尾添加超連結，失敗時改用藍色文字"""
+    from docx.shared import RGBColor
+    try:
+        paragraph._p.append(build_hyperlink(paragraph.part, url, text))
+        return True
+    except Exception as e:
+        print(f"建立超連結失敗: {e}")
+        run = paragraph.add_run(text)
+        run.font.color.rgb = RGBColor(0, 0, 255)
+        return False
+
+
+def build_builtin_record(doc, job):
+    """以內建範本格式填寫記錄文件"""
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    
+    # 建立標題
+    title = doc.add_heading(f"{job['title_name']}@MP4@KF@無碼", level=1)
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    
+    # 添加空行
+    doc.add_paragraph()
+    
+    # 建立資訊表格
+    table = doc.add_table(rows=6, cols=2)
+    table.style = 'Table Grid'
+    
+    rows = [
+        ("【影片名稱】", f"：{job['record_name']}"),
+        ("【影片格式】", "：MP4"),
+        ("【影片大小】", f"：{job['size_text']}"),
+        ("【影片說明】", "：無碼"),
+        ("【解壓密碼】", f"：{job['password']}"),
+    ]
+    for row, (label, value) in zip(table.rows, rows):
+        row.cells[0].text = label
+        row.cells[1].text = value
+    
+    cells = table.rows[5].cells
+    cells[0].text = "【影片載點】"
+    # 添加超連結（分割檔案時每個分割一行）
+    paragraph = cells[1].paragraphs[0]
+    paragraph.text = "："
+    for i, (file_name, download_link) in enumerate(zip(job['file_names'], job['links'])):
+        if i > 0:
+            paragraph.add_run("\n")
+        add_hyperlink(paragraph, download_link, file_name)
+    
+    # 校驗碼
+    if job['checksums']:
+        cells = table.add_row().cells
+        cells[0].text = "【校驗碼】"
+        cells[1].text = f"：{format_checksums(job['checksums'])}"
+    
+    # 添加空行和截圖區域
+    doc.add_paragraph()
+    doc.add_paragraph("【影片截圖】：")
+    doc.add_paragraph()
+    
+    # 添加固定內容與超連結
+    eli_para = doc.add_paragraph()
+    add_hyperlink(eli_para, "https://www.eyny.com/forum-230-1.html", "我的伊莉所有帖子")
+    
+    # 添加標籤
+    doc.add_paragraph("破處, 國產, 學妹, 蘿莉, 處女")
+
+
+def render_word_record(job):
+    """依 job 產生一份Word記錄文件，回傳 (檔案路徑, 耗時秒數)
+
+    job 只包含可序列化的資料，因此可以在子程序中執行；每個程序各自快取範本。
+    """
+    started = time.perf_counter()
+    template_path = job['template_path']
+    if template_path:
+        # 使用自訂範本（快取中的解析結果副本），依預留位置索引填入欄位
+        doc = WORD_TEMPLATE_CACHE.new_document(template_path)
+        values = {
+            '檔案名稱': job['record_name'],
+            '影片大小': job['size_text'],
+            '解壓縮密碼': job['password'],
+            '下載連結': "\n".join(job['links']),
+            '校驗碼': format_checksums(job['checksums']),
+            '上傳時間': job['upload_time']
+        }
+        WORD_TEMPLATE_CACHE.placeholders(template_path).fill(doc, values, list(zip(job['file_names'], job['links'])))
+    else:
+        # 使用內建範本
+        doc = WORD_TEMPLATE_CACHE.new_document()
+        build_builtin_record(doc, job)
+    
+    doc.save(job['output_path'])
+    return job['output_path'], time.perf_counter() - started
+
+
+class DocxRecordRenderer:
+    """Word (.docx) 記錄：內建範本或自訂範本，需要 python-docx"""
+
+    key = 'docx'
+    label = "Word 文件 (.docx)"
+    extension = '.docx'
+    bulk = False
+
+    def write_record(self, job):
+        return render_word_record(job)
+
+
+class TextRecordRenderer:
+    """以預先編譯的 string.Template 產生文字類記錄（Markdown、純文字、BBCode、HTML），不需載入 python-docx
+
+    body 可使用 $title $record_name $size $password $links $checksums $upload_time；
+    link 可使用 $name $url；escape 用於跳脫欄位值（例如 HTML）。
+    """
+
+    bulk = True
+
+    def __init__(self, key, label, extension, body, link, checksums, link_separator='\n',
+                 record_separator='\n', document=('', ''), escape=None):
+        self.key = key
+        self.label = label
+        self.extension = extension
+        self.body = Template(body)
+        self.link = Template(link)
+        self.checksums = Template(checksums)
+        self.link_separator = link_separator
+        self.record_separator = record_separator
+        self.document = document
+        self.escape = escape or (lambda text: text)
+
+    def render(self, job):
+        escape = self.escape
+        links = self.link_separator.join(
+            self.link.substitute(name=escape(name), url=escape(url))
+            for name, url in zip(job['file_names'], job['links'])
+        )
+        checksum_text = format_checksums(job['checksums'])
+        return self.body.substitute(
+            title=escape(job['title_name']),
+            record_name=escape(job['record_name']),
+            size=escape(job['size_text']),
+            password=escape(job['password']),
+            links=links,
+            checksums=self.checksums.substitute(checksums=escape(checksum_text)) if checksum_text else '',
+            upload_time=escape(job['upload_time'])
+        )
+
+    def write(self, path, jobs):
+        """把多筆記錄寫成一個檔案（逐筆寫出）"""
+        head, tail = self.document
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(head)
+            for n, job in enumerate(jobs):
+                if n:
+                    f.write(self.record_separator)
+                f.write(self.render(job))
+            f.write(tail)
+
+    def write_record(self, job):
+        started = time.perf_counter()
+        self.write(job['output_path'], [job])
+        return job['output_path'], time.perf_counter() - started
+
+
+RECORD_RENDERERS = {renderer.key: renderer for renderer in (
+    DocxRecordRenderer(),
+    TextRecordRenderer(
+        'markdown', "Markdown (.md)", '.md',
+        body=(
+            "# ${title}@MP4@KF@無碼\n\n"
+            "| 項目 | 內容 |\n"
+            "| --- | --- |\n"
+            "| 【影片名稱】 | ${record_name} |\n"
+            "| 【影片格式】 | MP4 |\n"
+            "| 【影片大小】 | ${size} |\n"
+            "| 【影片說明】 | 無碼 |\n"
+            "| 【解壓密碼】 | ${password} |\n"
+            "| 【影片載點】 | ${links} |\n"
+            "${checksums}\n"
+            "【影片截圖】：\n\n"
+            "[我的伊莉所有帖子](https://www.eyny.com/forum-230-1.html)\n\n"
+            "破處, 國產, 學妹, 蘿莉, 處女\n"
+        ),
+        link="[${name}](${url})",
+        checksums="| 【校驗碼】 | ${checksums} |\n",
+        link_separator="<br>",
+        record_separator="\n---\n\n",
+        escape=lambda text: text.replace('|', '\\|').replace('\n', '<br>')
+    ),
+    TextRecordRenderer(
+        'text', "純文字 (.txt)", '.txt',
+        body=(
+            "${title}@MP4@KF@無碼\n\n"
+            "【影片名稱】：${record_name}\n"
+            "【影片格式】：MP4\n"
+            "【影片大小】：${size}\n"
+            "【影片說明】：無碼\n"
+            "【解壓密碼】：${password}\n"
+            "【影片載點】：\n${links}\n"
+            "${checksums}\n"
+            "【影片截圖】：\n\n"
+            "我的伊莉所有帖子：https://www.eyny.com/forum-230-1.html\n\n"
+            "破處, 國產, 學妹, 蘿莉, 處女\n"
+        ),
+        link="${name}：${url}",
+        checksums="【校驗碼】：\n${checksums}\n",
+        record_separator="\n" + "=" * 40 + "\n\n"
+    ),
+    TextRecordRenderer(
+        'bbcode', "BBCode 論壇格式 (.txt)", '.bbcode.txt',
+        body=(
+            "[size=4][b]${title}@MP4@KF@無碼[/b][/size]\n\n"
+            "[b]【影片名稱】[/b]：${record_name}\n"
+            "[b]【影片格式】[/b]：MP4\n"
+            "[b]【影片大小】[/b]：${size}\n"
+            "[b]【影片說明】[/b]：無碼\n"
+            "[b]【解壓密碼】[/b]：${password}\n"
+            "[b]【影片載點】[/b]：\n${links}\n"
+            "${checksums}\n"
+            "[b]【影片截圖】[/b]：\n\n"
+            "[url=https://www.eyny.com/forum-230-1.html]我的伊莉所有帖子[/url]\n\n"
+            "破處, 國產, 學妹, 蘿莉, 處女\n"
+        ),
+        link="[url=${url}]${name}[/url]",
+        checksums="[b]【校驗碼】[/b]：\n[code]${checksums}[/code]\n",
+        record_separator="\n[hr]\n\n"
+    ),
+    TextRecordRenderer(
+        'html', "HTML 網頁 (.html)", '.html',
+        body=(
+            "<h1>${title}@MP4@KF@無碼</h1>\n"
+            "<table border=\"1\" cellpadding=\"4\">\n"
+            "<tr><td>【影片名稱】</td><td>：${record_name}</td></tr>\n"
+            "<tr><td>【影片格式】</td><td>：MP4</td></tr>\n"
+            "<tr><td>【影片大小】</td><td>：${size}</td></tr>\n"
+            "<tr><td>【影片說明】</td><td>：無碼</td></tr>\n"
+            "<tr><td>【解壓密碼】</td><td>：${password}</td></tr>\n"
+            "<tr><td>【影片載點】</td><td>：${links}</td></tr>\n"
+            "${checksums}"
+            "</table>\n"
+            "<p>【影片截圖】：</p>\n"
+            "<p><a href=\"https://www.eyny.com/forum-230-1.html\">我的伊莉所有帖子</a></p>\n"
+            "<p>破處, 國產, 學妹, 蘿莉, 處女</p>\n"
+        ),
+        link="<a href=\"${url}\">${name}</a>",
+        checksums="<tr><td>【校驗碼】</td><td><pre>${checksums}</pre></td></tr>\n",
+        link_separator="<br>\n",
+        record_separator="<hr>\n",
+        document=(
+            "<!DOCTYPE html>\n<html lang=\"zh-Hant\">\n<head>\n<meta charset=\"utf-8\">\n"
+            "<title>上傳記錄</title>\n</head>\n<body>\n",
+            "</body>\n</html>\n"
+        ),
+        escape=html.escape
+    ),
+)}
+
+
+def render_record(job):
+    """依 job['format'] 選擇記錄格式並寫出，回傳 (檔案路徑, 耗時秒數)"""
+    return RECORD_RENDERERS[job.get('format', 'docx')].write_record(job)
+
+
+def export_records(path, jobs, fmt):
+    """把多筆記錄以文字類格式寫成單一檔案（批次匯出，不需 python-docx）"""
+    renderer = RECORD_RENDERERS[fmt]
+    if not renderer.bulk:
+        raise ValueError(f"{renderer.label} 不支援批次匯出")
+    renderer.write(path, jobs)
+
+
+class RecordStage:
+    """文件記錄產生階段：接收已完成的上傳，在小型程序池中產生記錄，不佔用上傳執行緒
+
+    無法建立程序池（或程序池損壞）時改用執行緒池。同一個輸出路徑的工作依序執行：
+    前一筆還在產生時只保留最新的一筆等待，較舊的結果不會覆蓋較新的記錄。
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._executor = None
+        self._cond = threading.Condition()
+        self._paths = {}  # 產生中的輸出路徑 -> 等待中的最新工作 (job, on_done) 或 None
+        self.queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+        self.last_seconds = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            except (OSError, NotImplementedError, ImportError):
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _fallback_to_threads(self):
+        with self._cond:
+            if not isinstance(self._executor, ThreadPoolExecutor):
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def submit(self, job, on_done=None):
+        """加入一筆記錄工作；完成後以 on_done(路徑或 None, 錯誤或 None, 耗時秒數) 回報"""
+        path = job.get('output_path')
+        with self._cond:
+            self.queued += 1
+            if path in self._paths:
+                # 同一份記錄正在產生：排在它之後，取代尚未開始的較舊工作
+                if self._paths[path] is not None:
+                    self.queued -= 1
+                self._paths[path] = (job, on_done)
+                self._publish()
+                return
+            self._paths[path] = None
+            self._publish()
+        self._submit(job, on_done, retried=False)
+
+    def _submit(self, job, on_done, retried):
+        try:
+            future = self._get_executor().submit(render_record, job)
+        except (BrokenProcessPool, RuntimeError):
+            self._fallback_to_threads()
+            future = self._executor.submit(render_record, job)
+        future.add_done_callback(lambda f: self._done(f, job, on_done, retried))
+
+    def _done(self, future, job, on_done, retried):
+        try:
+            word_path, seconds = future.result()
+            error = None
+        except BrokenProcessPool as e:
+            if not retried:
+                self._fallback_to_threads()
+                self._submit(job, on_done, retried=True)
+                return
+            word_path, seconds, error = None, 0.0, e
+        except Exception as e:
+            word_path, seconds, error = None, 0.0, e
+
+        path = job.get('output_path')
+        with self._cond:
+            self.queued -= 1
+            if error is None:
+                METRICS.observe('record', seconds)
+                self.completed += 1
+                self.total_seconds += seconds
+                self.last_seconds = seconds
+            else:
+                self.failed += 1
+                METRICS.inc('record_failures')
+            waiting = self._paths.pop(path, None)
+            if waiting is not None:
+                self._paths[path] = None
+            self._publish()
+            self._cond.notify_all()
+
+        if waiting is not None:
+            # 已有較新的記錄在等待：這次的結果會被覆蓋，不回報
+            self._submit(*waiting, retried=False)
+            return
+        if on_done:
+            on_done(word_path, error, seconds)
+
+    def _publish(self):
+        # 記錄在程序池中產生，無法回報個別工作者，以「記錄文件」一列代表整個階段
+        METRICS.set_gauge('queue_record', self.queued)
+        METRICS.set_state(f"產生記錄（{min(self.queued, self.workers)} 個工作者）" if self.queued else None,
+                          name="記錄文件")
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': self.queued,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_seconds': self.total_seconds / self.completed if self.completed else 0.0,
+                'last_seconds': self.last_seconds
+            }
+
+    def reset_stats(self):
+        with self._cond:
+            self.completed = self.failed = 0
+            self.total_seconds = self.last_seconds = 0.0
+
+    def wait_idle(self):
+        """等待所有已送出的記錄產生完成"""
+        with self._cond:
+            while self.queued:
+                self._cond.wait(0.5)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+# 上傳報告欄位（記錄鍵值 -> 表頭）
+REPORT_COLUMNS = (
+    ('filename', '檔案名稱'),
+    ('filesize', '檔案大小'),
+    ('upload_time', '上傳時間'),
+    ('download_link', '下載連結'),
+    ('status', '狀態'),
+    ('checksums', '校驗碼'),
+)
+
+
+def report_row(record):
+    """把一筆上傳結果轉成報告用的文字欄位與連結清單"""
+    return {
+        'filename': record.name,
+        'filesize': record.filesize,
+        'upload_time': record.upload_time,
+        'download_link': record.download_link,
+        'status': record.status,
+        'checksums': format_checksums(record.checksums) or 'N/A',
+        'links': record.download_links,
+    }
+
+
+def write_report_csv(path, records, generated_at):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([title for _, title in REPORT_COLUMNS])
+        for record in records:
+            row = report_row(record)
+            if row['links']:
+                row['download_link'] = '\n'.join(row['links'])
+            writer.writerow([row[key] for key, _ in REPORT_COLUMNS])
+
+
+def write_report_jsonl(path, records, generated_at):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            entry = {
+                'filename': record.name,
+                'size': record.size,
+                'upload_time': record.upload_time,
+                'status': record.status,
+                'download_links': record.download_links,
+                'checksums': record.checksums,
+                'source_checksums': record.source_checksums,
+            }
+            f.write(json.dumps(entry, ensure_ascii=False))
+            f.write('\n')
+
+
+def write_report_html(path, records, generated_at):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(
+            '<!DOCTYPE html>\n<html lang="zh-Hant">\n<head>\n<meta charset="utf-8">\n'
+            '<title>KatFile 上傳報告</title>\n<style>\n'
+            'body { font-family: sans-serif; }\n'
+            'table { border-collapse: collapse; }\n'
+            'th, td { border: 1px solid #999; padding: 4px 8px; vertical-align: top; }\n'
+            'td.checksums { font-family: monospace; white-space: pre; }\n'
+            '</style>\n</head>\n<body>\n<h1>KatFile 上傳報告</h1>\n'
+        )
+        f.write(f'<p>生成時間：{html.escape(generated_at)}</p>\n<table>\n<tr>')
+        f.write(''.join(f'<th>{html.escape(title)}</th>' for _, title in REPORT_COLUMNS))
+        f.write('</tr>\n')
+        total = 0
+        for record in records:
+            row = report_row(record)
+            cells = []
+            for key, _ in REPORT_COLUMNS:
+                if key == 'download_link' and row['links']:
+                    value = '<br>'.join(
+                        f'<a href="{html.escape(link)}">{html.escape(link)}</a>' for link in row['links']
+                    )
+                else:
+                    value = html.escape(row[key])
+                cells.append(f'<td class="{key}">{value}</td>')
+            f.write(f'<tr>{"".join(cells)}</tr>\n')
+            total += 1
+        f.write(f'</table>\n<p>總計上傳檔案：{total} 個</p>\n</body>\n</html>\n')
+
+
+def docx_cell_xml(lines, links=()):
+    """以字串組出一個表格儲存格；連結使用 HYPERLINK 欄位碼，不需建立關聯"""
+    paragraphs = []
+    for line in lines:
+        paragraphs.append(f'<w:p><w:r><w:t xml:space="preserve">{xml_escape(line)}</w:t></w:r></w:p>')
+    for link in links:
+        instr = quoteattr(f' HYPERLINK "{link.replace(chr(34), "%22")}" ')
+        paragraphs.append(
+            f'<w:p><w:fldSimple w:instr={instr}><w:r><w:rPr><w:color w:val="0563C1"/><w:u w:val="single"/>'
+            f'</w:rPr><w:t xml:space="preserve">{xml_escape(link)}</w:t></w:r></w:fldSimple></w:p>'
+        )
+    return f'<w:tc>{"".join(paragraphs) or "<w:p/>"}</w:tc>'
+
+
+def write_report_docx(path, records, generated_at, batch_rows=500):
+    """先用 python-docx 建立含表頭的骨架，再把資料列的 XML 分批直接寫入 document.xml"""
+    from docx import Document
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    
+    marker = f'@@ROWS-{uuid.uuid4().hex}@@'
+    doc = Document()
+    title = doc.add_heading("KatFile 上傳報告", level=1)
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    doc.add_paragraph(f"生成時間：{generated_at}")
+    doc.add_paragraph(f"總計上傳檔案：{len(records)} 個")
+    table = doc.add_table(rows=2, cols=len(REPORT_COLUMNS))
+    table.style = 'Table Grid'
+    for cell, (_, title_text) in zip(table.rows[0].cells, REPORT_COLUMNS):
+        cell.text = title_text
+    table.rows[1].cells[0].text = marker
+
+    skeleton = io.BytesIO()
+    doc.save(skeleton)
+    skeleton.seek(0)
+
+    with zipfile.ZipFile(skeleton) as src:
+        # 以標記列為界，切出資料列之前與之後的 XML
+        document_xml = src.read('word/document.xml').decode('utf-8')
+        pos = document_xml.index(marker)
+        row_start = max(document_xml.rfind('<w:tr>', 0, pos), document_xml.rfind('<w:tr ', 0, pos))
+        row_end = document_xml.index('</w:tr>', pos) + len('</w:tr>')
+
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as dst:
+            for item in src.infolist():
+                if item.filename != 'word/document.xml':
+                    dst.writestr(item, src.read(item.filename))
+
+            with dst.open('word/document.xml', 'w', force_zip64=True) as out:
+                batch = [document_xml[:row_start]]
+                for record in records:
+                    row = report_row(record)
+                    cells = []
+                    for key, _ in REPORT_COLUMNS:
+                        if key == 'download_link' and row['links']:
+                            cells.append(docx_cell_xml((), row['links']))
+                        else:
+                            cells.append(docx_cell_xml(row[key].split('\n')))
+                    batch.append(f'<w:tr>{"".join(cells)}</w:tr>')
+                    if len(batch) >= batch_rows:
+                        out.write(''.join(batch).encode('utf-8'))
+                        batch = []
+                batch.append(document_xml[row_end:])
+                out.write(''.join(batch).encode('utf-8'))
+
+
+# 報告格式（副檔名 -> 寫入函式）
+REPORT_WRITERS = {
+    '.docx': write_report_docx,
+    '.csv': write_report_csv,
+    '.jsonl': write_report_jsonl,
+    '.html': write_report_html,
+}
+
+
+def export_report(path, records, generated_at=None):
+    """依副檔名選擇格式，把上傳記錄逐筆寫出成報告"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.htm':
+        ext = '.html'
+    writer = REPORT_WRITERS.get(ext)
+    if writer is None:
+        raise ValueError(f"不支援的報告格式：{ext or '（無副檔名）'}")
+    writer(path, records, generated_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def split_patterns(text):
+    """把以逗號、分號或換行分隔的萬用字元樣式拆成清單"""
+    return [pattern.strip() for pattern in re.split(r'[,;\n]', text or '') if pattern.strip()]
+
+
+class RemoteFolderCache:
+    """遠端資料夾的子資料夾快取：每個節點各自記錄取得時間，過期或失效的節點才重新查詢
+
+    fetch(fld_id) 回傳該資料夾下的子資料夾清單（folder/list 的 folders），可在任何執行緒呼叫。
+    """
+
+    def __init__(self, fetch, ttl=FOLDER_CACHE_TTL):
+        self._fetch = fetch
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # fld_id -> (取得時間, 子資料夾清單)
+
+    def cached(self, fld_id):
+        """未過期的快取內容；沒有或已過期時回傳 None"""
+        with self._lock:
+            entry = self._entries.get(fld_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def children(self, fld_id):
+        """子資料夾清單：快取有效時直接回傳，否則向伺服器查詢並更新快取"""
+        folders = self.cached(fld_id)
+        if folders is None:
+            folders = self._fetch(fld_id)
+            self.put(fld_id, folders)
+        return folders
+
+    def put(self, fld_id, folders):
+        with self._lock:
+            self._entries[fld_id] = (time.monotonic(), list(folders))
+
+    def invalidate(self, fld_id=None):
+        """讓一個節點（或全部節點）的快取失效"""
+        with self._lock:
+            if fld_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(fld_id, None)
+
+
+class RemoteFolderMirror:
+    """把本機的相對資料夾路徑對應到遠端資料夾（以 / 分隔，'' 為目標資料夾本身）
+
+    路徑 -> fld_id 記憶化，每個資料夾只查詢或建立一次；已存在的同名遠端資料夾直接重用。
+    prepare() 逐層處理：同一層的兄弟資料夾並行查詢與建立。create(name, parent_id) 回傳新的 fld_id。
+    """
+
+    def __init__(self, root_id, cache, create, workers=4):
+        self._cache = cache
+        self._create = create
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._ids = {'': root_id}
+        self.created = 0
+        self.reused = 0
+
+    @staticmethod
+    def normalize(rel_dir):
+        return '/'.join(part for part in str(rel_dir).replace(os.sep, '/').split('/') if part not in ('', '.'))
+
+    def folder_id(self, rel_dir):
+        """一個相對路徑對應的遠端 fld_id（需要時才建立）"""
+        rel_dir = self.normalize(rel_dir)
+        fld_id = self._ids.get(rel_dir)
+        if fld_id is None:
+            self.prepare([rel_dir])
+            fld_id = self._ids[rel_dir]
+        return fld_id
+
+    def prepare(self, rel_dirs):
+        """一次建立所有路徑（含上層）對應的遠端資料夾"""
+        levels = {}
+        for rel_dir in rel_dirs:
+            parts = self.normalize(rel_dir).split('/')
+            for depth in range(1, len(parts) + 1 if parts[0] else 1):
+                levels.setdefault(depth, set()).add('/'.join(parts[:depth]))
+
+        with self._lock, ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="建立資料夾") as pool:
+            for depth in sorted(levels):
+                missing = sorted(path for path in levels[depth] if path not in self._ids)
+                if not missing:
+                    continue
+                # 每個上層資料夾只列出一次子資料夾，已存在的直接重用
+                parents = sorted({self._ids[path.rpartition('/')[0]] for path in missing})
+                listings = dict(zip(parents, pool.map(self._cache.children, parents)))
+                to_create = []
+                for path in missing:
+                    parent_id = self._ids[path.rpartition('/')[0]]
+                    name = path.rpartition('/')[2]
+                    existing = next((folder for folder in listings[parent_id] if folder.get('name') == name), None)
+                    if existing is not None:
+                        self._ids[path] = int(existing['fld_id'])
+                        self.reused += 1
+                    else:
+                        to_create.append((path, name, parent_id))
+
+                futures = {pool.submit(self._create, name, parent_id): (path, parent_id)
+                           for path, name, parent_id in to_create}
+                # 等所有建立請求結束再拋出第一個錯誤，已建立的兄弟資料夾仍會記錄下來，不會重複建立
+                error = None
+                for future in as_completed(futures):
+                    path, parent_id = futures[future]
+                    self._cache.invalidate(parent_id)
+                    try:
+                        self._ids[path] = future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    self.created += 1
+                if error is not None:
+                    raise error
+
+
+class FolderScanner:
+    """以 os.scandir 平行掃描資料夾：每個子資料夾是一個工作，檔案大小直接取自 DirEntry.stat
+
+    include / exclude 為萬用字元樣式，比對相對路徑（以 / 分隔）或檔名；
+    exclude 也會排除整個子資料夾。結果以 on_batch(檔案清單) 分批回報。
+    """
+
+    def __init__(self, root, include=(), exclude=(), workers=8, batch_size=500, flush_interval=0.2):
+        self.root = str(root)
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+    @staticmethod
+    def _matches(patterns, rel_path, name):
+        return any(fnmatch.fnmatch(rel_path, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+    def _scan_dir(self, path, rel_dir):
+        files, dirs = [], []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                    pattern_path = rel_path.replace(os.sep, '/')
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not self._matches(self.exclude, pattern_path, entry.name):
+                                dirs.append((entry.path, rel_path))
+                        elif entry.is_file():
+                            if self.include and not self._matches(self.include, pattern_path, entry.name):
+                                continue
+                            if self._matches(self.exclude, pattern_path, entry.name):
+                                continue
+                            files.append(FileEntry(entry.path, rel_path, entry.stat().st_size))
+                    except OSError:
+                        continue
+        except OSError:
+            # 與 os.walk 相同：無法讀取的資料夾直接略過
+            pass
+        files.sort(key=lambda f: f.name)
+        return files, dirs
+
+    def run(self, on_batch, should_continue=lambda: True):
+        """執行掃描，回傳找到的檔案數；should_continue() 為 False 時停止"""
+        total = 0
+        batch = []
+        last_flush = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {pool.submit(self._scan_dir, self.root, '')}
+            while pending:
+                done, pending = wait(pending, timeout=self.flush_interval, return_when=FIRST_COMPLETED)
+                if not should_continue():
+                    for future in pending:
+                        future.cancel()
+                    return total
+                for future in done:
+                    files, dirs = future.result()
+                    for path, rel_path in dirs:
+                        pending.add(pool.submit(self._scan_dir, path, rel_path))
+                    batch.extend(files)
+                
+                # 批次滿了或等待一段時間後就先送出，讓第一批檔案立即出現
+                if batch and (len(batch) >= self.batch_size or time.monotonic() - last_flush >= self.flush_interval):
+                    total += len(batch)
+                    on_batch(batch)
+                    batch = []
+                    last_flush = time.monotonic()
+        if batch:
+            total += len(batch)
+            on_batch(batch)
+        return total
+
+
+class UIDispatcher:
+    """背景執行緒到 Tk 的介面更新：同一列的狀態只保留最新值、進度累加，由 Tk 迴圈定時一次套用
+
+    任何執行緒都可以呼叫 status / step；套用後把快照交給 subscribe 註冊的監聽者（例如儀表板），
+    介面成本取決於更新頻率（interval_ms），而不是事件數量。
+    """
+
+    def __init__(self, root, apply_status, apply_step, interval_ms=100):
+        self.root = root
+        self.interval_ms = interval_ms
+        self._apply_status = apply_status
+        self._apply_step = apply_step
+        self._lock = threading.Lock()
+        self._statuses = {}
+        self._steps = 0
+        self._listeners = []
+        self.posted = 0
+        self.applied = 0
+        self.snapshot = {'posted': 0, 'applied': 0, 'rows': 0, 'steps': 0, 'flushed_at': None}
+
+    def status(self, index, text):
+        """更新某一列的狀態（同一列在下次套用前只保留最後一次）"""
+        with self._lock:
+            self._statuses[index] = text
+            self.posted += 1
+
+    def step(self, count=1):
+        """推進進度條"""
+        with self._lock:
+            self._steps += count
+            self.posted += 1
+
+    def subscribe(self, listener):
+        """每次套用後以 listener(快照) 回報（在 Tk 執行緒呼叫）"""
+        self._listeners.append(listener)
+
+    def start(self):
+        self.root.after(self.interval_ms, self._tick)
+
+    def _tick(self):
+        try:
+            self.flush()
+        finally:
+            self.root.after(self.interval_ms, self._tick)
+
+    def flush(self):
+        """套用累積的更新（只能在 Tk 執行緒呼叫）"""
+        with self._lock:
+            statuses, self._statuses = self._statuses, {}
+            steps, self._steps = self._steps, 0
+            posted = self.posted
+        if not (statuses or steps):
+            return
+
+        for index, text in statuses.items():
+            self._apply_status(index, text)
+        if steps:
+            self._apply_step(steps)
+
+        self.applied += len(statuses) + (1 if steps else 0)
+        self.snapshot = {
+            'posted': posted,
+            'applied': self.applied,
+            'rows': len(statuses),
+            'steps': steps,
+            'flushed_at': time.time()
+        }
+        for listener in self._listeners:
+            listener(self.snapshot)
+
+
+# 日誌中的 API 金鑰（網址參數 key=...，或 JSON／dict 的 "key": "..."）
+SECRET_PATTERN = re.compile(r'(?i)(\bkey=|["\']key["\']\s*:\s*["\'])([^&\s"\']+)')
+
+
+def redact_secrets(text):
+    """遮蔽文字中的 API 金鑰，避免寫入日誌檔"""
+    return SECRET_PATTERN.sub(r'\1***', text)
+
+
+class LogSink:
+    """執行緒安全的日誌輸出：任何執行緒都可呼叫 emit，由 Tk 迴圈定時成批寫入日誌視窗
+
+    日誌視窗只保留最近 max_lines 行（環形緩衝），完整日誌寫入輪替的日誌檔；API 金鑰一律遮蔽。
+    """
+
+    def __init__(self, log_file, max_lines=2000, max_line_chars=500, max_bytes=5 * 1024 * 1024, backup_count=5):
+        self.log_file = Path(log_file)
+        self.max_lines = max_lines
+        self.max_line_chars = max_line_chars
+        self._queue = queue.SimpleQueue()
+        self._widget = None
+        self._lines = 0
+
+        self._logger = logging.getLogger(f"katfile_uploader.{id(self)}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        try:
+            self.log_file.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(self.log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self._logger.addHandler(handler)
+        except OSError as e:
+            print(f"無法開啟日誌檔 {self.log_file}: {e}")
+
+    def emit(self, message):
+        """記錄一則訊息（可在任何執行緒呼叫）"""
+        message = redact_secrets(str(message))
+        timestamp = datetime.now().strftime("[%H:%M:%S]")
+        self._queue.put(f"{timestamp} {message}")
+        self._logger.info(message)
+
+    def attach(self, widget):
+        self._widget = widget
+
+    def drain(self, limit=500):
+        """把佇列中的訊息一次寫入日誌視窗（只能在 Tk 執行緒呼叫），回傳寫入的行數"""
+        if self._widget is None:
+            return 0
+        lines = []
+        while len(lines) < limit:
+            try:
+                message = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if len(message) > self.max_line_chars:
+                message = message[:self.max_line_chars] + " …（完整內容見日誌檔）"
+            lines.append(message)
+        if not lines:
+            return 0
+
+        self._widget.insert(tk.END, "\n".join(lines) + "\n")
+        self._lines += sum(1 + line.count("\n") for line in lines)
+        if self._lines > self.max_lines:
+            excess = self._lines - self.max_lines
+            self._widget.delete("1.0", f"{excess + 1}.0")
+            self._lines = self.max_lines
+        self._widget.see(tk.END)
+        return len(lines)
+
+    def clear(self):
+        if self._widget is not None:
+            self._widget.delete("1.0", tk.END)
+        self._lines = 0
+
+    def files(self):
+        """日誌檔（由舊到新，包含輪替的備份）"""
+        backups = sorted(self.log_file.parent.glob(self.log_file.name + ".*"),
+                         key=lambda p: int(p.suffix[1:]) if p.suffix[1:].isdigit() else 0, reverse=True)
+        return [p for p in backups + [self.log_file] if p.exists()]
+
+    def flush(self):
+        for handler in self._logger.handlers:
+            handler.flush()
+
+
+class EventLog:
+    """結構化事件記錄：每個上傳批次寫一個 JSONL 檔，每行一個事件，供離線分析吞吐量與失敗原因
+
+    事件欄位：ts、run、stage、event，以及視情況提供的 file、name、part、bytes、
+    duration、http_status、retries、error 等；值為 None 的欄位不寫出。
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._file = None
+        self.run_id = None
+        self.path = None
+
+    def open_run(self):
+        """開始新的批次，回傳事件檔路徑"""
+        self.close_run()
+        run_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / f"run-{run_id}.jsonl"
+            handle = open(path, 'a', encoding='utf-8', buffering=1)
+        except OSError as e:
+            print(f"無法建立事件記錄檔: {e}")
+            return None
+        with self._lock:
+            self._file, self.run_id, self.path = handle, run_id, path
+        return path
+
+    def emit(self, stage, event, **fields):
+        """寫出一個事件（可在任何執行緒呼叫；沒有進行中的批次時忽略）"""
+        record = {
+            'ts': datetime.now().isoformat(timespec='milliseconds'),
+            'run': self.run_id,
+            'stage': stage,
+            'event': event,
+        }
+        for name, value in fields.items():
+            if value is not None:
+                record[name] = round(value, 4) if isinstance(value, float) else value
+        line = redact_secrets(json.dumps(record, ensure_ascii=False, default=str)) + '\n'
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+
+    def close_run(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+
+
+class UploadHistory:
+    """本機 SQLite 上傳歷史：每個原檔案一列 uploads，實際上傳的每個檔案（壓縮檔或分割）一列 upload_files
+
+    名稱、日期、雜湊與資料夾都有索引；名稱的部分比對在 SQLite 支援時使用 FTS5 trigram 全文索引，
+    多年累積的記錄也能立即查詢。可在任何執行緒呼叫（共用一個連線，以鎖保護）。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS uploads (
+            id INTEGER PRIMARY KEY,
+            run_id TEXT,
+            uploaded_at REAL NOT NULL,
+            name TEXT NOT NULL COLLATE NOCASE,
+            source_path TEXT,
+            size INTEGER,
+            status TEXT,
+            folder_id INTEGER,
+            folder_name TEXT,
+            md5 TEXT,
+            sha256 TEXT,
+            duration REAL,
+            bytes_sent INTEGER,
+            download_links TEXT,
+            checksums TEXT
+        );
+        CREATE TABLE IF NOT EXISTS upload_files (
+            upload_id INTEGER NOT NULL REFERENCES uploads(id) ON DELETE CASCADE,
+            seq INTEGER NOT NULL,
+            name TEXT,
+            file_code TEXT,
+            download_link TEXT,
+            size INTEGER,
+            md5 TEXT,
+            sha256 TEXT,
+            PRIMARY KEY (upload_id, seq)
+        );
+        CREATE INDEX IF NOT EXISTS idx_uploads_name ON uploads(name);
+        CREATE INDEX IF NOT EXISTS idx_uploads_date ON uploads(uploaded_at);
+        CREATE INDEX IF NOT EXISTS idx_uploads_md5 ON uploads(md5);
+        CREATE INDEX IF NOT EXISTS idx_uploads_sha256 ON uploads(sha256);
+        CREATE INDEX IF NOT EXISTS idx_uploads_folder ON uploads(folder_id, uploaded_at);
+        CREATE INDEX IF NOT EXISTS idx_uploads_folder_name ON uploads(folder_name COLLATE NOCASE, uploaded_at);
+        CREATE INDEX IF NOT EXISTS idx_upload_files_name ON upload_files(name COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_upload_files_code ON upload_files(file_code);
+        CREATE INDEX IF NOT EXISTS idx_upload_files_md5 ON upload_files(md5);
+        CREATE INDEX IF NOT EXISTS idx_upload_files_sha256 ON upload_files(sha256);
+    """
+
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS uploads_fts USING fts5(
+            name, content='uploads', content_rowid='id', tokenize='trigram');
+        CREATE TRIGGER IF NOT EXISTS uploads_fts_insert AFTER INSERT ON uploads BEGIN
+            INSERT INTO uploads_fts(rowid, name) VALUES (new.id, new.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS uploads_fts_delete AFTER DELETE ON uploads BEGIN
+            INSERT INTO uploads_fts(uploads_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END;
+    """
+
+    COLUMNS = ("id, uploaded_at, name, source_path, size, status, folder_id, folder_name, md5, sha256, duration, "
+               "download_links, checksums")
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        with self._conn:
+            self._conn.executescript(self.SCHEMA)
+        try:
+            with self._conn:
+                self._conn.executescript(self.FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # 較舊的 SQLite 沒有 FTS5 或 trigram 分詞器，名稱比對改用 LIKE
+            self.has_fts = False
+
+    def add(self, record, source_path=None, folder_id=0, folder_name=None, upload_infos=(), duration=None,
+            run_id=None):
+        """記錄一個原檔案的上傳結果；upload_infos 為實際上傳的 FileEntry，回傳記錄 id"""
+        digests = record.source_checksums or {}
+        upload_infos = list(upload_infos)
+        bytes_sent = sum(info.bytes_sent or 0 for info in upload_infos)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO uploads (run_id, uploaded_at, name, source_path, size, status, folder_id, folder_name, "
+                "md5, sha256, duration, bytes_sent, download_links, checksums) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, record.uploaded_at, record.name, source_path, record.size, record.status, folder_id,
+                 folder_name, digests.get('md5'), digests.get('sha256'), duration, bytes_sent or None,
+                 json.dumps(record.download_links), json.dumps(record.checksums, ensure_ascii=False))
+            )
+            self._write_files(cursor.lastrowid, upload_infos, record.download_links)
+        return cursor.lastrowid
+
+    def update(self, upload_id, record, upload_infos=()):
+        """校驗後狀態改變或重新上傳時，更新狀態、連結、校驗碼與檔案代碼"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE uploads SET status = ?, download_links = ?, checksums = ? WHERE id = ?",
+                (record.status, json.dumps(record.download_links), json.dumps(record.checksums, ensure_ascii=False),
+                 upload_id)
+            )
+            if upload_infos:
+                self._write_files(upload_id, list(upload_infos), record.download_links)
+
+    def _write_files(self, upload_id, upload_infos, links):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO upload_files (upload_id, seq, name, file_code, download_link, size, md5, sha256) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(upload_id, seq, info.name, info.file_code, links[seq] if seq < len(links) else None, info.size,
+              info.digests.get('md5'), info.digests.get('sha256'))
+             for seq, info in enumerate(upload_infos)]
+        )
+
+    def _filters(self, name=None, digest=None, folder=None, status=None, date_from=None, date_to=None, where=None):
+        """把查詢條件轉成 WHERE 子句與參數；每個條件都能使用索引"""
+        clauses, params = [], []
+        if name:
+            if self.has_fts and len(name) >= 3:
+                clauses.append("id IN (SELECT rowid FROM uploads_fts WHERE uploads_fts MATCH ?)")
+                params.append('"' + name.replace('"', '""') + '"')
+            else:
+                clauses.append(r"name LIKE ? ESCAPE '\'")
+                params.append('%' + re.sub(r'([%_\\])', r'\\\1', name) + '%')
+        if digest:
+            digest = digest.strip().lower()
+            column = 'md5' if len(digest) == 32 else 'sha256'
+            clauses.append(f"({column} = ? OR id IN (SELECT upload_id FROM upload_files WHERE {column} = ?))")
+            params += [digest, digest]
+        if folder not in (None, ''):
+            if str(folder).isdigit():
+                clauses.append("folder_id = ?")
+                params.append(int(folder))
+            else:
+                clauses.append("folder_name = ? COLLATE NOCASE")
+                params.append(folder)
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        if date_from is not None:
+            clauses.append("uploaded_at >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            clauses.append("uploaded_at < ?")
+            params.append(date_to)
+        if where:
+            clauses.append(f"({where})")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    @contextmanager
+    def _reader(self, custom):
+        """自訂 SQL 條件以唯讀連線執行，避免寫入或刪除記錄"""
+        if not custom:
+            with self._lock:
+                yield self._conn
+            return
+        conn = sqlite3.connect(f"{self.db_path.resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def count(self, **filters):
+        where, params = self._filters(**filters)
+        with self._reader(filters.get('where')) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM uploads{where}", params).fetchone()[0]
+
+    def search(self, limit=None, batch_rows=1000, **filters):
+        """依條件由新到舊逐筆產生 HistoryEntry；limit 為 None 時產生全部（分批讀取，不會一次載入）"""
+        where, params = self._filters(**filters)
+        keyset = (" AND " if where else " WHERE ") + "(uploaded_at, id) < (?, ?)"
+        last = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = batch_rows if remaining is None else min(batch_rows, remaining)
+            sql = (f"SELECT {self.COLUMNS} FROM uploads{where}{keyset if last else ''} "
+                   f"ORDER BY uploaded_at DESC, id DESC LIMIT {int(size)}")
+            with self._reader(filters.get('where')) as conn:
+                rows = conn.execute(sql, params + list(last or ())).fetchall()
+            for row in rows:
+                yield HistoryEntry(*row)
+            if len(rows) < size:
+                break
+            last = (rows[-1][1], rows[-1][0])
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def files(self, upload_id):
+        """一筆記錄實際上傳的檔案（名稱、檔案代碼、連結）"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT name, file_code, download_link FROM upload_files WHERE upload_id = ? ORDER BY seq",
+                (upload_id,)
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class HistoryEntry:
+    """上傳歷史查詢結果的一列；record 屬性轉成 UploadResult，可直接交給 export_report"""
+
+    __slots__ = ('id', 'uploaded_at', 'name', 'source_path', 'size', 'status', 'folder_id', 'folder_name', 'md5',
+                 'sha256', 'duration', 'download_links', 'checksums')
+
+    def __init__(self, id, uploaded_at, name, source_path, size, status, folder_id, folder_name, md5, sha256,
+                 duration, download_links, checksums):
+        self.id = id
+        self.uploaded_at = uploaded_at
+        self.name = name
+        self.source_path = source_path
+        self.size = size
+        self.status = status
+        self.folder_id = folder_id
+        self.folder_name = folder_name
+        self.md5 = md5
+        self.sha256 = sha256
+        self.duration = duration
+        self.download_links = json.loads(download_links or '[]')
+        self.checksums = json.loads(checksums or '[]')
+
+    @property
+    def record(self):
+        source_checksums = {name: value for name, value in (('md5', self.md5), ('sha256', self.sha256)) if value}
+        return UploadResult(self.name, self.size or 0, self.status, self.download_links, self.checksums,
+                            source_checksums, uploaded_at=self.uploaded_at)
+
+
+def response_retries(response):
+    """urllib3 在這個回應之前自動重試的次數"""
+    retries = getattr(getattr(response, 'raw', None), 'retries', None)
+    return len(retries.history) if retries is not None else 0
+
+
+class SessionProfiler:
+    """上傳工作階段的效能分析：cProfile、取樣式呼叫堆疊與 tracemalloc
+
+    Python 3.12 以前，start() 之後建立的執行緒各自有一個 cProfile，執行緒結束時停用；
+    3.12 起 cProfile 使用整個程序共用的 sys.monitoring，改用單一 cProfile 涵蓋所有執行緒
+    （已有其他分析工具在執行時略過 cProfile）。取樣執行緒定時記錄所有執行緒的呼叫堆疊，
+    並在記憶體用量創新高時保留 tracemalloc 快照。stop() 把結果寫入工作階段目錄：
+    profile.pstats、profile.txt、stacks.collapsed（flamegraph.pl / speedscope 可讀）與 memory.txt。
+    stage_functions 為 {階段: [函式, ...]}，用來把記憶體配置位置歸到對應的階段。
+    """
+
+    def __init__(self, directory, stage_functions=None, sample_interval=0.01, snapshot_interval=1.0,
+                 traceback_depth=25, top_sites=10):
+        self.directory = Path(directory)
+        self.sample_interval = sample_interval
+        self.snapshot_interval = snapshot_interval
+        self.traceback_depth = traceback_depth
+        self.top_sites = top_sites
+        self._stage_ranges = self._code_ranges(stage_functions or {})
+        self._profiles = []
+        self._profiles_lock = threading.Lock()
+        self._process_profile = None
+        self.profile_error = None
+        self._stacks = {}
+        self._stop = threading.Event()
+        self._sampler = None
+        self._peak_snapshot = None
+        self._peak_bytes = 0
+        self._started_tracemalloc = False
+
+    @staticmethod
+    def _code_ranges(stage_functions):
+        ranges = []
+        for stage, functions in stage_functions.items():
+            for function in functions:
+                code = getattr(function, '__func__', function).__code__
+                last = max((line for _, line in dis.findlinestarts(code) if line), default=code.co_firstlineno)
+                ranges.append((code.co_filename, code.co_firstlineno, last, stage))
+        return ranges
+
+    def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.traceback_depth)
+            self._started_tracemalloc = True
+        if sys.version_info >= (3, 12):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self._process_profile = profile
+                self._profiles.append(profile)
+            except ValueError as e:
+                # 例如在除錯器或其他分析工具下執行
+                self.profile_error = str(e)
+        else:
+            threading.setprofile(self._thread_hook)
+        self._sampler = threading.Thread(target=self._sample, name="效能取樣", daemon=True)
+        self._sampler.start()
+
+    def _thread_hook(self, frame, event, arg):
+        # 新執行緒的第一個事件（呼叫 run）：換成這個執行緒專用的 cProfile，執行緒的工作結束時停用
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with self._profiles_lock:
+            if self._stop.is_set():
+                return
+            try:
+                profile.enable()
+            except ValueError as e:
+                self.profile_error = str(e)
+                return
+            self._profiles.append(profile)
+        thread = threading.current_thread()
+        target = getattr(thread, '_target', None)
+        if target is not None:
+            def profiled_target(*args, **kwargs):
+                try:
+                    return target(*args, **kwargs)
+                finally:
+                    profile.disable()
+            thread._target = profiled_target
+
+    def _sample(self):
+        own = threading.get_ident()
+        last_snapshot = 0.0
+        while not self._stop.wait(self.sample_interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+
+            # 用量比上次快照高出 10% 以上時才重新快照（快照本身成本較高）
+            now = time.monotonic()
+            if tracemalloc.is_tracing() and now - last_snapshot >= self.snapshot_interval:
+                current, _ = tracemalloc.get_traced_memory()
+                if current > self._peak_bytes * 1.1:
+                    self._peak_bytes = current
+                    self._peak_snapshot = tracemalloc.take_snapshot()
+                    last_snapshot = now
+
+    def _stage_of(self, traceback):
+        """由最內層往外找第一個屬於已知階段的呼叫位置"""
+        for frame in reversed(traceback):
+            for filename, first, last, stage in self._stage_ranges:
+                if frame.filename == filename and first <= frame.lineno <= last:
+                    return stage
+        return "其他"
+
+    def _memory_report(self, title, snapshot):
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        by_stage = {}
+        for statistic in snapshot.statistics('traceback'):
+            stage = self._stage_of(statistic.traceback)
+            site = statistic.traceback[-1]
+            sites = by_stage.setdefault(stage, {})
+            size, count = sites.get((site.filename, site.lineno), (0, 0))
+            sites[(site.filename, site.lineno)] = (size + statistic.size, count + statistic.count)
+
+        lines = [f"== {title} =="]
+        for stage, sites in sorted(by_stage.items(), key=lambda item: -sum(size for size, _ in item[1].values())):
+            total = sum(size for size, _ in sites.values())
+            lines.append(f"\n[{stage}] 合計 {format_file_size(total)}")
+            top = sorted(sites.items(), key=lambda item: -item[1][0])[:self.top_sites]
+            for (filename, lineno), (size, count) in top:
+                lines.append(f"  {format_file_size(size):>10}  {count:>7} 個  {filename}:{lineno}")
+        return lines
+
+    def stop(self):
+        """停止分析並寫出結果，回傳工作階段目錄"""
+        with self._profiles_lock:
+            self._stop.set()
+        threading.setprofile(None)
+        if self._process_profile is not None:
+            self._process_profile.disable()
+            self._process_profile = None
+        if self._sampler is not None:
+            self._sampler.join(timeout=5)
+
+        with self._profiles_lock:
+            profiles = list(self._profiles)
+        if profiles:
+            pstats.Stats(*profiles).dump_stats(str(self.directory / "profile.pstats"))
+            with open(self.directory / "profile.txt", 'w', encoding='utf-8') as f:
+                pstats.Stats(str(self.directory / "profile.pstats"), stream=f).sort_stats('cumulative').print_stats(60)
+
+        with open(self.directory / "stacks.collapsed", 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self._stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            lines = [f"目前追蹤的記憶體: {format_file_size(current)}，最高: {format_file_size(peak)}", ""]
+            if self._peak_snapshot is not None:
+                lines += self._memory_report("記憶體用量最高時", self._peak_snapshot) + [""]
+            lines += self._memory_report("工作階段結束時", tracemalloc.take_snapshot())
+            (self.directory / "memory.txt").write_text("\n".join(lines) + "\n", encoding='utf-8')
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+        self._peak_snapshot = None
+        return self.directory
+
+
+def probe_connection(url, timeout=10):
+    """分段量測連線到 url 的 DNS、TCP 連線、TLS 交握與第一個位元組的時間（秒）"""
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    host = parts.hostname
+    port = parts.port or (443 if secure else 80)
+    result = {'host': host, 'port': port}
+
+    started = time.perf_counter()
+    family, socktype, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+    result['dns'] = time.perf_counter() - started
+    result['ip'] = address[0]
+
+    sock = socket.socket(family, socktype, proto)
+    sock.settimeout(timeout)
+    try:
+        started = time.perf_counter()
+        sock.connect(address)
+        result['connect'] = time.perf_counter() - started
+
+        if secure:
+            started = time.perf_counter()
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+            result['tls'] = time.perf_counter() - started
+
+        path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        host_header = host if parts.port is None else f"{host}:{port}"
+        request = (f"GET {path} HTTP/1.1\r\nHost: {host_header}\r\nUser-Agent: KatFile-Uploader/3.3\r\n"
+                   f"Connection: close\r\n\r\n")
+        started = time.perf_counter()
+        sock.sendall(request.encode('ascii'))
+        first = sock.recv(1024)
+        result['ttfb'] = time.perf_counter() - started
+        status_line = first.split(b'\r\n', 1)[0].split()
+        result['status'] = int(status_line[1]) if len(status_line) > 1 and status_line[1].isdigit() else None
+    finally:
+        sock.close()
+    return result
+
+
+def measure_upload_throughput(upload_url, payload, block_size, concurrency=1, timeout=60, stored=None):
+    """以 concurrency 個連線同時上傳測試資料，回傳整體速度（位元組/秒）
+
+    不帶 sess_id 上傳，預期伺服器不會保存；若回應中仍出現 file_code，會加入 stored 清單讓呼叫端停止測試並回報。
+    以實際被讀走送出的位元組計算，伺服器提早中斷也不影響量測。
+    """
+    sent = [0]
+    lock = threading.Lock()
+
+    def count(nbytes):
+        with lock:
+            sent[0] += nbytes
+
+    session = requests.Session()
+    session.mount(upload_url, HTTPAdapter(pool_maxsize=concurrency))
+
+    def upload(n):
+        body = MultipartFileStream({'utype': 'prem'}, 'file_0', f"katfile_probe_{n}.bin", io.BytesIO(payload),
+                                   len(payload), block_size=block_size, on_read=count)
+        try:
+            response = session.post(upload_url, data=body.as_body(), headers={'Content-Type': body.content_type}, timeout=timeout)
+            result = response.json()
+        except (requests.RequestException, ValueError):
+            return
+        codes = [item.get('file_code') for item in result if isinstance(item, dict)] if isinstance(result, list) else []
+        if stored is not None:
+            with lock:
+                stored.extend(code for code in codes if code and code != 'undef')
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(upload, range(concurrency)))
+    finally:
+        session.close()
+    elapsed = time.perf_counter() - started
+    return sent[0] / elapsed if elapsed else 0.0
+
 
 class KatFileUploaderEnhanced:
     def __init__(self, root):
@@ -36,7 +2798,15 @@ class KatFileUploaderEnhanced:
         # 初始化變數
         self.api_key = tk.StringVar()
         self.selected_files = []
-        self.folders = []
+        self.selected_paths = set()  # 已選檔案路徑（去除重複用）
+        self.scan_generation = 0  # 清除列表時遞增，丟棄舊掃描的結果
+        self.file_statuses = []  # 與 selected_files 對應的狀態文字
+        self.file_items = {}  # 目前頁面中 檔案索引 -> Treeview 項目 ID
+        self.file_page = 0
+        self.folder_cache = RemoteFolderCache(self.fetch_folder_children)
+        self.folder_items = {}  # fld_id -> 資料夾樹的項目 ID
+        self.quarantine_folder_id = None  # 「校驗失敗」資料夾（第一次需要時才查詢或建立）
+        self.quarantine_lock = threading.Lock()
         self.current_folder_id = 0
         self.account_info = {}
         self.is_uploading = False
@@ -46,23 +2816,80 @@ class KatFileUploaderEnhanced:
         self.compress_enabled = tk.BooleanVar(value=False)
         self.compress_password = tk.StringVar()
         self.compress_format = tk.StringVar(value="zip")
+        self.compress_level = tk.StringVar(value="6")
+        
+        # 資料夾掃描篩選（萬用字元，以逗號分隔）
+        self.scan_include = tk.StringVar(value="")
+        self.scan_exclude = tk.StringVar(value="")
+        
+        # 鏡像模式：依檔案的相對路徑在目標資料夾下建立對應的遠端資料夾
+        self.mirror_folders = tk.BooleanVar(value=False)
+        
+        # 暫存空間設定
+        self.scratch_dir = tk.StringVar(value=str(Path.home() / "katfile_temp_compress"))
+        self.scratch_quota_gb = tk.StringVar(value="20")
+        self.scratch = None
+        
+        # 上傳調校（網路診斷會依量測結果更新並儲存）
+        self.parallel_uploads = tk.StringVar(value="3")
+        self.upload_block_kb = tk.StringVar(value=str(UPLOAD_BLOCK_SIZE // 1024))
+        
+        # 文件記錄產生階段（背景程序池）
+        self.record_stage = RecordStage(workers=2)
+        
+        # 壓縮檔快取設定
+        self.cache_enabled = tk.BooleanVar(value=True)
+        self.cache_budget_gb = tk.StringVar(value="50")
+        self.archive_cache = None
         
         # Word文件設定
         self.generate_word = tk.BooleanVar(value=True)
+        self.record_format = tk.StringVar(value='docx')
         self.word_template_path = ""
         
+        # 校驗碼設定
+        self.digest_md5 = tk.BooleanVar(value=False)
+        self.digest_sha256 = tk.BooleanVar(value=True)
+        
         # 設定檔路徑
         self.config_file = Path.home() / ".katfile_uploader_config.json"
         
+        # 日誌（視窗只保留最近的內容，完整日誌寫入輪替的日誌檔）
+        self.log_sink = LogSink(Path.home() / ".katfile_uploader_logs" / "katfile_uploader.log")
+        self.event_log = EventLog(Path.home() / ".katfile_uploader_logs" / "events")
+        
+        # 本機上傳歷史（SQLite，可依名稱、日期、雜湊、資料夾查詢）
+        try:
+            self.history = UploadHistory(Path.home() / ".katfile_uploader_logs" / "history.sqlite3")
+        except (sqlite3.Error, OSError) as e:
+            print(f"無法開啟上傳歷史資料庫: {e}")
+            self.history = None
+        
+        # 批次結束時匯出效能指標的目錄（可設為 node_exporter 的 textfile collector 目錄）
+        self.metrics_dir = tk.StringVar(value=str(Path.home() / ".katfile_uploader_logs" / "metrics"))
+        
+        # 效能分析模式（cProfile + 取樣堆疊 + tracemalloc，結果寫入每個工作階段的目錄）
+        self.profile_enabled = tk.BooleanVar(value=False)
+        self.profile_dir = Path.home() / ".katfile_uploader_logs" / "profiles"
+        
         # 載入設定
         self.load_config()
         
         # 建立GUI
         self.create_widgets()
         
+        # 背景執行緒的介面更新（合併後定時套用）
+        self.ui = UIDispatcher(self.root, self.update_file_status, lambda count: self.progress.step(count))
+        self.ui.subscribe(self.show_ui_snapshot)
+        self.ui.start()
+        self.refresh_dashboard()
+        
         # 建立改進的請求會話
         self.setup_session()
         
+        # 清除上次異常結束時遺留的暫存檔
+        self.cleanup_scratch_space()
+        
         # 如果有API金鑰，自動載入帳戶資訊
         if self.api_key.get().strip():
             self.load_account_info()
@@ -79,7 +2906,7 @@ class KatFileUploaderEnhanced:
             allowed_methods=["HEAD", "GET", "OPTIONS", "POST"]
         )
         
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        adapter = HTTPAdapter(max_retries=retry_strategy, pool_maxsize=10)
         self.session.mount("http://", adapter)
         self.session.mount("https://", adapter)
         
@@ -110,10 +2937,20 @@ class KatFileUploaderEnhanced:
         word_frame = ttk.Frame(notebook)
         notebook.add(word_frame, text="📄 文件記錄")
         
+        # 即時儀表板頁面
+        dashboard_frame = ttk.Frame(notebook)
+        notebook.add(dashboard_frame, text="📈 儀表板")
+        
+        # 上傳歷史頁面
+        history_frame = ttk.Frame(notebook)
+        notebook.add(history_frame, text="🗂️ 上傳歷史")
+        
         # 建立各頁面內容
         self.create_main_page(main_frame)
         self.create_compress_page(compress_frame)
         self.create_word_page(word_frame)
+        self.create_dashboard_page(dashboard_frame)
+        self.create_history_page(history_frame)
     
     def create_main_page(self, parent):
         """建立主要上傳頁面"""
@@ -154,6 +2991,11 @@ class KatFileUploaderEnhanced:
         ttk.Radiobutton(format_frame, text="ZIP格式（相容性好）", variable=self.compress_format, value="zip").pack(anchor=tk.W)
         ttk.Radiobutton(format_frame, text="7Z格式（壓縮率高）", variable=self.compress_format, value="7z").pack(anchor=tk.W)
         
+        level_frame = ttk.Frame(format_frame)
+        level_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Label(level_frame, text="壓縮等級 (0-9):").pack(side=tk.LEFT)
+        ttk.Spinbox(level_frame, from_=0, to=9, textvariable=self.compress_level, width=5).pack(side=tk.LEFT, padx=(5, 0))
+        
         # 密碼設定
         password_frame = ttk.LabelFrame(parent, text="壓縮密碼", padding="10")
         password_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -198,9 +3040,43 @@ class KatFileUploaderEnhanced:
                                  state="readonly", width=5)
         unit_combo.pack(side=tk.LEFT, padx=(5, 0))
         
+        # 未壓縮時的虛擬分割上傳
+        parallel_frame = ttk.Frame(self.split_options_frame)
+        parallel_frame.pack(fill=tk.X, pady=(5, 0))
+        
+        ttk.Label(parallel_frame, text="分割並行上傳數:").pack(side=tk.LEFT)
+        ttk.Spinbox(parallel_frame, from_=1, to=8, textvariable=self.parallel_uploads, width=5).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Label(parallel_frame, text="（未啟用壓縮時直接從原檔案分段上傳，不建立暫存檔）").pack(side=tk.LEFT, padx=(5, 0))
+        
         # 初始狀態設定
         self.toggle_split_options()
 
+        # 暫存空間設定
+        scratch_frame = ttk.LabelFrame(parent, text="暫存空間", padding="10")
+        scratch_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        ttk.Label(scratch_frame, text="壓縮暫存目錄（建議使用高速磁碟或記憶體磁碟）:").pack(anchor=tk.W)
+        
+        scratch_path_frame = ttk.Frame(scratch_frame)
+        scratch_path_frame.pack(fill=tk.X, pady=(5, 0))
+        
+        ttk.Entry(scratch_path_frame, textvariable=self.scratch_dir).pack(side=tk.LEFT, fill=tk.X, expand=True)
+        ttk.Button(scratch_path_frame, text="瀏覽", command=self.select_scratch_dir).pack(side=tk.RIGHT, padx=(5, 0))
+        
+        quota_frame = ttk.Frame(scratch_frame)
+        quota_frame.pack(fill=tk.X, pady=(5, 0))
+        
+        ttk.Label(quota_frame, text="容量上限 (GB):").pack(side=tk.LEFT)
+        ttk.Entry(quota_frame, textvariable=self.scratch_quota_gb, width=10).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Label(quota_frame, text="（超過上限時會等待已上傳的壓縮檔釋放空間後再繼續壓縮）").pack(side=tk.LEFT, padx=(5, 0))
+        
+        cache_frame = ttk.Frame(scratch_frame)
+        cache_frame.pack(fill=tk.X, pady=(5, 0))
+        
+        ttk.Checkbutton(cache_frame, text="保留壓縮檔快取（重試或重複上傳時不必重新壓縮），上限 (GB):",
+                        variable=self.cache_enabled).pack(side=tk.LEFT)
+        ttk.Entry(cache_frame, textvariable=self.cache_budget_gb, width=10).pack(side=tk.LEFT, padx=(5, 0))
+        
         # 壓縮測試按鈕
         ttk.Button(parent, text="🧪 測試壓縮", command=self.test_compression).pack(pady=10)
         
@@ -231,10 +3107,25 @@ class KatFileUploaderEnhanced:
         
         ttk.Checkbutton(
             enable_frame, 
-            text="自動生成Word文件記錄（每個檔案生成一份記錄）", 
+            text="自動生成記錄文件（每個檔案生成一份記錄）", 
             variable=self.generate_word
         ).pack(anchor=tk.W)
         
+        format_frame = ttk.Frame(enable_frame)
+        format_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Label(format_frame, text="記錄格式:").pack(side=tk.LEFT)
+        format_labels = {renderer.label: key for key, renderer in RECORD_RENDERERS.items()}
+        self.record_format_label = tk.StringVar(value=RECORD_RENDERERS[self.get_record_format()].label)
+        format_combo = ttk.Combobox(format_frame, textvariable=self.record_format_label,
+                                    values=list(format_labels), state="readonly", width=24)
+        format_combo.pack(side=tk.LEFT, padx=(5, 0))
+        format_combo.bind("<<ComboboxSelected>>",
+                          lambda e: self.record_format.set(format_labels[self.record_format_label.get()]))
+        self.record_format.trace_add("write", lambda *args: self.record_format_label.set(
+            RECORD_RENDERERS[self.get_record_format()].label))
+        ttk.Button(format_frame, text="📦 匯出全部記錄", command=self.export_all_records).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Label(enable_frame, text="Markdown／純文字／BBCode／HTML 不需載入 Word，產生速度較快；自訂範本只用於 .docx").pack(anchor=tk.W, pady=(5, 0))
+        
         # 範本設定
         template_frame = ttk.LabelFrame(parent, text="範本設定", padding="10")
         template_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -255,12 +3146,22 @@ class KatFileUploaderEnhanced:
         ttk.Button(default_frame, text="📄 使用內建範本", command=self.use_builtin_template).pack(side=tk.LEFT)
         ttk.Button(default_frame, text="🔍 預覽範本", command=self.preview_template).pack(side=tk.LEFT, padx=(10, 0))
         
+        # 校驗碼設定
+        digest_frame = ttk.LabelFrame(parent, text="校驗碼", padding="10")
+        digest_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        ttk.Label(digest_frame, text="上傳時同步計算（不需額外讀取檔案），並寫入記錄文件與上傳報告:").pack(anchor=tk.W)
+        digest_options = ttk.Frame(digest_frame)
+        digest_options.pack(fill=tk.X, pady=(5, 0))
+        ttk.Checkbutton(digest_options, text="MD5", variable=self.digest_md5).pack(side=tk.LEFT)
+        ttk.Checkbutton(digest_options, text="SHA-256", variable=self.digest_sha256).pack(side=tk.LEFT, padx=(10, 0))
+        
         # 輸出設定
         output_frame = ttk.LabelFrame(parent, text="輸出設定", padding="10")
         output_frame.pack(fill=tk.X, padx=10, pady=10)
         
-        ttk.Label(output_frame, text="Word文件將儲存到與原檔案相同的目錄").pack(anchor=tk.W)
-        ttk.Label(output_frame, text="檔案名稱格式：[原檔案名]_記錄.docx").pack(anchor=tk.W)
+        ttk.Label(output_frame, text="記錄文件將儲存到與原檔案相同的目錄").pack(anchor=tk.W)
+        ttk.Label(output_frame, text="檔案名稱格式：[原檔案名]_記錄.docx（其他格式使用對應副檔名）").pack(anchor=tk.W)
         
         # Word文件說明
         word_info_frame = ttk.LabelFrame(parent, text="說明", padding="10")
@@ -275,6 +3176,10 @@ class KatFileUploaderEnhanced:
 5. Word文件會儲存在與原檔案相同的目錄
 6. 支援批次生成，一次上傳多個檔案會生成多份記錄
 
+自訂範本可使用以下欄位（可任意排版，會自動填入）：
+{檔案名稱}  {影片大小}  {解壓縮密碼}  {檔案名稱+網址的超連結}
+{下載連結}  {校驗碼}  {上傳時間}
+
 內建範本包含以下欄位：
 - 檔案名稱
 - 影片格式
@@ -299,15 +3204,39 @@ class KatFileUploaderEnhanced:
     
     def toggle_split_options(self):
         """切換分割選項的可見性"""
-        if self.enable_split.get():
-            for widget in self.split_options_frame.winfo_children():
-                widget.configure(state="normal")
-        else:
-            for widget in self.split_options_frame.winfo_children():
-                try:
-                    widget.configure(state="disabled")
-                except:
-                    pass
+        state = "normal" if self.enable_split.get() else "disabled"
+        pending = list(self.split_options_frame.winfo_children())
+        while pending:
+            widget = pending.pop()
+            pending.extend(widget.winfo_children())
+            try:
+                if isinstance(widget, ttk.Combobox) and state == "normal":
+                    widget.configure(state="readonly")
+                else:
+                    widget.configure(state=state)
+            except:
+                pass
+    
+    def get_split_size_bytes(self):
+        """取得分割大小（位元組）"""
+        split_size = int(self.split_size.get())
+        if self.split_unit.get() == "GB":
+            split_size *= 1024
+        return split_size * 1024 * 1024
+    
+    def get_parallel_uploads(self):
+        """取得分割檔案的並行上傳數"""
+        try:
+            return max(1, min(8, int(self.parallel_uploads.get())))
+        except ValueError:
+            return 1
+    
+    def get_upload_block_size(self):
+        """取得上傳時每次讀取與送出的區塊大小（位元組，64 KB - 16 MB）"""
+        try:
+            return max(64, min(16 * 1024, int(self.upload_block_kb.get()))) * 1024
+        except ValueError:
+            return UPLOAD_BLOCK_SIZE
 
     def test_compression(self):
         """測試壓縮功能"""
@@ -338,17 +3267,97 @@ class KatFileUploaderEnhanced:
                 if compressed_file:
                     success_msg = f"✅ 壓縮測試成功！\n壓縮檔案：{compressed_file}"
                     self.root.after(0, lambda: messagebox.showinfo("測試成功", success_msg))
-                    self.root.after(0, lambda: self.log(f"✅ 測試壓縮成功：{compressed_file}"))
+                    self.log(f"✅ 測試壓縮成功：{compressed_file}")
                 else:
                     self.root.after(0, lambda: messagebox.showerror("測試失敗", "壓縮測試失敗"))
                     
             except Exception as e:
                 error_msg = f"❌ 壓縮測試錯誤：{str(e)}"
-                self.root.after(0, lambda: self.log(error_msg))
+                self.log(error_msg)
                 self.root.after(0, lambda: messagebox.showerror("錯誤", error_msg))
         
         threading.Thread(target=test_thread, daemon=True).start()
     
+    def select_scratch_dir(self):
+        """選擇壓縮暫存目錄"""
+        directory = filedialog.askdirectory(title="選擇壓縮暫存目錄")
+        if directory:
+            self.scratch_dir.set(directory)
+            self.log(f"📂 暫存目錄：{directory}")
+    
+    def get_scratch_quota_bytes(self):
+        """取得暫存空間容量上限（位元組）"""
+        try:
+            quota_gb = float(self.scratch_quota_gb.get())
+        except ValueError:
+            quota_gb = 20
+        return int(max(quota_gb, 0.1) * 1024 ** 3)
+    
+    def get_digest_names(self):
+        """取得已啟用的校驗碼演算法"""
+        names = []
+        if self.digest_md5.get():
+            names.append('md5')
+        if self.digest_sha256.get():
+            names.append('sha256')
+        return tuple(names)
+    
+    def collect_checksums(self, upload_infos):
+        """整理已上傳檔案的校驗碼（只保留設定中啟用的演算法）"""
+        names = self.get_digest_names()
+        checksums = []
+        for info in upload_infos:
+            entry = {name: info.digests[name] for name in names if info.digests.get(name)}
+            if entry:
+                entry['name'] = info.name
+                checksums.append(entry)
+        return checksums
+    
+    def get_compress_level(self):
+        """取得壓縮等級（0-9）"""
+        try:
+            return max(0, min(9, int(self.compress_level.get())))
+        except ValueError:
+            return 6
+    
+    def get_archive_cache(self):
+        """取得壓縮檔快取（位於暫存目錄下，未啟用時回傳 None）"""
+        if not self.cache_enabled.get():
+            return None
+        try:
+            budget = int(max(float(self.cache_budget_gb.get()), 0) * 1024 ** 3)
+        except ValueError:
+            budget = 50 * 1024 ** 3
+        cache_dir = Path(self.scratch_dir.get()) / "archive_cache"
+        if self.archive_cache is None or self.archive_cache.root_dir != cache_dir:
+            self.archive_cache = ArchiveCache(cache_dir, budget)
+        else:
+            self.archive_cache.budget_bytes = budget
+        return self.archive_cache
+    
+    def get_archive_cache_key(self, file_path):
+        """依來源檔案與目前的壓縮設定產生快取鍵"""
+        split_bytes = self.get_split_size_bytes() if self.enable_split.get() else 0
+        return ArchiveCache.make_key(
+            file_path, self.compress_format.get(), self.get_compress_level(),
+            self.compress_password.get().strip(), split_bytes
+        )
+    
+    def cleanup_scratch_space(self):
+        """啟動時清除當機或異常結束的工作階段遺留的暫存檔"""
+        manager = ScratchSpaceManager(self.scratch_dir.get(), self.get_scratch_quota_bytes())
+        
+        def cleanup_thread():
+            try:
+                freed = manager.cleanup_stale_sessions()
+                if freed:
+                    msg = f"🧹 已清除遺留的暫存檔：{self.format_file_size(freed)}"
+                    self.log(msg)
+            except Exception as e:
+                self.log(f"⚠️ 清除暫存檔失敗: {e}")
+        
+        threading.Thread(target=cleanup_thread, daemon=True).start()
+    
     def select_word_template(self):
         """選擇Word範本檔案"""
         template_file = filedialog.askopenfilename(
@@ -398,6 +3407,154 @@ class KatFileUploaderEnhanced:
             
             messagebox.showinfo("內建範本預覽", preview_text)
     
+    def create_dashboard_page(self, parent):
+        """建立即時儀表板頁面（資料來自 METRICS，每秒更新）"""
+        # 上傳速度圖
+        graph_frame = ttk.LabelFrame(parent, text="上傳速度（最近 60 秒）", padding="10")
+        graph_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        self.throughput_var = tk.StringVar(value="目前 0.00 MB/s｜平均 0.00 MB/s｜已上傳 0 B")
+        ttk.Label(graph_frame, textvariable=self.throughput_var).pack(anchor=tk.W)
+        self.throughput_canvas = tk.Canvas(graph_frame, height=160, background="white", highlightthickness=0)
+        self.throughput_canvas.pack(fill=tk.BOTH, expand=True, pady=(5, 0))
+        
+        bottom_frame = ttk.Frame(parent)
+        bottom_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        
+        # 工作者狀態
+        worker_frame = ttk.LabelFrame(bottom_frame, text="工作者狀態", padding="10")
+        worker_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        self.worker_tree = ttk.Treeview(worker_frame, columns=("state", "duration"), show="tree headings", height=8)
+        self.worker_tree.heading("#0", text="工作者")
+        self.worker_tree.heading("state", text="狀態")
+        self.worker_tree.heading("duration", text="持續時間")
+        self.worker_tree.column("#0", width=140)
+        self.worker_tree.column("state", width=200)
+        self.worker_tree.column("duration", width=80)
+        self.worker_tree.pack(fill=tk.BOTH, expand=True)
+        
+        # 佇列、暫存空間與計數
+        stats_frame = ttk.LabelFrame(bottom_frame, text="佇列與計數", padding="10")
+        stats_frame.pack(side=tk.LEFT, fill=tk.BOTH, padx=(10, 0))
+        
+        self.dashboard_vars = {}
+        rows = (
+            ('queue_upload', "待上傳（已壓縮）"),
+            ('queue_verify', "待校驗"),
+            ('queue_record', "待產生記錄"),
+            ('scratch', "暫存空間"),
+            ('uploads_completed', "上傳完成"),
+            ('upload_retries', "上傳重試"),
+            ('link_retries', "取得連結重試"),
+            ('upload_failures', "上傳失敗"),
+            ('compress_failures', "壓縮失敗"),
+            ('verify_mismatches', "校驗不符"),
+            ('record_failures', "記錄失敗"),
+            ('ui_updates', "介面更新（送出／套用）"),
+        )
+        for row, (key, label) in enumerate(rows):
+            ttk.Label(stats_frame, text=f"{label}:").grid(row=row, column=0, sticky=tk.W, pady=1)
+            self.dashboard_vars[key] = tk.StringVar(value="0")
+            ttk.Label(stats_frame, textvariable=self.dashboard_vars[key]).grid(row=row, column=1, sticky=tk.E,
+                                                                              padx=(10, 0))
+        
+        # 指標匯出
+        export_frame = ttk.LabelFrame(parent, text="指標匯出", padding="10")
+        export_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        ttk.Label(export_frame, text="每批結束時寫出 Prometheus textfile 與 JSON 摘要到:").pack(anchor=tk.W)
+        metrics_path_frame = ttk.Frame(export_frame)
+        metrics_path_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Entry(metrics_path_frame, textvariable=self.metrics_dir).pack(side=tk.LEFT, fill=tk.X, expand=True)
+        ttk.Button(metrics_path_frame, text="瀏覽", command=self.select_metrics_dir).pack(side=tk.RIGHT, padx=(5, 0))
+        ttk.Button(metrics_path_frame, text="📤 立即匯出", command=self.export_metrics).pack(side=tk.RIGHT, padx=(5, 0))
+        
+        # 上傳調校
+        tuning_frame = ttk.LabelFrame(parent, text="上傳調校", padding="10")
+        tuning_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        tuning_row = ttk.Frame(tuning_frame)
+        tuning_row.pack(fill=tk.X)
+        ttk.Label(tuning_row, text="上傳區塊 (KB):").pack(side=tk.LEFT)
+        ttk.Combobox(tuning_row, textvariable=self.upload_block_kb, width=8,
+                     values=[str(size // 1024) for size in PROBE_BLOCK_SIZES]).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Label(tuning_row, text="並行上傳數:").pack(side=tk.LEFT, padx=(15, 0))
+        ttk.Spinbox(tuning_row, from_=1, to=8, textvariable=self.parallel_uploads, width=5).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(tuning_row, text="🔍 網路診斷並調校", command=self.diagnose_and_tune).pack(side=tk.LEFT, padx=(15, 0))
+        self.tuning_var = tk.StringVar(value="尚未執行網路診斷")
+        ttk.Label(tuning_frame, textvariable=self.tuning_var).pack(anchor=tk.W, pady=(5, 0))
+        
+        ttk.Checkbutton(
+            export_frame,
+            text=f"🔬 效能分析模式（cProfile、取樣堆疊與記憶體追蹤，結果寫入 {self.profile_dir}；上傳會稍慢）",
+            variable=self.profile_enabled
+        ).pack(anchor=tk.W, pady=(5, 0))
+    
+    def create_history_page(self, parent):
+        """建立上傳歷史查詢頁面（資料來自本機 SQLite 歷史）"""
+        query_frame = ttk.LabelFrame(parent, text="查詢條件", padding="10")
+        query_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        self.history_query = {
+            'name': tk.StringVar(),
+            'digest': tk.StringVar(),
+            'folder': tk.StringVar(),
+            'status': tk.StringVar(),
+            'date_from': tk.StringVar(),
+            'date_to': tk.StringVar(),
+            'where': tk.StringVar(),
+        }
+        fields = (
+            ('name', "檔案名稱（部分比對）:", 0, 0, 30),
+            ('digest', "MD5 / SHA-256:", 0, 2, 40),
+            ('folder', "資料夾（ID 或名稱）:", 1, 0, 30),
+            ('date_from', "日期從 (YYYY-MM-DD):", 1, 2, 12),
+            ('date_to', "日期到 (YYYY-MM-DD):", 2, 2, 12),
+        )
+        for key, label, row, column, width in fields:
+            ttk.Label(query_frame, text=label).grid(row=row, column=column, sticky=tk.W, pady=2)
+            ttk.Entry(query_frame, textvariable=self.history_query[key], width=width).grid(
+                row=row, column=column + 1, sticky=tk.W, padx=(5, 15), pady=2)
+        ttk.Label(query_frame, text="狀態:").grid(row=2, column=0, sticky=tk.W, pady=2)
+        ttk.Combobox(query_frame, textvariable=self.history_query['status'], width=10, state="readonly",
+                     values=("", "成功", "失敗", "校驗失敗")).grid(row=2, column=1, sticky=tk.W, padx=(5, 15), pady=2)
+        ttk.Label(query_frame, text="進階 SQL 條件:").grid(row=3, column=0, sticky=tk.W, pady=2)
+        ttk.Entry(query_frame, textvariable=self.history_query['where']).grid(
+            row=3, column=1, columnspan=3, sticky=tk.EW, padx=(5, 15), pady=2)
+        ttk.Label(query_frame, text="例如 size > 1073741824 AND status = '成功'（唯讀執行）",
+                  foreground="gray").grid(row=4, column=1, columnspan=3, sticky=tk.W, padx=(5, 0))
+        query_frame.columnconfigure(3, weight=1)
+        
+        button_frame = ttk.Frame(query_frame)
+        button_frame.grid(row=5, column=0, columnspan=4, sticky=tk.W, pady=(8, 0))
+        ttk.Button(button_frame, text="🔍 查詢", command=self.search_history).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="📄 匯出查詢結果", command=self.export_history_report).pack(side=tk.LEFT, padx=(5, 0))
+        
+        # 查詢結果
+        result_frame = ttk.LabelFrame(parent, text="查詢結果（雙擊複製下載連結）", padding="10")
+        result_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        
+        self.history_count_var = tk.StringVar(value="")
+        ttk.Label(result_frame, textvariable=self.history_count_var).pack(anchor=tk.W, pady=(0, 5))
+        
+        columns = ("time", "size", "status", "folder", "link")
+        tree_frame = ttk.Frame(result_frame)
+        tree_frame.pack(fill=tk.BOTH, expand=True)
+        self.history_tree = ttk.Treeview(tree_frame, columns=columns, show="tree headings")
+        self.history_tree.heading("#0", text="檔案名稱")
+        for column, title, width in (("time", "上傳時間", 140), ("size", "大小", 80), ("status", "狀態", 70),
+                                     ("folder", "資料夾", 120), ("link", "下載連結", 300)):
+            self.history_tree.heading(column, text=title)
+            self.history_tree.column(column, width=width)
+        self.history_tree.column("#0", width=260)
+        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.history_tree.yview)
+        self.history_tree.configure(yscrollcommand=scrollbar.set)
+        self.history_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.history_tree.bind("<Double-1>", self.copy_history_links)
+        self.history_links = {}
+    
     def create_left_panel(self, parent):
         """建立左側面板（API設定和帳戶資訊）"""
         # API金鑰設定區域
@@ -454,6 +3611,7 @@ class KatFileUploaderEnhanced:
         self.folder_tree = ttk.Treeview(folder_frame, columns=("id",), show="tree")
         self.folder_tree.pack(fill=tk.BOTH, expand=True)
         self.folder_tree.bind("<Double-1>", self.on_folder_select)
+        self.folder_tree.bind("<<TreeviewOpen>>", self.on_folder_open)
     
     def create_right_panel(self, parent):
         """建立右側面板（檔案上傳和日誌）"""
@@ -469,6 +3627,8 @@ class KatFileUploaderEnhanced:
         self.target_folder_var = tk.StringVar(value="根目錄")
         self.target_folder_label = ttk.Label(target_frame, textvariable=self.target_folder_var, foreground="blue")
         self.target_folder_label.pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Checkbutton(target_frame, text="🪞 鏡像資料夾結構（依子資料夾建立對應的遠端資料夾）",
+                        variable=self.mirror_folders).pack(side=tk.LEFT, padx=(15, 0))
         
         # 檔案選擇按鈕
         button_frame = ttk.Frame(file_frame)
@@ -478,6 +3638,15 @@ class KatFileUploaderEnhanced:
         ttk.Button(button_frame, text="📂 選擇資料夾", command=self.select_folder).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(button_frame, text="🗑️ 清除列表", command=self.clear_files).pack(side=tk.LEFT)
         
+        # 資料夾掃描篩選
+        filter_frame = ttk.Frame(file_frame)
+        filter_frame.pack(fill=tk.X, pady=(0, 10))
+        ttk.Label(filter_frame, text="資料夾篩選 包含:").pack(side=tk.LEFT)
+        ttk.Entry(filter_frame, textvariable=self.scan_include, width=20).pack(side=tk.LEFT, padx=(5, 10))
+        ttk.Label(filter_frame, text="排除:").pack(side=tk.LEFT)
+        ttk.Entry(filter_frame, textvariable=self.scan_exclude, width=20).pack(side=tk.LEFT, padx=(5, 10))
+        ttk.Label(filter_frame, text="例如 *.mp4, *.mkv；排除 *.tmp, .git", foreground="gray").pack(side=tk.LEFT)
+        
         # 檔案列表
         self.file_tree = ttk.Treeview(file_frame, columns=("size", "status"), show="tree headings", height=6)
         self.file_tree.heading("#0", text="檔案名稱")
@@ -487,6 +3656,15 @@ class KatFileUploaderEnhanced:
         self.file_tree.column("status", width=100)
         self.file_tree.pack(fill=tk.X)
         
+        # 分頁控制
+        page_frame = ttk.Frame(file_frame)
+        page_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Button(page_frame, text="◀ 上一頁", command=lambda: self.show_file_page(self.file_page - 1)).pack(side=tk.LEFT)
+        ttk.Button(page_frame, text="下一頁 ▶", command=lambda: self.show_file_page(self.file_page + 1)).pack(side=tk.LEFT, padx=(5, 0))
+        self.file_page_var = tk.StringVar(value="")
+        ttk.Label(page_frame, textvariable=self.file_page_var, foreground="gray").pack(side=tk.LEFT, padx=(10, 0))
+        self.update_file_page_label()
+        
         # 上傳控制
         upload_frame = ttk.Frame(file_frame)
         upload_frame.pack(fill=tk.X, pady=(10, 0))
@@ -497,12 +3675,18 @@ class KatFileUploaderEnhanced:
         self.progress = ttk.Progressbar(upload_frame, mode='determinate')
         self.progress.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(10, 0))
         
+        # 文件記錄階段狀態
+        self.record_stage_var = tk.StringVar(value="")
+        ttk.Label(file_frame, textvariable=self.record_stage_var, foreground="gray").pack(anchor=tk.W, pady=(5, 0))
+        
         # 日誌區域
         log_frame = ttk.LabelFrame(parent, text="操作日誌", padding="10")
         log_frame.pack(fill=tk.BOTH, expand=True)
         
         self.log_text = scrolledtext.ScrolledText(log_frame, height=15)
         self.log_text.pack(fill=tk.BOTH, expand=True)
+        self.log_sink.attach(self.log_text)
+        self.drain_log()
         
         # 日誌控制按鈕
         log_buttons = ttk.Frame(log_frame)
@@ -510,43 +3694,17 @@ class KatFileUploaderEnhanced:
         
         ttk.Button(log_buttons, text="清除日誌", command=self.clear_log).pack(side=tk.LEFT)
         ttk.Button(log_buttons, text="儲存日誌", command=self.save_log).pack(side=tk.LEFT, padx=(10, 0))
-        ttk.Button(log_buttons, text="📄 生成Word報告", command=self.generate_upload_report).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Button(log_buttons, text="📄 匯出上傳報告", command=self.generate_upload_report).pack(side=tk.LEFT, padx=(10, 0))
     
     def add_hyperlink(self, paragraph, url, text):
         """在段落中添加超連結"""
-        try:
-            # 建立超連結元素
-            hyperlink = OxmlElement('w:hyperlink')
-            hyperlink.set(qn('r:id'), paragraph.part.relate_to(url, "http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink", is_external=True))
-            
-            # 建立文字運行
-            run = OxmlElement('w:r')
-            
-            # 設定超連結樣式
-            rPr = OxmlElement('w:rPr')
-            color = OxmlElement('w:color')
-            color.set(qn('w:val'), '0000FF')  # 藍色
-            underline = OxmlElement('w:u')
-            underline.set(qn('w:val'), 'single')
-            rPr.append(color)
-            rPr.append(underline)
-            run.append(rPr)
-            
-            # 添加文字
-            text_elem = OxmlElement('w:t')
-            text_elem.text = text
-            run.append(text_elem)
-            
-            hyperlink.append(run)
-            paragraph._p.append(hyperlink)
-            
-            return True
-        except Exception as e:
-            print(f"建立超連結失敗: {e}")
-            return False
+        return add_hyperlink(paragraph, url, text)
 
-    def split_file(self, file_path, split_size_mb):
-        """分割檔案"""
+    def split_file(self, file_path, split_size_mb, output_dir=None, digests=(), digest_results=None):
+        """分割檔案（分割檔寫入 output_dir，未指定時寫在原檔案旁）
+
+        指定 digests 時會在分割的同時計算原檔雜湊，結果寫入 digest_results。
+        """
         try:
             file_path = Path(file_path)
             if not file_path.exists():
@@ -560,46 +3718,97 @@ class KatFileUploaderEnhanced:
                 return [file_path]
             
             split_files = []
-            output_dir = file_path.parent / f"{file_path.stem}_parts"
-            output_dir.mkdir(exist_ok=True)
+            if output_dir is None:
+                output_dir = file_path.parent / f"{file_path.stem}_parts"
+            output_dir = Path(output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
             
             self.log(f"✂️ 開始分割檔案：{file_path.name}")
+            started = time.perf_counter()
             
+            # 以固定大小的區塊複製，記憶體用量與分割大小無關
+            source_digests = StreamDigests(digests)
+            block = bytearray(UPLOAD_BLOCK_SIZE)
+            view = memoryview(block)
             with open(file_path, 'rb') as input_file:
                 part_num = 1
                 while True:
-                    chunk = input_file.read(split_size_bytes)
-                    if not chunk:
-                        break
-                    
+                    part_started = time.perf_counter()
                     part_file = output_dir / f"{file_path.stem}.part{part_num:03d}"
+                    part_bytes = 0
                     with open(part_file, 'wb') as part_output:
-                        part_output.write(chunk)
+                        while part_bytes < split_size_bytes:
+                            n = input_file.readinto(view[:min(UPLOAD_BLOCK_SIZE, split_size_bytes - part_bytes)])
+                            if not n:
+                                break
+                            source_digests.update_at(source_digests.hashed, view[:n])
+                            part_output.write(view[:n])
+                            part_bytes += n
+                    if not part_bytes:
+                        part_file.unlink()
+                        break
                     
                     split_files.append(part_file)
                     self.log(f"📄 建立分割檔案：{part_file.name}")
+                    self.event_log.emit('split', 'part', file=str(file_path), part=part_num, bytes=part_bytes,
+                                        duration=time.perf_counter() - part_started)
                     part_num += 1
             
+            if digest_results is not None:
+                digest_results.update(source_digests.hexdigests(file_size))
+            
             self.log(f"✅ 分割完成：共 {len(split_files)} 個檔案")
+            METRICS.observe('split', time.perf_counter() - started)
+            self.event_log.emit('split', 'done', file=str(file_path), bytes=file_size, parts=len(split_files),
+                                duration=time.perf_counter() - started)
             return split_files
             
         except Exception as e:
+            self.event_log.emit('split', 'error', file=str(file_path), error=str(e))
             raise Exception(f"分割失敗: {str(e)}")
 
-    def compress_file(self, file_path, output_dir):
-        """壓縮檔案（支援分割）"""
+    def write_archive(self, source, archive_path, arcname, digests=()):
+        """依目前的格式、等級與密碼設定建立壓縮檔，回傳壓縮過程中順便算出的原檔雜湊"""
+        password = self.compress_password.get().strip() or None
+        level = self.get_compress_level()
+        
+        with HashingReader(source, digests) as reader:
+            if self.compress_format.get() == "zip":
+                # ZIP壓縮
+                with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=level) as zipf:
+                    if password:
+                        zipf.setpassword(password.encode('utf-8'))
+                    zinfo = zipfile.ZipInfo.from_file(source, arcname)
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                    zinfo._compresslevel = level
+                    with zipf.open(zinfo, 'w') as dest:
+                        shutil.copyfileobj(reader, dest, UPLOAD_BLOCK_SIZE)
+            else:
+                # 7Z壓縮
+                filters = [{'id': py7zr.FILTER_LZMA2, 'preset': level}]
+                if password:
+                    filters.append({'id': py7zr.FILTER_CRYPTO_AES256_SHA256})
+                with py7zr.SevenZipFile(archive_path, 'w', filters=filters, password=password) as archive:
+                    archive.writef(reader, arcname)
+            
+            return reader.hexdigests()
+    
+    def compress_file(self, file_path, output_dir, digest_results=None):
+        """壓縮檔案（支援分割）
+
+        原檔的校驗碼在分割或壓縮讀取時一併計算，寫入 digest_results。
+        """
         try:
             file_path = Path(file_path)
             output_dir = Path(output_dir)
             
             # 檢查是否需要分割
             if self.enable_split.get():
-                split_size = int(self.split_size.get())
-                if self.split_unit.get() == "GB":
-                    split_size *= 1024
+                split_size = self.get_split_size_bytes() // (1024 * 1024)
                 
-                # 先分割檔案
-                split_files = self.split_file(file_path, split_size)
+                # 先分割檔案（分割暫存檔與壓縮檔放在同一個暫存目錄）
+                split_files = self.split_file(file_path, split_size, output_dir / f"{file_path.stem}_parts",
+                                              self.get_digest_names(), digest_results)
                 
                 if len(split_files) > 1:
                     # 需要分割，壓縮所有分割檔案
@@ -612,23 +3821,19 @@ class KatFileUploaderEnhanced:
                         else:  # 7z
                             compressed_file = output_dir / f"{base_name}.part{i:03d}.7z"
                         
-                        password = self.compress_password.get().strip() if self.compress_password.get().strip() else None
-                        
                         self.log(f"🗜️ 壓縮分割檔案：{split_file.name}")
+                        started = time.perf_counter()
                         
-                        if self.compress_format.get() == "zip":
-                            # ZIP壓縮
-                            with zipfile.ZipFile(compressed_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                                if password:
-                                    zipf.setpassword(password.encode('utf-8'))
-                                zipf.write(split_file, split_file.name)
-                        else:
-                            # 7Z壓縮
-                            with py7zr.SevenZipFile(compressed_file, 'w', password=password) as archive:
-                                archive.write(split_file, split_file.name)
+                        self.write_archive(split_file, compressed_file, split_file.name)
+                        METRICS.observe('compress', time.perf_counter() - started)
                         
                         compressed_files.append(str(compressed_file))
                         self.log(f"✅ 壓縮完成：{compressed_file.name}")
+                        self.event_log.emit('compress', 'done', file=str(file_path), part=i,
+                                            bytes=split_file.stat().st_size,
+                                            output_bytes=compressed_file.stat().st_size,
+                                            format=self.compress_format.get(), level=self.get_compress_level(),
+                                            duration=time.perf_counter() - started)
                     
                     # 清理分割檔案
                     for split_file in split_files:
@@ -644,207 +3849,402 @@ class KatFileUploaderEnhanced:
             else:
                 compressed_file = output_dir / f"{file_path.stem}.7z"
             
-            password = self.compress_password.get().strip() if self.compress_password.get().strip() else None
-            
             self.log(f"🗜️ 開始壓縮：{file_path.name}")
+            started = time.perf_counter()
             
-            if self.compress_format.get() == "zip":
-                # ZIP壓縮
-                with zipfile.ZipFile(compressed_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    if password:
-                        zipf.setpassword(password.encode('utf-8'))
-                    zipf.write(file_path, file_path.name)
-            else:
-                # 7Z壓縮
-                with py7zr.SevenZipFile(compressed_file, 'w', password=password) as archive:
-                    archive.write(file_path, file_path.name)
+            source_digests = self.write_archive(file_path, compressed_file, file_path.name, self.get_digest_names())
+            METRICS.observe('compress', time.perf_counter() - started)
+            if digest_results is not None:
+                digest_results.update(source_digests)
             
             self.log(f"✅ 壓縮完成：{compressed_file.name}")
+            self.event_log.emit('compress', 'done', file=str(file_path), bytes=file_path.stat().st_size,
+                                output_bytes=compressed_file.stat().st_size,
+                                format=self.compress_format.get(), level=self.get_compress_level(),
+                                duration=time.perf_counter() - started)
             return [str(compressed_file)]
             
         except Exception as e:
-            self.log(f"❌ 壓縮失敗：{str(e)}")
+            self.log(f"❌ 壓縮失敗：{str(e)}")
+            self.event_log.emit('compress', 'error', file=str(file_path), error=str(e))
+            return None
+    
+    def get_record_name(self, compressed_files):
+        """取得記錄使用的名稱（分割檔案時去掉 .part001）"""
+        if isinstance(compressed_files, list) and len(compressed_files) > 1:
+            return Path(compressed_files[0]).stem.replace('.part001', '')
+        compressed_file = compressed_files[0] if isinstance(compressed_files, list) else compressed_files
+        return Path(compressed_file).stem
+    
+    def build_record_job(self, file_info, download_links, compressed_files, checksums=None):
+        """整理產生記錄文件所需的資料（只含可序列化的內容，可交給子程序處理）"""
+        links = download_links if isinstance(download_links, list) else [download_links]
+        files = compressed_files if isinstance(compressed_files, list) else [compressed_files]
+        record_name = self.get_record_name(compressed_files)
+        
+        if self.compress_enabled.get() and self.compress_password.get().strip():
+            password = self.compress_password.get().strip()
+        else:
+            password = "無"
+        
+        template_path = self.word_template_path if self.word_template_path and os.path.exists(self.word_template_path) else ""
+        fmt = self.get_record_format()
+        
+        return {
+            'format': fmt,
+            'template_path': template_path,
+            'output_path': str(Path(file_info.path).parent / f"{record_name}_記錄{RECORD_RENDERERS[fmt].extension}"),
+            'title_name': file_info.name,
+            'record_name': record_name,
+            'size_text': self.format_file_size(file_info.size),
+            'password': password,
+            'links': list(links),
+            'file_names': [Path(f).name for f in files],
+            'checksums': checksums or [],
+            'upload_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+    
+    def get_record_format(self):
+        """取得記錄文件格式（未知的設定值視為 docx）"""
+        fmt = self.record_format.get()
+        return fmt if fmt in RECORD_RENDERERS else 'docx'
+    
+    def generate_word_document(self, file_info, download_links, compressed_files, checksums=None):
+        """生成記錄文件（同步執行，格式依記錄格式設定）"""
+        try:
+            job = self.build_record_job(file_info, download_links, compressed_files, checksums)
+            word_path, seconds = render_record(job)
+            self.log(f"📄 記錄文件已生成：{word_path}")
+            self.event_log.emit('record', 'done', file=file_info.path, name=file_info.name,
+                                format=job['format'], output=word_path, duration=seconds)
+            return word_path
+            
+        except Exception as e:
+            self.log(f"❌ 記錄文件生成失敗：{str(e)}")
+            self.event_log.emit('record', 'error', file=file_info.path, name=file_info.name,
+                                format=self.get_record_format(), error=str(e))
+            return None
+    
+    def submit_word_document(self, index, file_info, download_links, compressed_files, checksums=None, record=None):
+        """保存記錄資料供批次匯出；啟用記錄文件時交給背景產生階段，完成後更新狀態與日誌"""
+        job = self.build_record_job(file_info, download_links, compressed_files, checksums)
+        if record is not None:
+            record.record_job = job
+        if not self.generate_word.get():
+            return
+        
+        def on_done(word_path, error, seconds):
+            self.event_log.emit('record', 'done' if word_path else 'error', file=file_info.path,
+                                name=file_info.name, format=job['format'], output=word_path,
+                                duration=seconds if word_path else None, error=str(error) if error else None)
+            if word_path:
+                word_msg = f"📄 記錄文件: {word_path}"
+                self.log(word_msg)
+                if record is None or record.status == '成功':
+                    self.ui.status(index, "✅ 完成")
+            else:
+                error_msg = f"❌ 記錄文件生成失敗：{error}"
+                self.log(error_msg)
+                self.ui.status(index, "⚠️ 文件生成失敗")
+        
+        self.ui.status(index, "生成文件...")
+        self.record_stage.submit(job, on_done)
+    
+    def export_all_records(self):
+        """把本次所有上傳的記錄以文字類格式匯出成單一檔案（不需 python-docx）"""
+        jobs = [record.record_job for record in self.upload_records if record.record_job]
+        if not jobs:
+            messagebox.showinfo("提示", "沒有可匯出的上傳記錄")
+            return
+        
+        fmt = self.get_record_format()
+        if not RECORD_RENDERERS[fmt].bulk:
+            fmt = 'text'
+        filetypes = [(renderer.label, f"*{renderer.extension}")
+                     for renderer in RECORD_RENDERERS.values() if renderer.bulk]
+        filetypes.sort(key=lambda item: item[1] != f"*{RECORD_RENDERERS[fmt].extension}")
+        export_file = filedialog.asksaveasfilename(
+            title="匯出全部記錄",
+            defaultextension=RECORD_RENDERERS[fmt].extension,
+            filetypes=filetypes + [("所有檔案", "*.*")]
+        )
+        if not export_file:
+            return
+        
+        # 依副檔名決定格式（.bbcode.txt 優先於 .txt）
+        for renderer in sorted(RECORD_RENDERERS.values(), key=lambda r: -len(r.extension)):
+            if renderer.bulk and export_file.lower().endswith(renderer.extension):
+                fmt = renderer.key
+                break
+        
+        try:
+            export_records(export_file, jobs, fmt)
+            self.log(f"📦 已匯出 {len(jobs)} 筆記錄（{RECORD_RENDERERS[fmt].label}）：{export_file}")
+            messagebox.showinfo("成功", f"已匯出 {len(jobs)} 筆記錄到：{export_file}")
+        except Exception as e:
+            error_msg = f"❌ 匯出記錄失敗：{str(e)}"
+            self.log(error_msg)
+            messagebox.showerror("錯誤", error_msg)
+    
+    def refresh_record_stage_status(self):
+        """更新文件記錄階段的佇列與耗時顯示（上傳期間定時執行）"""
+        stats = self.record_stage.stats()
+        if stats['completed'] or stats['queued']:
+            self.record_stage_var.set(
+                f"📄 文件記錄：佇列 {stats['queued']}｜完成 {stats['completed']}｜失敗 {stats['failed']}｜"
+                f"平均 {stats['avg_seconds']:.2f} 秒｜最近 {stats['last_seconds']:.2f} 秒"
+            )
+        if self.is_uploading or stats['queued']:
+            self.root.after(500, self.refresh_record_stage_status)
+    
+    def refresh_dashboard(self):
+        """更新儀表板（每秒執行一次）"""
+        try:
+            snapshot = METRICS.snapshot()
+            counters, gauges = snapshot['counters'], snapshot['gauges']
+            series = METRICS.throughput_series(60)
+            
+            uploaded = counters.get('upload_bytes', 0)
+            average = uploaded / (1024 * 1024) / snapshot['uptime'] if snapshot['uptime'] else 0.0
+            self.throughput_var.set(f"目前 {series[-1]:.2f} MB/s｜平均 {average:.2f} MB/s｜"
+                                    f"已上傳 {format_file_size(uploaded)}")
+            self.draw_throughput(series)
+            
+            # 工作者狀態（只更新有變動的列）
+            workers = snapshot['workers']
+            for item in self.worker_tree.get_children():
+                if item not in workers:
+                    self.worker_tree.delete(item)
+            for name in sorted(workers):
+                state, seconds = workers[name]
+                values = (state, f"{seconds:.0f} 秒")
+                if self.worker_tree.exists(name):
+                    self.worker_tree.item(name, values=values)
+                else:
+                    self.worker_tree.insert("", tk.END, iid=name, text=name, values=values)
+            
+            for key, var in self.dashboard_vars.items():
+                if key == 'ui_updates':
+                    continue  # 由 show_ui_snapshot 更新
+                if key == 'scratch':
+                    var.set(f"{format_file_size(gauges.get('scratch_reserved', 0))} / "
+                            f"{format_file_size(gauges.get('scratch_quota', 0))}")
+                else:
+                    var.set(str(gauges.get(key, counters.get(key, 0))))
+        finally:
+            self.root.after(1000, self.refresh_dashboard)
+    
+    def show_ui_snapshot(self, snapshot):
+        """介面更新合併的效果：背景執行緒送出的更新數與實際套用到介面的次數"""
+        self.dashboard_vars['ui_updates'].set(f"{snapshot['posted']} / {snapshot['applied']}")
+    
+    def start_profiler(self):
+        """開始分析本次上傳工作階段（須在建立工作執行緒之前呼叫）"""
+        session_dir = self.profile_dir / datetime.now().strftime('%Y%m%d-%H%M%S')
+        stage_functions = {
+            "壓縮": [self.compress_file, self.write_archive, self.split_file],
+            "上傳": [self._upload_single_file, self.upload_virtual_parts],
+            "校驗": [self.fetch_file_info, self.on_verification_result],
+            "記錄": [self.submit_word_document, render_record],
+            "介面": [self.drain_log, self.refresh_dashboard, self.update_file_status],
+        }
+        try:
+            profiler = SessionProfiler(session_dir, stage_functions)
+            profiler.start()
+        except Exception as e:
+            self.log(f"⚠️ 無法啟動效能分析: {e}")
             return None
+        self.log(f"🔬 效能分析已啟動：{session_dir}")
+        if profiler.profile_error:
+            self.log(f"⚠️ cProfile 無法啟用（{profiler.profile_error}），只記錄取樣堆疊與記憶體配置")
+        return profiler
     
-    def generate_word_document(self, file_info, download_links, compressed_files):
-        """生成Word文件記錄"""
+    def stop_profiler(self, profiler):
+        """停止分析並寫出結果"""
         try:
-            if self.word_template_path and os.path.exists(self.word_template_path):
-                # 使用自訂範本
-                doc = Document(self.word_template_path)
-            else:
-                # 使用內建範本
-                doc = Document()
-                
-                # 建立標題
-                title = doc.add_heading(f"{file_info['name']}@MP4@KF@無碼", level=1)
-                title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                
-                # 添加空行
-                doc.add_paragraph()
-                
-                # 建立資訊表格
-                table = doc.add_table(rows=6, cols=2)
-                table.style = 'Table Grid'
-                
-                # 取得壓縮檔名稱（用於顯示）
-                if isinstance(compressed_files, list) and len(compressed_files) > 1:
-                    # 分割檔案情況，使用基礎名稱
-                    compressed_name = Path(compressed_files[0]).stem.replace('.part001', '')
-                else:
-                    # 單一檔案情況
-                    compressed_file = compressed_files[0] if isinstance(compressed_files, list) else compressed_files
-                    compressed_name = Path(compressed_file).stem
-                
-                # 填入資訊
-                cells = table.rows[0].cells
-                cells[0].text = "【影片名稱】"
-                cells[1].text = f"：{compressed_name}"
-                
-                cells = table.rows[1].cells
-                cells[0].text = "【影片格式】"
-                cells[1].text = "：MP4"
-                
-                cells = table.rows[2].cells
-                cells[0].text = "【影片大小】"
-                cells[1].text = f"：{self.format_file_size(file_info['size'])}"
-                
-                cells = table.rows[3].cells
-                cells[0].text = "【影片說明】"
-                cells[1].text = "：無碼"
-                
-                cells = table.rows[4].cells
-                cells[0].text = "【解壓密碼】"
-                if self.compress_enabled.get() and self.compress_password.get().strip():
-                    cells[1].text = f"：{self.compress_password.get().strip()}"
-                else:
-                    cells[1].text = "：無"
-                
-                cells = table.rows[5].cells
-                cells[0].text = "【影片載點】"
-                # 添加超連結
-                paragraph = cells[1].paragraphs[0]
-                paragraph.text = "："
-                
-                # 處理多個下載連結（分割檔案）
-                if isinstance(download_links, list) and len(download_links) > 1:
-                    for i, (compressed_file, download_link) in enumerate(zip(compressed_files, download_links)):
-                        if i > 0:
-                            paragraph.add_run("\n")
-                        
-                        part_name = Path(compressed_file).name
-                        hyperlink_success = self.add_hyperlink(paragraph, download_link, part_name)
-                        if not hyperlink_success:
-                            run = paragraph.add_run(f"{part_name}")
-                            run.font.color.rgb = RGBColor(0, 0, 255)
-                else:
-                    # 單一檔案
-                    download_link = download_links[0] if isinstance(download_links, list) else download_links
-                    compressed_file = compressed_files[0] if isinstance(compressed_files, list) else compressed_files
-                    file_name = Path(compressed_file).name
-                    
-                    hyperlink_success = self.add_hyperlink(paragraph, download_link, file_name)
-                    if not hyperlink_success:
-                        run = paragraph.add_run(f"{file_name}")
-                        run.font.color.rgb = RGBColor(0, 0, 255)
-                
-                # 添加空行和截圖區域
-                doc.add_paragraph()
-                doc.add_paragraph("【影片截圖】：")
-                doc.add_paragraph()
-                
-                # 添加固定內容與超連結
-                eli_para = doc.add_paragraph()
-                eli_hyperlink = self.add_hyperlink(eli_para, "https://www.eyny.com/forum-230-1.html", "我的伊莉所有帖子")
-                if not eli_hyperlink:
-                    run = eli_para.add_run("我的伊莉所有帖子")
-                    run.font.color.rgb = RGBColor(0, 0, 255)
-                
-                # 添加標籤
-                doc.add_paragraph("破處, 國產, 學妹, 蘿莉, 處女")
-            
-            # 儲存Word文件（使用壓縮檔名稱）
-            file_dir = Path(file_info['path']).parent
-            
-            # 取得壓縮檔名稱作為Word文件名稱
-            if isinstance(compressed_files, list) and len(compressed_files) > 1:
-                # 分割檔案情況，使用基礎名稱
-                compressed_name = Path(compressed_files[0]).stem.replace('.part001', '')
-            else:
-                # 單一檔案情況
-                compressed_file = compressed_files[0] if isinstance(compressed_files, list) else compressed_files
-                compressed_name = Path(compressed_file).stem
-            
-            word_filename = f"{compressed_name}_記錄.docx"
-            word_path = file_dir / word_filename
+            session_dir = profiler.stop()
+            self.log(f"🔬 效能分析結果：{session_dir}（profile.pstats、stacks.collapsed、memory.txt）")
+        except Exception as e:
+            self.log(f"⚠️ 寫出效能分析結果失敗: {e}")
+    
+    def select_metrics_dir(self):
+        """選擇指標匯出目錄"""
+        directory = filedialog.askdirectory(title="選擇指標匯出目錄", initialdir=self.metrics_dir.get())
+        if directory:
+            self.metrics_dir.set(directory)
+            self.save_config()
+    
+    def export_metrics(self):
+        """寫出 Prometheus textfile（原子替換，供 node_exporter 讀取）與本批的 JSON 摘要"""
+        try:
+            directory = Path(self.metrics_dir.get())
+            directory.mkdir(parents=True, exist_ok=True)
             
-            doc.save(str(word_path))
+            prom_path = directory / "katfile_uploader.prom"
+            temp_path = prom_path.with_suffix(".prom.tmp")
+            temp_path.write_text(METRICS.prometheus_text(), encoding='utf-8')
+            os.replace(temp_path, prom_path)
             
-            self.log(f"📄 Word文件已生成：{word_path}")
-            return str(word_path)
+            summary_path = directory / f"metrics-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+            with open(summary_path, 'w', encoding='utf-8') as f:
+                json.dump(METRICS.summary(), f, ensure_ascii=False, indent=2)
             
+            self.log(f"📈 效能指標已匯出：{prom_path}、{summary_path.name}")
+            return summary_path
         except Exception as e:
-            self.log(f"❌ Word文件生成失敗：{str(e)}")
+            self.log(f"⚠️ 匯出效能指標失敗: {e}")
             return None
     
+    def draw_throughput(self, series):
+        """在畫布上繪製上傳速度折線圖"""
+        canvas = self.throughput_canvas
+        canvas.delete("all")
+        width = max(canvas.winfo_width(), 100)
+        height = max(canvas.winfo_height(), 60)
+        top = max(max(series), 1.0)
+        pad = 20
+        
+        canvas.create_text(4, 4, anchor=tk.NW, text=f"{top:.1f} MB/s", fill="gray")
+        canvas.create_line(0, height - pad, width, height - pad, fill="lightgray")
+        step = width / max(len(series) - 1, 1)
+        points = []
+        for n, value in enumerate(series):
+            points.extend((n * step, height - pad - value / top * (height - 2 * pad)))
+        if len(points) >= 4:
+            canvas.create_line(*points, fill="#1f77b4", width=2)
+    
     def generate_upload_report(self):
-        """生成上傳報告"""
+        """生成上傳報告（Word / CSV / JSONL / HTML）"""
         if not self.upload_records:
             messagebox.showinfo("提示", "沒有上傳記錄可生成報告")
             return
         
+        # 選擇儲存位置，格式由副檔名決定
+        report_file = filedialog.asksaveasfilename(
+            title="儲存上傳報告",
+            defaultextension=".docx",
+            filetypes=[("Word文件", "*.docx"), ("CSV檔案", "*.csv"), ("JSON Lines", "*.jsonl"),
+                       ("HTML網頁", "*.html"), ("所有檔案", "*.*")]
+        )
+        
+        if not report_file:
+            return
+        
+        records = list(self.upload_records)
+        self.log(f"📊 正在生成上傳報告（{len(records)} 筆記錄）...")
+        
+        def export_thread():
+            try:
+                start = time.perf_counter()
+                export_report(report_file, records)
+                elapsed = time.perf_counter() - start
+                self.log(f"📊 上傳報告已生成：{report_file}（{elapsed:.1f} 秒）")
+                self.root.after(0, lambda: messagebox.showinfo("成功", f"上傳報告已儲存到：{report_file}"))
+            except Exception as e:
+                error_msg = f"❌ 生成報告失敗：{str(e)}"
+                self.log(error_msg)
+                self.root.after(0, lambda: messagebox.showerror("錯誤", error_msg))
+        
+        threading.Thread(target=export_thread, daemon=True).start()
+    
+    def get_history_filters(self):
+        """讀取上傳歷史的查詢條件；日期格式錯誤時引發 ValueError"""
+        values = {key: var.get().strip() for key, var in self.history_query.items()}
+        filters = {key: values[key] or None for key in ('name', 'digest', 'folder', 'status', 'where')}
+        for key, days in (('date_from', 0), ('date_to', 1)):
+            if values[key]:
+                try:
+                    day = datetime.strptime(values[key], '%Y-%m-%d')
+                except ValueError:
+                    raise ValueError(f"日期格式錯誤：{values[key]}（應為 YYYY-MM-DD）")
+                # 「日期到」包含當天
+                filters[key] = day.timestamp() + days * 86400
+            else:
+                filters[key] = None
+        return filters
+    
+    def search_history(self):
+        """查詢上傳歷史，只顯示最新的 HISTORY_DISPLAY_ROWS 筆"""
+        if self.history is None:
+            messagebox.showerror("錯誤", "上傳歷史資料庫無法使用")
+            return
         try:
-            # 選擇儲存位置
-            report_file = filedialog.asksaveasfilename(
-                title="儲存上傳報告",
-                defaultextension=".docx",
-                filetypes=[("Word文件", "*.docx"), ("所有檔案", "*.*")]
-            )
-            
-            if not report_file:
-                return
-            
-            # 建立報告文件
-            doc = Document()
-            
-            # 標題
-            title = doc.add_heading("KatFile 上傳報告", level=1)
-            title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            
-            # 生成時間
-            doc.add_paragraph(f"生成時間：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            doc.add_paragraph(f"總計上傳檔案：{len(self.upload_records)} 個")
-            
-            # 建立表格
-            table = doc.add_table(rows=1, cols=5)
-            table.style = 'Table Grid'
-            
-            # 表頭
-            header_cells = table.rows[0].cells
-            header_cells[0].text = "檔案名稱"
-            header_cells[1].text = "檔案大小"
-            header_cells[2].text = "上傳時間"
-            header_cells[3].text = "下載連結"
-            header_cells[4].text = "狀態"
-            
-            # 填入記錄
-            for record in self.upload_records:
-                row_cells = table.add_row().cells
-                row_cells[0].text = record.get('filename', 'N/A')
-                row_cells[1].text = record.get('filesize', 'N/A')
-                row_cells[2].text = record.get('upload_time', 'N/A')
-                row_cells[3].text = record.get('download_link', 'N/A')
-                row_cells[4].text = record.get('status', 'N/A')
-            
-            doc.save(report_file)
-            
-            self.log(f"📊 上傳報告已生成：{report_file}")
-            messagebox.showinfo("成功", f"上傳報告已儲存到：{report_file}")
-            
-        except Exception as e:
-            error_msg = f"❌ 生成報告失敗：{str(e)}"
-            self.log(error_msg)
-            messagebox.showerror("錯誤", error_msg)
+            filters = self.get_history_filters()
+        except ValueError as e:
+            messagebox.showerror("錯誤", str(e))
+            return
+        self.history_count_var.set("查詢中...")
+        
+        def search_thread():
+            try:
+                start = time.perf_counter()
+                entries = list(self.history.search(limit=HISTORY_DISPLAY_ROWS, **filters))
+                total = self.history.count(**filters)
+                elapsed = time.perf_counter() - start
+                self.root.after(0, lambda: self.show_history_results(entries, total, elapsed))
+            except sqlite3.Error as e:
+                error_msg = f"查詢失敗：{e}"
+                self.root.after(0, lambda: (self.history_count_var.set(error_msg),
+                                            messagebox.showerror("錯誤", error_msg)))
+        
+        threading.Thread(target=search_thread, daemon=True).start()
+    
+    def show_history_results(self, entries, total, elapsed):
+        """把查詢結果填入歷史列表（在主執行緒執行）"""
+        self.history_tree.delete(*self.history_tree.get_children())
+        self.history_links = {}
+        for entry in entries:
+            record = entry.record
+            item = self.history_tree.insert("", tk.END, text=entry.name, values=(
+                record.upload_time, record.filesize, entry.status,
+                entry.folder_name or entry.folder_id or "", record.download_link
+            ))
+            self.history_links[item] = entry.download_links
+        shown = f"，顯示最新 {len(entries)} 筆" if total > len(entries) else ""
+        self.history_count_var.set(f"共 {total} 筆{shown}（{elapsed * 1000:.0f} 毫秒）")
+    
+    def copy_history_links(self, event):
+        """複製選取記錄的下載連結"""
+        links = [link for item in self.history_tree.selection() for link in self.history_links.get(item, ())]
+        if links:
+            self.root.clipboard_clear()
+            self.root.clipboard_append('\n'.join(links))
+            self.history_count_var.set(f"已複製 {len(links)} 個下載連結")
+    
+    def export_history_report(self):
+        """把目前查詢條件的全部結果匯出成上傳報告"""
+        if self.history is None:
+            messagebox.showerror("錯誤", "上傳歷史資料庫無法使用")
+            return
+        try:
+            filters = self.get_history_filters()
+        except ValueError as e:
+            messagebox.showerror("錯誤", str(e))
+            return
+        
+        report_file = filedialog.asksaveasfilename(
+            title="匯出查詢結果",
+            defaultextension=".csv",
+            filetypes=[("CSV檔案", "*.csv"), ("Word文件", "*.docx"), ("JSON Lines", "*.jsonl"),
+                       ("HTML網頁", "*.html"), ("所有檔案", "*.*")]
+        )
+        if not report_file:
+            return
+        
+        def export_thread():
+            try:
+                start = time.perf_counter()
+                records = [entry.record for entry in self.history.search(**filters)]
+                export_report(report_file, records)
+                elapsed = time.perf_counter() - start
+                self.log(f"📊 上傳歷史報告已生成：{report_file}（{len(records)} 筆，{elapsed:.1f} 秒）")
+                self.root.after(0, lambda: messagebox.showinfo("成功", f"查詢結果已匯出到：{report_file}"))
+            except Exception as e:
+                error_msg = f"❌ 匯出查詢結果失敗：{str(e)}"
+                self.log(error_msg)
+                self.root.after(0, lambda: messagebox.showerror("錯誤", error_msg))
+        
+        threading.Thread(target=export_thread, daemon=True).start()
     
     # 以下是原有的方法，保持不變
     def toggle_key_visibility(self):
@@ -874,8 +4274,24 @@ class KatFileUploaderEnhanced:
                     self.compress_enabled.set(config.get('compress_enabled', False))
                     self.compress_password.set(config.get('compress_password', ''))
                     self.compress_format.set(config.get('compress_format', 'zip'))
+                    self.compress_level.set(str(config.get('compress_level', 6)))
                     self.generate_word.set(config.get('generate_word', True))
+                    self.record_format.set(config.get('record_format', 'docx'))
+                    digests = config.get('digests', ['sha256'])
+                    self.digest_md5.set('md5' in digests)
+                    self.digest_sha256.set('sha256' in digests)
                     self.word_template_path = config.get('word_template_path', '')
+                    self.scratch_dir.set(config.get('scratch_dir', self.scratch_dir.get()))
+                    self.scratch_quota_gb.set(str(config.get('scratch_quota_gb', self.scratch_quota_gb.get())))
+                    self.cache_enabled.set(config.get('cache_enabled', True))
+                    self.cache_budget_gb.set(str(config.get('cache_budget_gb', self.cache_budget_gb.get())))
+                    self.scan_include.set(config.get('scan_include', ''))
+                    self.scan_exclude.set(config.get('scan_exclude', ''))
+                    self.mirror_folders.set(config.get('mirror_folders', False))
+                    self.metrics_dir.set(config.get('metrics_dir', self.metrics_dir.get()))
+                    self.profile_enabled.set(config.get('profile_enabled', False))
+                    self.parallel_uploads.set(str(config.get('parallel_uploads', self.parallel_uploads.get())))
+                    self.upload_block_kb.set(str(config.get('upload_block_kb', self.upload_block_kb.get())))
         except Exception as e:
             self.log(f"⚠️ 載入設定失敗: {e}")
     
@@ -887,8 +4303,22 @@ class KatFileUploaderEnhanced:
                 'compress_enabled': self.compress_enabled.get(),
                 'compress_password': self.compress_password.get(),
                 'compress_format': self.compress_format.get(),
+                'compress_level': self.get_compress_level(),
                 'generate_word': self.generate_word.get(),
-                'word_template_path': self.word_template_path
+                'record_format': self.get_record_format(),
+                'digests': list(self.get_digest_names()),
+                'word_template_path': self.word_template_path,
+                'scratch_dir': self.scratch_dir.get(),
+                'scratch_quota_gb': self.scratch_quota_gb.get(),
+                'cache_enabled': self.cache_enabled.get(),
+                'cache_budget_gb': self.cache_budget_gb.get(),
+                'scan_include': self.scan_include.get(),
+                'scan_exclude': self.scan_exclude.get(),
+                'mirror_folders': self.mirror_folders.get(),
+                'metrics_dir': self.metrics_dir.get(),
+                'profile_enabled': self.profile_enabled.get(),
+                'parallel_uploads': self.get_parallel_uploads(),
+                'upload_block_kb': self.get_upload_block_size() // 1024
             }
             with open(self.config_file, 'w', encoding='utf-8') as f:
                 json.dump(config, f, ensure_ascii=False, indent=2)
@@ -896,28 +4326,31 @@ class KatFileUploaderEnhanced:
             self.log(f"⚠️ 儲存設定失敗: {e}")
     
     def log(self, message):
-        """記錄日誌"""
-        timestamp = datetime.now().strftime("[%H:%M:%S]")
-        log_message = f"{timestamp} {message}\n"
-        
-        self.log_text.insert(tk.END, log_message)
-        self.log_text.see(tk.END)
-        self.root.update_idletasks()
+        """記錄日誌（可在任何執行緒呼叫，由 drain_log 定時寫入視窗）"""
+        self.log_sink.emit(message)
+    
+    def drain_log(self):
+        """把排隊中的日誌成批寫入視窗（Tk 迴圈定時執行）"""
+        written = self.log_sink.drain()
+        self.root.after(50 if written else 150, self.drain_log)
     
     def clear_log(self):
-        """清除日誌"""
-        self.log_text.delete(1.0, tk.END)
+        """清除日誌（只清除視窗，日誌檔保留）"""
+        self.log_sink.clear()
     
     def save_log(self):
-        """儲存日誌"""
+        """儲存完整日誌（包含已輪替的日誌檔）"""
         try:
             filename = filedialog.asksaveasfilename(
                 defaultextension=".txt",
                 filetypes=[("文字檔案", "*.txt"), ("所有檔案", "*.*")]
             )
             if filename:
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(self.log_text.get(1.0, tk.END))
+                self.log_sink.flush()
+                with open(filename, 'wb') as out:
+                    for log_file in self.log_sink.files():
+                        with open(log_file, 'rb') as f:
+                            shutil.copyfileobj(f, out)
                 self.log(f"📄 日誌已儲存到: {filename}")
         except Exception as e:
             self.log(f"❌ 儲存日誌失敗: {e}")
@@ -973,52 +4406,138 @@ class KatFileUploaderEnhanced:
         
         def test_thread():
             try:
-                url = f"https://katfile.cloud/api/account/info?key={quote(key)}"
+                url = f"{KATFILE_API}/account/info?key={quote(key)}"
                 response = self.session.get(url, timeout=15, allow_redirects=True)
                 
                 if response.status_code == 200:
                     data = response.json()
                     if data.get('msg') == 'OK':
-                        self.root.after(0, lambda: self.log("✅ API金鑰測試成功"))
+                        self.log("✅ API金鑰測試成功")
                         self.root.after(0, lambda: messagebox.showinfo("成功", "API金鑰有效！"))
                         self.root.after(0, self.load_account_info)
                         return
                     else:
                         error_msg = f"❌ API金鑰無效: {data.get('msg', '未知錯誤')}"
-                        self.root.after(0, lambda msg=error_msg: self.log(msg))
+                        self.log(error_msg)
                         self.root.after(0, lambda: messagebox.showerror("錯誤", f"API金鑰無效: {data.get('msg', '未知錯誤')}"))
                         return
                         
             except Exception as error:
                 error_msg = f"❌ 測試失敗: {str(error)}"
-                self.root.after(0, lambda msg=error_msg: self.log(msg))
+                self.log(error_msg)
                 self.root.after(0, lambda: messagebox.showerror("錯誤", "測試失敗，請檢查API金鑰和網路連線"))
                 
         threading.Thread(target=test_thread, daemon=True).start()
     
-    def diagnose_network(self):
-        """診斷網路連線"""
+    def diagnose_and_tune(self):
+        """確認後執行網路診斷，並實際上傳測試資料調校並行數與區塊大小"""
+        if not self.api_key.get().strip():
+            messagebox.showwarning("警告", "請先設定API金鑰")
+            return
+        if not messagebox.askyesno(
+                "上傳速度測試",
+                f"上傳速度測試會向上傳主機送出最多 {format_file_size(PROBE_MAX_TOTAL)} 的測試資料"
+                f"（每個連線最多 {format_file_size(PROBE_MAX_PAYLOAD)}），會佔用頻寬數十秒。\n\n"
+                "測試資料不帶登入資訊，預期不會保存；若伺服器仍回傳檔案代碼，測試會立即停止並在日誌中列出。\n\n"
+                "是否繼續？"):
+            return
+        self.diagnose_network(tune=True)
+    
+    def diagnose_network(self, tune=False):
+        """網路效能探測：量測 DNS／TCP／TLS／首位元組時間；tune 為 True 時再量測上傳速度並調校並行數與區塊大小"""
         self.log("🔍 開始網路診斷...")
+        key = self.api_key.get().strip()
+        
+        def log_probe(label, url):
+            try:
+                result = probe_connection(url)
+            except (OSError, ValueError) as e:
+                self.log(f"❌ {label} 連線失敗: {e}")
+                return None
+            timings = "，".join(f"{name} {result[field] * 1000:.0f} ms"
+                               for field, name in (('dns', "DNS"), ('connect', "TCP"), ('tls', "TLS"), ('ttfb', "首位元組"))
+                               if field in result)
+            self.log(f"✅ {label} {result['host']} ({result['ip']}): {timings}，HTTP {result.get('status')}")
+            return result
         
         def diagnose_thread():
             try:
-                ip = socket.gethostbyname('katfile.cloud')
-                self.root.after(0, lambda: self.log(f"✅ DNS解析成功: katfile.cloud -> {ip}"))
+                log_probe("網站", KATFILE_SITE)
                 
-                response = self.session.get('https://katfile.cloud', timeout=10, allow_redirects=True)
-                self.root.after(0, lambda: self.log(f"✅ 基本連線成功: HTTP {response.status_code}"))
-                
-                response = self.session.get("https://katfile.cloud/api/account/info?key=test", timeout=10, allow_redirects=True)
+                response = self.session.get(f"{KATFILE_API}/account/info?key=test", timeout=10, allow_redirects=True)
                 if response.status_code in [200, 400, 401]:
-                    self.root.after(0, lambda: self.log("✅ API端點可正常訪問"))
+                    self.log("✅ API端點可正常訪問")
                 else:
-                    self.root.after(0, lambda: self.log(f"⚠️ API端點回應異常: HTTP {response.status_code}"))
-                    
+                    self.log(f"⚠️ API端點回應異常: HTTP {response.status_code}")
+                
+                if not key:
+                    self.log("ℹ️ 設定API金鑰後可一併測試上傳主機與上傳速度")
+                    return
+                
+                response = self.session.get(f"{KATFILE_API}/upload/server?key={quote(key)}", timeout=30,
+                                            allow_redirects=True)
+                upload_url = response.json().get('result') if response.status_code == 200 else None
+                if not upload_url:
+                    self.log(f"⚠️ 無法取得上傳伺服器: HTTP {response.status_code}")
+                    return
+                if log_probe("上傳主機", upload_url) is None:
+                    return
+                
+                if tune:
+                    self.tune_upload_settings(upload_url)
+                else:
+                    self.log("ℹ️ 上傳速度測試與調校請使用儀表板的「網路診斷並調校」")
             except Exception as e:
-                self.root.after(0, lambda: self.log(f"❌ 網路診斷失敗: {str(e)}"))
+                self.log(f"❌ 網路診斷失敗: {str(e)}")
         
         threading.Thread(target=diagnose_thread, daemon=True).start()
     
+    def tune_upload_settings(self, upload_url):
+        """以測試資料量測不同區塊大小與並行數的上傳速度，套用並儲存建議值（總量不超過 PROBE_MAX_TOTAL）"""
+        mb = 1024 * 1024
+        stored = []
+        
+        def measure(payload, block_size, concurrency=1):
+            speed = measure_upload_throughput(upload_url, payload, block_size, concurrency, stored=stored)
+            if stored:
+                raise Exception(f"伺服器保存了測試資料，已停止測試，請手動刪除檔案: {', '.join(stored)}")
+            return speed
+        
+        # 先以 1 MB 估計速度，決定每個連線的測試資料量（約 2 秒，最多 PROBE_MAX_PAYLOAD）
+        estimate = measure(os.urandom(mb), UPLOAD_BLOCK_SIZE)
+        payload = os.urandom(int(max(1, min(PROBE_MAX_PAYLOAD // mb, estimate * 2 / mb))) * mb)
+        self.log(f"📶 上傳速度測試（每個連線 {format_file_size(len(payload))}）...")
+        
+        by_block = {}
+        for block_size in PROBE_BLOCK_SIZES:
+            by_block[block_size] = measure(payload, block_size)
+            self.log(f"   區塊 {block_size // 1024} KB：{by_block[block_size] / mb:.2f} MB/s")
+        # 差距在 5% 以內時選擇較小的區塊（記憶體用量較低）
+        best = max(by_block.values())
+        block_size = min(size for size, speed in by_block.items() if speed >= best * 0.95)
+        
+        by_concurrency = {1: by_block[block_size]}
+        for concurrency in PROBE_CONCURRENCY[1:]:
+            by_concurrency[concurrency] = measure(payload, block_size, concurrency)
+            self.log(f"   並行 {concurrency}：{by_concurrency[concurrency] / mb:.2f} MB/s")
+            if by_concurrency[concurrency] < by_concurrency[concurrency // 2] * 1.1:
+                break  # 再增加並行數已沒有明顯效益
+        # 達到最高速度 90% 的最小並行數
+        best = max(by_concurrency.values())
+        concurrency = min(n for n, speed in by_concurrency.items() if speed >= best * 0.9)
+        
+        summary = (f"建議：並行 {concurrency}、區塊 {block_size // 1024} KB（約 {best / mb:.2f} MB/s，"
+                   f"{datetime.now().strftime('%Y-%m-%d %H:%M')} 量測）")
+        self.log(f"✅ {summary}，已套用並儲存")
+        
+        def apply():
+            self.parallel_uploads.set(str(concurrency))
+            self.upload_block_kb.set(str(block_size // 1024))
+            self.tuning_var.set(summary)
+            self.save_config()
+        
+        self.root.after(0, apply)
+    
     def load_account_info(self):
         """載入帳戶資訊"""
         key = self.api_key.get().strip()
@@ -1027,7 +4546,7 @@ class KatFileUploaderEnhanced:
             
         def load_thread():
             try:
-                url = f"https://katfile.cloud/api/account/info?key={quote(key)}"
+                url = f"{KATFILE_API}/account/info?key={quote(key)}"
                 response = self.session.get(url, timeout=15, allow_redirects=True)
                 
                 if response.status_code == 200:
@@ -1038,7 +4557,7 @@ class KatFileUploaderEnhanced:
                     
             except Exception as error:
                 error_msg = f"❌ 載入帳戶資訊失敗: {str(error)}"
-                self.root.after(0, lambda msg=error_msg: self.log(msg))
+                self.log(error_msg)
                 
         threading.Thread(target=load_thread, daemon=True).start()
     
@@ -1074,53 +4593,100 @@ class KatFileUploaderEnhanced:
         self.account_text.insert(tk.END, account_display)
         self.account_text.config(state=tk.DISABLED)
     
-    def refresh_folders(self):
-        """重新整理資料夾列表"""
+    def fetch_folder_children(self, fld_id):
+        """向伺服器查詢一個資料夾的子資料夾（不經快取）"""
         key = self.api_key.get().strip()
-        if not key:
+        url = f"{KATFILE_API}/folder/list?{urlencode({'key': key, 'fld_id': fld_id})}"
+        response = self.session.get(url, timeout=15, allow_redirects=True)
+        if response.status_code != 200:
+            raise Exception(f"HTTP {response.status_code}")
+        data = response.json()
+        if data.get('msg') != 'OK':
+            raise Exception(data.get('msg', '未知錯誤'))
+        return (data.get('result') or {}).get('folders') or []
+    
+    def refresh_folders(self):
+        """重新整理資料夾樹：清除全部快取，只重新載入根目錄的子資料夾"""
+        if not self.api_key.get().strip():
             return
-            
-        def refresh_thread():
+        
+        self.folder_cache.invalidate()
+        self.folder_tree.delete(*self.folder_tree.get_children())
+        root_item = self.folder_tree.insert("", "end", text="📁 根目錄", values=(0,), open=True)
+        self.folder_items = {0: root_item}
+        self.load_folder_children(0)
+    
+    def on_folder_open(self, event):
+        """展開資料夾節點時才載入子資料夾（快取有效時不查詢伺服器）"""
+        item = self.folder_tree.focus()
+        if item:
+            self.load_folder_children(int(self.folder_tree.item(item, "values")[0]))
+    
+    def load_folder_children(self, fld_id):
+        """載入一個節點的子資料夾：有效快取直接顯示，否則在背景查詢後顯示"""
+        folders = self.folder_cache.cached(fld_id)
+        if folders is not None:
+            self.update_folder_display(fld_id, folders)
+            return
+        
+        def load_thread():
             try:
-                url = f"https://katfile.cloud/api/folder/list?key={quote(key)}"
-                response = self.session.get(url, timeout=15, allow_redirects=True)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('msg') == 'OK':
-                        self.folders = data.get('result', {}).get('folders', [])
-                        self.root.after(0, self.update_folder_display)
-                        
+                folders = self.folder_cache.children(fld_id)
+                self.root.after(0, lambda: self.update_folder_display(fld_id, folders))
             except Exception as error:
                 error_msg = f"❌ 載入資料夾失敗: {str(error)}"
-                self.root.after(0, lambda msg=error_msg: self.log(msg))
-                
-        threading.Thread(target=refresh_thread, daemon=True).start()
+                self.log(error_msg)
+        
+        threading.Thread(target=load_thread, daemon=True).start()
     
-    def update_folder_display(self):
-        """更新資料夾顯示"""
-        for item in self.folder_tree.get_children():
-            self.folder_tree.delete(item)
+    def update_folder_display(self, fld_id, folders):
+        """以子資料夾清單更新一個節點；子節點先放佔位項目，展開時才載入"""
+        parent = self.folder_items.get(fld_id)
+        if parent is None or not self.folder_tree.exists(parent):
+            return
         
-        root_item = self.folder_tree.insert("", "end", text="📁 根目錄", values=(0,))
+        for item in self.folder_tree.get_children(parent):
+            self.forget_folder_items(item)
+        self.folder_tree.delete(*self.folder_tree.get_children(parent))
         
-        for folder in self.folders:
+        for folder in folders:
             folder_name = folder.get('name', '未知資料夾')
-            folder_id = folder.get('fld_id', 0)
-            self.folder_tree.insert("", "end", text=f"📁 {folder_name}", values=(folder_id,))
+            folder_id = int(folder.get('fld_id', 0))
+            item = self.folder_tree.insert(parent, "end", text=f"📁 {folder_name}", values=(folder_id,))
+            self.folder_tree.insert(item, "end", text="載入中...", values=(folder_id,))
+            self.folder_items[folder_id] = item
         
-        self.log(f"📁 載入了 {len(self.folders)} 個資料夾")
+        if fld_id == 0:
+            self.log(f"📁 載入了 {len(folders)} 個資料夾")
+    
+    def forget_folder_items(self, item):
+        """移除一個子樹在 folder_items 中的對應（佔位項目沒有對應）"""
+        for child in self.folder_tree.get_children(item):
+            self.forget_folder_items(child)
+        fld_id = int(self.folder_tree.item(item, "values")[0])
+        if self.folder_items.get(fld_id) == item:
+            del self.folder_items[fld_id]
+    
+    def folder_path(self, item):
+        """資料夾樹項目的完整路徑（例如 電影/2024）"""
+        names = []
+        while item and int(self.folder_tree.item(item, "values")[0]) != 0:
+            names.append(self.folder_tree.item(item, "text").replace("📁 ", "", 1))
+            item = self.folder_tree.parent(item)
+        return "/".join(reversed(names)) or "根目錄"
     
     def on_folder_select(self, event):
         """資料夾選擇事件"""
         selection = self.folder_tree.selection()
         if selection:
             item = selection[0]
-            folder_id = self.folder_tree.item(item, "values")[0]
-            folder_name = self.folder_tree.item(item, "text")
+            folder_id = int(self.folder_tree.item(item, "values")[0])
+            if self.folder_items.get(folder_id) != item:
+                return  # 載入中的佔位項目
+            folder_name = self.folder_path(item)
             
-            self.current_folder_id = int(folder_id)
-            self.target_folder_var.set(folder_name.replace("📁 ", ""))
+            self.current_folder_id = folder_id
+            self.target_folder_var.set(folder_name)
             
             self.log(f"📂 選擇目標資料夾: {folder_name} (ID: {folder_id})")
     
@@ -1135,35 +4701,43 @@ class KatFileUploaderEnhanced:
         if not folder_name:
             return
             
+        parent_id = self.current_folder_id
+        
         def create_thread():
             try:
-                params = {
-                    'key': key,
-                    'name': folder_name
-                }
-                
-                if self.current_folder_id != 0:
-                    params['parent_id'] = self.current_folder_id
-                
-                url = f"https://katfile.cloud/api/folder/create?{urlencode(params)}"
-                response = self.session.get(url, timeout=15, allow_redirects=True)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('msg') == 'OK':
-                        success_msg = f"✅ 資料夾 '{folder_name}' 建立成功"
-                        self.root.after(0, lambda msg=success_msg: self.log(msg))
-                        self.root.after(0, self.refresh_folders)
-                    else:
-                        error_msg = f"❌ 建立資料夾失敗: {data.get('msg', '未知錯誤')}"
-                        self.root.after(0, lambda msg=error_msg: self.log(msg))
-                        
+                self.create_remote_folder(folder_name, parent_id)
+                success_msg = f"✅ 資料夾 '{folder_name}' 建立成功"
+                self.log(success_msg)
+                # 只重新載入上層資料夾節點
+                self.folder_cache.invalidate(parent_id)
+                self.root.after(0, lambda: self.load_folder_children(parent_id))
             except Exception as error:
                 error_msg = f"❌ 建立資料夾錯誤: {str(error)}"
-                self.root.after(0, lambda msg=error_msg: self.log(msg))
+                self.log(error_msg)
                 
         threading.Thread(target=create_thread, daemon=True).start()
     
+    def create_remote_folder(self, name, parent_id=0):
+        """在伺服器上建立資料夾，回傳新的 fld_id"""
+        params = {
+            'key': self.api_key.get().strip(),
+            'name': name
+        }
+        if parent_id != 0:
+            params['parent_id'] = parent_id
+        
+        url = f"{KATFILE_API}/folder/create?{urlencode(params)}"
+        response = self.session.get(url, timeout=15, allow_redirects=True)
+        if response.status_code != 200:
+            raise Exception(f"HTTP {response.status_code}")
+        data = response.json()
+        if data.get('msg') != 'OK':
+            raise Exception(data.get('msg', '未知錯誤'))
+        fld_id = (data.get('result') or {}).get('fld_id')
+        if not fld_id:
+            raise Exception("伺服器未回傳資料夾 ID")
+        return int(fld_id)
+    
     def select_files(self):
         """選擇檔案"""
         files = filedialog.askopenfilenames(
@@ -1171,60 +4745,97 @@ class KatFileUploaderEnhanced:
             filetypes=[("所有檔案", "*.*")]
         )
         
+        new_files = []
         for file_path in files:
-            if file_path not in [f['path'] for f in self.selected_files]:
-                file_info = {
-                    'path': file_path,
-                    'name': os.path.basename(file_path),
-                    'size': os.path.getsize(file_path)
-                }
-                self.selected_files.append(file_info)
+            if file_path not in self.selected_paths:
+                new_files.append(FileEntry.from_path(file_path))
         
-        self.update_file_display()
+        if files:
+            self.add_selected_files(new_files)
+            self.log(f"📄 選擇了 {len(self.selected_files)} 個檔案")
     
     def select_folder(self):
         """選擇資料夾"""
         folder_path = filedialog.askdirectory(title="選擇要上傳的資料夾")
         
         if folder_path:
-            for root, dirs, files in os.walk(folder_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if file_path not in [f['path'] for f in self.selected_files]:
-                        file_info = {
-                            'path': file_path,
-                            'name': os.path.relpath(file_path, folder_path),
-                            'size': os.path.getsize(file_path)
-                        }
-                        self.selected_files.append(file_info)
+            scanner = FolderScanner(folder_path, split_patterns(self.scan_include.get()),
+                                    split_patterns(self.scan_exclude.get()))
+            generation = self.scan_generation
+            self.log(f"🔍 掃描資料夾：{folder_path}")
             
-            self.update_file_display()
+            def scan_thread():
+                started = time.perf_counter()
+                try:
+                    # 結果分批交給 Tk 執行緒加入列表
+                    found = scanner.run(
+                        lambda batch: self.root.after(0, lambda: self.add_scanned_files(generation, batch)),
+                        lambda: generation == self.scan_generation
+                    )
+                    elapsed = time.perf_counter() - started
+                    self.root.after(0, lambda: self.log(
+                        f"📄 資料夾掃描完成：找到 {found} 個檔案（{elapsed:.1f} 秒），共選擇 {len(self.selected_files)} 個檔案"))
+                except Exception as e:
+                    self.log(f"❌ 掃描資料夾失敗: {e}")
+            
+            threading.Thread(target=scan_thread, daemon=True).start()
+    
+    def add_scanned_files(self, generation, batch):
+        """加入一批掃描結果（略過已選的檔案；列表已清除時丟棄）"""
+        if generation == self.scan_generation:
+            self.add_selected_files([f for f in batch if f.path not in self.selected_paths])
     
     def clear_files(self):
         """清除檔案列表"""
+        self.scan_generation += 1
         self.selected_files = []
-        self.update_file_display()
+        self.selected_paths = set()
+        self.file_statuses = []
+        self.show_file_page(0)
         self.log("🗑️ 檔案列表已清除")
     
-    def update_file_display(self):
-        """更新檔案顯示"""
-        for item in self.file_tree.get_children():
-            self.file_tree.delete(item)
+    def add_selected_files(self, file_infos):
+        """加入檔案（增量）：只有落在目前頁面的檔案才會建立列"""
+        start = len(self.selected_files)
+        self.selected_files.extend(file_infos)
+        self.selected_paths.update(f.path for f in file_infos)
+        self.file_statuses.extend(["等待上傳"] * len(file_infos))
         
-        for i, file_info in enumerate(self.selected_files):
-            size_str = self.format_file_size(file_info['size'])
-            self.file_tree.insert("", "end", text=file_info['name'], 
-                                values=(size_str, "等待上傳"), tags=(str(i),))
+        page_start = self.file_page * FILE_LIST_PAGE_SIZE
+        page_end = min(len(self.selected_files), page_start + FILE_LIST_PAGE_SIZE)
+        for index in range(max(start, page_start), page_end):
+            self.insert_file_row(index)
+        self.update_file_page_label()
+    
+    def insert_file_row(self, index):
+        file_info = self.selected_files[index]
+        self.file_items[index] = self.file_tree.insert(
+            "", "end", text=file_info.name,
+            values=(self.format_file_size(file_info.size), self.file_statuses[index])
+        )
+    
+    def show_file_page(self, page):
+        """顯示指定頁面（只重建該頁的列）"""
+        pages = max(1, -(-len(self.selected_files) // FILE_LIST_PAGE_SIZE))
+        self.file_page = max(0, min(page, pages - 1))
+        
+        if self.file_items:
+            self.file_tree.delete(*self.file_items.values())
+        self.file_items = {}
         
-        self.log(f"📄 選擇了 {len(self.selected_files)} 個檔案")
+        page_start = self.file_page * FILE_LIST_PAGE_SIZE
+        for index in range(page_start, min(len(self.selected_files), page_start + FILE_LIST_PAGE_SIZE)):
+            self.insert_file_row(index)
+        self.update_file_page_label()
+    
+    def update_file_page_label(self):
+        total = len(self.selected_files)
+        pages = max(1, -(-total // FILE_LIST_PAGE_SIZE))
+        self.file_page_var.set(f"共 {total} 個檔案｜第 {self.file_page + 1}/{pages} 頁")
     
     def format_file_size(self, size):
         """格式化檔案大小"""
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if size < 1024.0:
-                return f"{size:.1f} {unit}"
-            size /= 1024.0
-        return f"{size:.1f} TB"
+        return format_file_size(size)
     
     def start_upload(self):
         """開始上傳"""
@@ -1259,194 +4870,638 @@ class KatFileUploaderEnhanced:
             self.log("🗜️ 壓縮功能已啟用")
         
         if self.generate_word.get():
-            self.log("📄 Word文件記錄功能已啟用")
+            self.log(f"📄 記錄文件功能已啟用（{RECORD_RENDERERS[self.get_record_format()].label}）")
+        
+        compress = self.compress_enabled.get()
+        batch_started = time.perf_counter()
+        if self.event_log.open_run():
+            self.event_log.emit('batch', 'start', files=len(self.selected_files),
+                                bytes=sum(f.size for f in self.selected_files), compress=compress,
+                                format=self.compress_format.get() if compress else None,
+                                split=self.enable_split.get(), folder_id=self.current_folder_id)
+        METRICS.reset()
+        profiler = self.start_profiler() if self.profile_enabled.get() else None
+        cache = self.get_archive_cache() if compress else None
+        # 壓縮檔快取與暫存檔共用同一個磁碟：空間不足時先淘汰快取中未使用的壓縮檔
+        self.scratch = ScratchSpaceManager(self.scratch_dir.get(), self.get_scratch_quota_bytes(),
+                                           reclaim=cache.reclaim if cache is not None else None)
+        
+        def compress_producer(prepared):
+            """壓縮工作（先行於上傳）：受暫存空間配額控制，壓縮結果依序放入佇列"""
+            try:
+                for i, file_info in enumerate(self.selected_files):
+                    if not self.is_uploading:
+                        break
+                    
+                    # 已有相同來源與設定的壓縮檔時直接重用
+                    cache_key = None
+                    if cache is not None:
+                        cache_key = self.get_archive_cache_key(file_info.path)
+                        cached = cache.lookup(cache_key)
+                        if cached is not None:
+                            cache_msg = f"♻️ 使用快取的壓縮檔：{file_info.name}"
+                            self.log(cache_msg)
+                            self.event_log.emit('compress', 'cache_hit', file=file_info.path, bytes=file_info.size)
+                            file_info.source_digests = cache.metadata(cache_key).get('source_digests', {})
+                            if not self._put_prepared(prepared, (i, cached.files, cached)):
+                                cached.release()
+                                break
+                            continue
+                    
+                    # 預估暫存需求：壓縮檔最多約為原檔大小，分割時另需同樣大小的分割暫存檔
+                    estimate = file_info.size + 1024 * 1024
+                    if self.enable_split.get():
+                        estimate += file_info.size
+                    
+                    self.ui.status(i, "等待暫存空間...")
+                    METRICS.set_state("等待暫存空間")
+                    with METRICS.timed('wait_scratch'):
+                        lease = self.scratch.reserve(estimate, lambda: self.is_uploading)
+                    if lease is None:
+                        break
+                    
+                    self.ui.status(i, "壓縮中...")
+                    METRICS.set_state("壓縮中")
+                    source_digests = {}
+                    compressed_files = self.compress_file(file_info.path, lease.directory, source_digests)
+                    METRICS.set_state(None)
+                    if not compressed_files:
+                        METRICS.inc('compress_failures')
+                    else:
+                        METRICS.inc('compress_input_bytes', file_info.size)
+                        METRICS.inc('compress_output_bytes', sum(os.path.getsize(f) for f in compressed_files))
+                    file_info.source_digests = source_digests
+                    if compressed_files and cache is not None:
+                        # 移入快取後即可歸還暫存配額
+                        try:
+                            cached = cache.store(cache_key, compressed_files, {'source_digests': source_digests})
+                            lease.release()
+                            compressed_files, lease = cached.files, cached
+                        except OSError as e:
+                            cache_msg = f"⚠️ 壓縮檔無法放入快取: {e}"
+                            self.log(cache_msg)
+                    if not compressed_files:
+                        lease.release()
+                        lease = None
+                    elif isinstance(lease, ScratchLease):
+                        lease.resize(sum(os.path.getsize(f) for f in compressed_files))
+                    
+                    if not self._put_prepared(prepared, (i, compressed_files, lease)):
+                        if lease:
+                            lease.release()
+                        break
+            except Exception as e:
+                error_msg = f"❌ 壓縮工作錯誤: {str(e)}"
+                self.log(error_msg)
+            finally:
+                METRICS.set_state(None)
+                try:
+                    prepared.put_nowait(None)
+                except queue.Full:
+                    pass
+        
+        self.verifier = UploadVerifier(self.fetch_file_info, self.on_verification_result)
+        self.record_stage.reset_stats()
+        self.refresh_record_stage_status()
+        
+        mirror = None
+        if self.mirror_folders.get():
+            mirror = RemoteFolderMirror(self.current_folder_id, self.folder_cache, self.create_remote_folder)
         
         def upload_thread():
             try:
                 success_count = 0
-                temp_dir = Path.home() / "katfile_temp_compress"
-                temp_dir.mkdir(exist_ok=True)
+                self.scratch.open_session()
+                
+                if compress:
+                    prepared = queue.Queue(maxsize=2)
+                    producer = threading.Thread(target=compress_producer, args=(prepared,), name="壓縮", daemon=True)
+                    producer.start()
+                
+                if mirror is not None:
+                    # 先逐層建立整個遠端資料夾結構（同一層並行，與壓縮同時進行），之後每個檔案直接查表
+                    self.log("🪞 建立對應的遠端資料夾結構...")
+                    try:
+                        with METRICS.timed('mirror_folders'):
+                            mirror.prepare(os.path.dirname(f.name) for f in self.selected_files)
+                        mirror_msg = f"🪞 遠端資料夾已就緒：新建 {mirror.created} 個，重用 {mirror.reused} 個"
+                        self.log(mirror_msg)
+                        self.root.after(0, lambda: self.load_folder_children(self.current_folder_id))
+                    except Exception as e:
+                        error_msg = f"❌ 建立遠端資料夾結構失敗: {str(e)}"
+                        self.log(error_msg)
                 
                 for i, file_info in enumerate(self.selected_files):
                     if not self.is_uploading:
                         break
                     
-                    self.root.after(0, lambda idx=i: self.update_file_status(idx, "處理中..."))
+                    file_started = time.perf_counter()
+                    if not compress:
+                        self.ui.status(i, "處理中...")
+                    
+                    # 目標資料夾（鏡像模式依檔案的相對路徑決定）
+                    target_folder_id = self.current_folder_id
+                    target_folder_name = self.target_folder_var.get()
+                    if mirror is not None:
+                        rel_dir = mirror.normalize(os.path.dirname(file_info.name))
+                        try:
+                            target_folder_id = mirror.folder_id(rel_dir)
+                            if rel_dir:
+                                target_folder_name = rel_dir if self.current_folder_id == 0 else f"{target_folder_name}/{rel_dir}"
+                        except Exception as e:
+                            error_msg = f"⚠️ 無法建立遠端資料夾 {rel_dir}，改為上傳到 {target_folder_name}: {str(e)}"
+                            self.log(error_msg)
                     
                     # 檔案處理（壓縮）
-                    upload_file_path = file_info['path']
+                    upload_file_path = file_info.path
                     compressed_file = None
                     
-                    if self.compress_enabled.get():
-                        self.root.after(0, lambda idx=i: self.update_file_status(idx, "壓縮中..."))
-                        compressed_files = self.compress_file(file_info['path'], temp_dir)
+                    if (not compress and self.enable_split.get()
+                            and file_info.size > self.get_split_size_bytes()):
+                        # 未壓縮的大檔案：直接從原檔案的位元組範圍分段上傳
+                        part_size = self.get_split_size_bytes()
+                        parts = plan_virtual_parts(file_info.path, part_size)
+                        self.ui.status(i, "上傳分割檔案...")
+                        
+                        download_links = self.upload_virtual_parts(i, parts, target_folder_id)
+                        
+                        if all(download_links):
+                            success_count += 1
+                            self.ui.status(i, "✅ 完成")
+                            
+                            try:
+                                manifest_path = write_parts_manifest(file_info, parts, download_links, part_size)
+                                manifest_msg = f"🧾 分割清單: {manifest_path}"
+                                self.log(manifest_msg)
+                            except Exception as e:
+                                manifest_msg = f"⚠️ 寫入分割清單失敗: {e}"
+                                self.log(manifest_msg)
+                            
+                            checksums = self.collect_checksums(parts)
+                            
+                            # 記錄上傳資訊
+                            upload_record = UploadResult(file_info.name, file_info.size, '成功', download_links,
+                                                         checksums)
+                            self.add_upload_record(upload_record, file_info, parts, file_started,
+                                                   target_folder_id, target_folder_name)
+                            
+                            # 生成記錄文件（背景階段）
+                            self.submit_word_document(i, file_info, download_links, [part.name for part in parts],
+                                                      checksums, upload_record)
+                            
+                            success_msg = f"✅ 分割上傳成功: {file_info.name} ({len(download_links)} 個檔案)"
+                            self.log(success_msg)
+                            
+                            self.queue_verification(i, file_info, parts, download_links,
+                                                    [part.name for part in parts], upload_record,
+                                                    manifest_part_size=part_size, folder_id=target_folder_id)
+                        else:
+                            self.ui.status(i, "❌ 分割上傳失敗")
+                            self.quarantine_partial_upload(file_info, parts)
+                            
+                            # 記錄失敗資訊（已上傳分割的檔案代碼一併寫入）
+                            upload_record = UploadResult(file_info.name, file_info.size, '失敗')
+                            self.add_upload_record(upload_record, file_info, parts, file_started,
+                                                   target_folder_id, target_folder_name)
+                        
+                        self.ui.step()
+                        continue
+                    
+                    lease = None
+                    if compress:
+                        item = None
+                        wait_started = time.perf_counter()
+                        while True:
+                            try:
+                                METRICS.set_state("等待壓縮")
+                                item = prepared.get(timeout=1.0)
+                                METRICS.set_gauge('queue_upload', prepared.qsize())
+                                METRICS.set_state(None)
+                                break
+                            except queue.Empty:
+                                if not producer.is_alive() and prepared.empty():
+                                    break
+                        if item is None:
+                            break
+                        METRICS.observe('wait_compress', time.perf_counter() - wait_started)
+                        _, compressed_files, lease = item
                         if compressed_files:
                             # 處理分割檔案的情況
                             if isinstance(compressed_files, list) and len(compressed_files) > 1:
                                 # 分割檔案：需要上傳多個檔案
-                                self.root.after(0, lambda idx=i: self.update_file_status(idx, "上傳分割檔案..."))
+                                self.ui.status(i, "上傳分割檔案...")
                                 download_links = []
+                                part_infos = []
                                 
                                 for j, compressed_file in enumerate(compressed_files):
-                                    part_info = {
-                                        'path': compressed_file,
-                                        'name': os.path.basename(compressed_file),
-                                        'size': os.path.getsize(compressed_file)
-                                    }
+                                    part_info = FileEntry.from_path(compressed_file)
                                     
-                                    part_link = self.upload_single_file(part_info, self.current_folder_id)
+                                    part_link = self.upload_single_file(part_info, target_folder_id, self.get_digest_names())
+                                    part_infos.append(part_info)
                                     if part_link:
                                         download_links.append(part_link)
-                                        self.root.after(0, lambda idx=i, part=j+1, total=len(compressed_files): 
-                                                       self.update_file_status(idx, f"已上傳 {part}/{total} 個分割檔案"))
+                                        self.ui.status(i, f"已上傳 {j + 1}/{len(compressed_files)} 個分割檔案")
                                     else:
-                                        self.root.after(0, lambda idx=i: self.update_file_status(idx, f"❌ 分割檔案 {j+1} 上傳失敗"))
+                                        self.ui.status(i, f"❌ 分割檔案 {j+1} 上傳失敗")
                                         break
                                 
                                 if len(download_links) == len(compressed_files):
                                     # 所有分割檔案上傳成功
                                     success_count += 1
-                                    self.root.after(0, lambda idx=i: self.update_file_status(idx, "✅ 完成"))
+                                    self.ui.status(i, "✅ 完成")
                                     
-                                    # 生成Word文件
-                                    if self.generate_word.get():
-                                        self.root.after(0, lambda idx=i: self.update_file_status(idx, "生成文件..."))
-                                        word_file = self.generate_word_document(file_info, download_links, compressed_files)
-                                        if word_file:
-                                            word_msg = f"📄 Word文件: {word_file}"
-                                            self.root.after(0, lambda msg=word_msg: self.log(msg))
+                                    checksums = self.collect_checksums(part_infos)
                                     
                                     # 記錄上傳資訊
-                                    upload_record = {
-                                        'filename': file_info['name'],
-                                        'filesize': self.format_file_size(file_info['size']),
-                                        'upload_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                                        'download_link': f"{len(download_links)} 個分割檔案",
-                                        'status': '成功'
-                                    }
-                                    self.upload_records.append(upload_record)
+                                    upload_record = UploadResult(file_info.name, file_info.size, '成功', download_links,
+                                                                 checksums, file_info.source_digests)
+                                    self.add_upload_record(upload_record, file_info, part_infos, file_started,
+                                                           target_folder_id, target_folder_name)
+                                    
+                                    # 生成記錄文件（背景階段）
+                                    self.submit_word_document(i, file_info, download_links, compressed_files,
+                                                              checksums, upload_record)
                                     
-                                    success_msg = f"✅ 分割上傳成功: {file_info['name']} ({len(download_links)} 個檔案)"
-                                    self.root.after(0, lambda msg=success_msg: self.log(msg))
+                                    success_msg = f"✅ 分割上傳成功: {file_info.name} ({len(download_links)} 個檔案)"
+                                    self.log(success_msg)
+                                    
+                                    # 校驗完成前保留壓縮檔，以便只重新上傳不符的分割
+                                    self.queue_verification(i, file_info, part_infos, download_links,
+                                                            compressed_files, upload_record, release=lease.release,
+                                                            folder_id=target_folder_id)
                                 else:
-                                    self.root.after(0, lambda idx=i: self.update_file_status(idx, "❌ 分割上傳失敗"))
-                                
-                                # 清理分割檔案
-                                for compressed_file in compressed_files:
-                                    if os.path.exists(compressed_file):
-                                        try:
-                                            os.remove(compressed_file)
-                                        except:
-                                            pass
+                                    self.ui.status(i, "❌ 分割上傳失敗")
+                                    self.quarantine_partial_upload(file_info, part_infos)
+                                    
+                                    # 記錄失敗資訊（已上傳分割的檔案代碼一併寫入）
+                                    upload_record = UploadResult(file_info.name, file_info.size, '失敗')
+                                    self.add_upload_record(upload_record, file_info, part_infos, file_started,
+                                                           target_folder_id, target_folder_name)
+                                    
+                                    # 釋放暫存空間（快取中的壓縮檔會保留）
+                                    lease.release()
                                 
                                 # 跳過後續的單檔案處理
-                                self.root.after(0, lambda: self.progress.step())
+                                self.ui.step()
                                 continue
                             else:
                                 # 單一檔案
                                 compressed_file = compressed_files[0]
-                                upload_file_info = {
-                                    'path': compressed_file,
-                                    'name': os.path.basename(compressed_file),
-                                    'size': os.path.getsize(compressed_file)
-                                }
+                                upload_file_info = FileEntry.from_path(compressed_file)
                         else:
-                            self.root.after(0, lambda idx=i: self.update_file_status(idx, "❌ 壓縮失敗"))
+                            self.ui.status(i, "❌ 壓縮失敗")
+                            
+                            # 記錄失敗資訊
+                            upload_record = UploadResult(file_info.name, file_info.size, '失敗')
+                            self.add_upload_record(upload_record, file_info, [], file_started,
+                                                   target_folder_id, target_folder_name)
+                            
+                            self.ui.step()
                             continue
                     else:
                         upload_file_info = file_info
                         compressed_file = None
                     
                     # 上傳單一檔案
-                    self.root.after(0, lambda idx=i: self.update_file_status(idx, "上傳中..."))
+                    self.ui.status(i, "上傳中...")
                     
-                    download_link = self.upload_single_file(upload_file_info, self.current_folder_id)
+                    download_link = self.upload_single_file(upload_file_info, target_folder_id, self.get_digest_names())
                     
                     if download_link:
                         success_count += 1
-                        self.root.after(0, lambda idx=i: self.update_file_status(idx, "✅ 完成"))
+                        self.ui.status(i, "✅ 完成")
+                        
+                        checksums = self.collect_checksums([upload_file_info])
                         
                         # 記錄上傳資訊
-                        upload_record = {
-                            'filename': file_info['name'],
-                            'filesize': self.format_file_size(file_info['size']),
-                            'upload_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                            'download_link': download_link,
-                            'status': '成功'
-                        }
-                        self.upload_records.append(upload_record)
+                        upload_record = UploadResult(
+                            file_info.name, file_info.size, '成功', [download_link], checksums,
+                            file_info.source_digests if compressed_file else file_info.digests
+                        )
+                        self.add_upload_record(upload_record, file_info, [upload_file_info], file_started,
+                                               target_folder_id, target_folder_name)
                         
-                        success_msg = f"✅ 上傳成功: {file_info['name']}"
-                        self.root.after(0, lambda msg=success_msg: self.log(msg))
+                        success_msg = f"✅ 上傳成功: {file_info.name}"
+                        self.log(success_msg)
                         link_msg = f"🔗 下載連結: {download_link}"
-                        self.root.after(0, lambda msg=link_msg: self.log(msg))
+                        self.log(link_msg)
                         
-                        # 生成Word文件
-                        if self.generate_word.get():
-                            self.root.after(0, lambda idx=i: self.update_file_status(idx, "生成文件..."))
-                            # 單一檔案的Word文件生成
-                            if compressed_file:
-                                word_file = self.generate_word_document(file_info, [download_link], [compressed_file])
-                            else:
-                                # 未壓縮的檔案
-                                word_file = self.generate_word_document(file_info, [download_link], [file_info['path']])
-                            
-                            if word_file:
-                                word_msg = f"📄 Word文件: {word_file}"
-                                self.root.after(0, lambda msg=word_msg: self.log(msg))
+                        # 生成記錄文件（背景階段；未壓縮的檔案以原檔名記錄）
+                        self.submit_word_document(i, file_info, [download_link], [compressed_file or file_info.path],
+                                                  checksums, upload_record)
+                        
+                        # 校驗完成前保留壓縮檔
+                        self.queue_verification(i, file_info, [upload_file_info], [download_link],
+                                                [compressed_file or file_info.path], upload_record,
+                                                release=lease.release if lease else None,
+                                                folder_id=target_folder_id)
+                        lease = None
                     else:
-                        self.root.after(0, lambda idx=i: self.update_file_status(idx, "❌ 失敗"))
+                        self.ui.status(i, "❌ 失敗")
                         
                         # 記錄失敗資訊
-                        upload_record = {
-                            'filename': file_info['name'],
-                            'filesize': self.format_file_size(file_info['size']),
-                            'upload_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                            'download_link': 'N/A',
-                            'status': '失敗'
-                        }
-                        self.upload_records.append(upload_record)
+                        upload_record = UploadResult(file_info.name, file_info.size, '失敗')
+                        self.add_upload_record(upload_record, file_info, [upload_file_info], file_started,
+                                               target_folder_id, target_folder_name)
                     
-                    # 清理臨時壓縮檔案
-                    if compressed_file and os.path.exists(compressed_file):
-                        try:
-                            os.remove(compressed_file)
-                        except:
-                            pass
+                    # 釋放暫存空間（快取中的壓縮檔會保留）
+                    if lease:
+                        lease.release()
                     
-                    self.root.after(0, lambda: self.progress.step())
+                    self.ui.step()
                 
-                # 清理臨時目錄
-                try:
-                    shutil.rmtree(temp_dir)
-                except:
-                    pass
+                # 等待背景完整性校驗（含重新上傳）完成
+                if self.verifier.pending:
+                    self.log("🔎 等待上傳校驗完成...")
+                self.verifier.wait_idle()
+                
+                # 等待背景文件記錄產生完成
+                if self.record_stage.queued:
+                    self.log("📄 等待文件記錄產生完成...")
+                self.record_stage.wait_idle()
                 
                 # 上傳完成
                 completion_msg = f"🎉 上傳完成！成功: {success_count}/{len(self.selected_files)}"
-                self.root.after(0, lambda msg=completion_msg: self.log(msg))
+                self.log(completion_msg)
+                self.event_log.emit('batch', 'done', files=len(self.selected_files), succeeded=success_count,
+                                    duration=time.perf_counter() - batch_started)
                 
             finally:
                 self.is_uploading = False
+                self.verifier.stop()
+                self.event_log.close_run()
+                METRICS.observe('batch', time.perf_counter() - batch_started)
+                self.export_metrics()
+                if profiler is not None:
+                    self.stop_profiler(profiler)
+                # 清理本次工作階段的暫存目錄
+                self.scratch.close_session()
+                if cache is not None:
+                    cache.close()
                 self.root.after(0, lambda: self.upload_button.config(text="🚀 開始上傳", state='normal'))
         
-        threading.Thread(target=upload_thread, daemon=True).start()
+        threading.Thread(target=upload_thread, name="上傳", daemon=True).start()
+    
+    def fetch_file_info(self, file_codes):
+        """批次查詢伺服器上的檔案資訊，回傳 {file_code: info}"""
+        key = self.api_key.get().strip()
+        url = f"{KATFILE_API}/file/info?key={quote(key)}&file_code={','.join(file_codes)}"
+        response = self.session.get(url, timeout=30, allow_redirects=True)
+        if response.status_code != 200:
+            raise Exception(f"HTTP {response.status_code}")
+        data = response.json()
+        if data.get('msg') != 'OK':
+            raise Exception(data.get('msg', '未知錯誤'))
+        
+        infos = {}
+        for info in data.get('result') or []:
+            code = info.get('filecode') or info.get('file_code')
+            if code and str(info.get('status', 200)) == '200':
+                infos[code] = info
+        return infos
+    
+    def add_upload_record(self, record, file_info, upload_infos, started, folder_id, folder_name):
+        """加入本批次的上傳記錄，並寫入本機上傳歷史"""
+        self.upload_records.append(record)
+        if self.history is None:
+            return
+        try:
+            with METRICS.timed('history'):
+                record.history_id = self.history.add(
+                    record, file_info.path, folder_id, folder_name, upload_infos,
+                    time.perf_counter() - started, self.event_log.run_id
+                )
+        except sqlite3.Error as e:
+            error_msg = f"⚠️ 寫入上傳歷史失敗: {e}"
+            self.log(error_msg)
+    
+    def queue_verification(self, index, file_info, upload_infos, download_links, names, record,
+                           release=None, manifest_part_size=None, folder_id=None):
+        """將一個檔案（或其所有分割）交給背景校驗；全部校驗完成後才釋放暫存檔"""
+        # 先決定要校驗的數量再送出，校驗執行緒不會在送出途中把計數減到 0
+        parts = [n for n, info in enumerate(upload_infos) if info.file_code]
+        group = {
+            'index': index,
+            'file_info': file_info,
+            'infos': upload_infos,
+            'links': list(download_links),
+            'names': names,
+            'record': record,
+            'release': release,
+            'manifest_part_size': manifest_part_size,
+            'folder_id': self.current_folder_id if folder_id is None else folder_id,
+            'lock': threading.Lock(),
+            'pending': len(parts),
+            'changed': False,
+            'failed': False
+        }
+        if not parts:
+            self.finish_verification(group)
+            return
+        for n in parts:
+            self.submit_verification(group, n, 0)
+    
+    def submit_verification(self, group, part, attempt):
+        info = group['infos'][part]
+        self.verifier.submit({
+            'group': group,
+            'part': part,
+            'file_code': info.file_code,
+            'expected_size': info.bytes_sent,
+            'server_size': info.server_size,
+            'digests': info.digests,
+            'attempt': attempt
+        })
+    
+    def on_verification_result(self, item, status, detail):
+        """處理一筆校驗結果（在校驗背景執行緒中執行，重新上傳交給校驗工作池）"""
+        group = item['group']
+        info = group['infos'][item['part']]
+        
+        if status == 'mismatch':
+            warn_msg = f"⚠️ 上傳校驗不符：{info.name}，{detail}"
+            self.log(warn_msg)
+            
+            if item['attempt'] < 2:
+                self.verifier.run_async(self.reupload_mismatch, item)
+                return
+            self.verifier.run_async(self.quarantine_remote_file, item['file_code'])
+            group['failed'] = True
+        elif status == 'unknown':
+            warn_msg = f"⚠️ 無法校驗 {info.name}：{detail}"
+            self.log(warn_msg)
+        
+        self.finish_verification_part(group)
+    
+    def reupload_mismatch(self, item):
+        """只重新上傳不符的檔案或分割，並把伺服器上不符的那份移到校驗失敗資料夾"""
+        group = item['group']
+        info = group['infos'][item['part']]
+        try:
+            retry_msg = f"🔁 重新上傳：{info.name}"
+            self.log(retry_msg)
+            link = self.upload_single_file(info, group['folder_id'], self.get_digest_names())
+            self.quarantine_remote_file(item['file_code'])
+            if link:
+                group['links'][item['part']] = link
+                group['changed'] = True
+                self.submit_verification(group, item['part'], item['attempt'] + 1)
+                return
+            group['failed'] = True
+        except Exception as e:
+            error_msg = f"❌ 重新上傳失敗：{info.name}，{str(e)}"
+            self.log(error_msg)
+            group['failed'] = True
+        self.finish_verification_part(group)
+    
+    def finish_verification_part(self, group):
+        """一個檔案或分割校驗結束；全部結束時完成整個檔案的校驗"""
+        with group['lock']:
+            group['pending'] -= 1
+            done = group['pending'] == 0
+        if done:
+            self.finish_verification(group)
+    
+    def quarantine_remote_file(self, file_code, reason="校驗不符", stage='verify'):
+        """把有問題的遠端檔案（校驗不符、未完成分割上傳的殘留分割）移到「校驗失敗」資料夾並記錄，方便確認後手動刪除"""
+        try:
+            with self.quarantine_lock:
+                if self.quarantine_folder_id is None:
+                    existing = next((folder for folder in self.folder_cache.children(0)
+                                     if folder.get('name') == QUARANTINE_FOLDER_NAME), None)
+                    if existing is not None:
+                        self.quarantine_folder_id = int(existing['fld_id'])
+                    else:
+                        self.quarantine_folder_id = self.create_remote_folder(QUARANTINE_FOLDER_NAME)
+                        self.folder_cache.invalidate(0)
+            params = {'key': self.api_key.get().strip(), 'file_code': file_code, 'fld_id': self.quarantine_folder_id}
+            response = self.session.get(f"{KATFILE_API}/file/set_folder?{urlencode(params)}", timeout=30,
+                                        allow_redirects=True)
+            if response.status_code != 200:
+                raise Exception(f"HTTP {response.status_code}")
+            self.event_log.emit(stage, 'quarantined', file_code=file_code, folder_id=self.quarantine_folder_id)
+            flag_msg = f"🚩 {reason}的檔案 {file_code} 已移到「{QUARANTINE_FOLDER_NAME}」資料夾"
+            self.log(flag_msg)
+        except Exception as e:
+            warn_msg = f"⚠️ 無法標記{reason}的檔案 {file_code}：{str(e)}"
+            self.log(warn_msg)
+            self.event_log.emit(stage, 'quarantine_error', file_code=file_code, error=str(e))
+    
+    def quarantine_partial_upload(self, file_info, upload_infos):
+        """分割上傳失敗時，已上傳的分割會留在伺服器：記錄其檔案代碼並移到「校驗失敗」資料夾"""
+        file_codes = [info.file_code for info in upload_infos if info.file_code]
+        if not file_codes:
+            return
+        orphan_msg = f"⚠️ {file_info.name} 未完成，已上傳的 {len(file_codes)} 個分割留在伺服器: {', '.join(file_codes)}"
+        self.log(orphan_msg)
+        self.event_log.emit('upload', 'orphaned', file=file_info.path, file_codes=file_codes)
+        for file_code in file_codes:
+            self.quarantine_remote_file(file_code, "分割上傳未完成", 'upload')
+    
+    def finish_verification(self, group):
+        """一個檔案的所有校驗都完成：更新記錄、必要時重新生成文件，並釋放暫存檔"""
+        try:
+            record = group['record']
+            file_info = group['file_info']
+            idx = group['index']
+            
+            if group['failed']:
+                record.status = '校驗失敗'
+                self.ui.status(idx, "⚠️ 校驗失敗")
+            elif group['changed']:
+                links = group['links']
+                record.download_links = list(links)
+                record.checksums = self.collect_checksums(group['infos'])
+                
+                if group['manifest_part_size']:
+                    write_parts_manifest(file_info, group['infos'], links, group['manifest_part_size'])
+                self.submit_word_document(idx, file_info, links, group['names'], record.checksums, record)
+                
+                fixed_msg = f"✅ 重新上傳後校驗通過：{file_info.name}"
+                self.log(fixed_msg)
+            
+            if (group['failed'] or group['changed']) and self.history and record.history_id:
+                self.history.update(record.history_id, record, group['infos'] if group['changed'] else ())
+        except Exception as e:
+            error_msg = f"❌ 更新校驗結果失敗: {str(e)}"
+            self.log(error_msg)
+        finally:
+            if group['release']:
+                group['release']()
+    
+    def _put_prepared(self, prepared, item):
+        """將壓縮結果放入佇列；上傳被中止時回傳 False"""
+        while self.is_uploading:
+            try:
+                METRICS.set_state("等待上傳")
+                prepared.put(item, timeout=1.0)
+                METRICS.set_gauge('queue_upload', prepared.qsize())
+                METRICS.set_state(None)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def upload_virtual_parts(self, index, parts, target_folder_id):
+        """並行上傳同一原檔案的多個虛擬分割，回傳與 parts 對應的下載連結（失敗者為 None）"""
+        download_links = [None] * len(parts)
+        completed = 0
+        # 分割清單一定需要 SHA-256
+        digests = tuple(dict.fromkeys(('sha256',) + self.get_digest_names()))
+        
+        with ThreadPoolExecutor(max_workers=min(self.get_parallel_uploads(), len(parts)),
+                                thread_name_prefix="上傳分割") as pool:
+            futures = {
+                pool.submit(self.upload_single_file, part, target_folder_id, digests): n
+                for n, part in enumerate(parts)
+            }
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                n = futures[future]
+                link = future.result()
+                if link:
+                    download_links[n] = link
+                    completed += 1
+                    self.ui.status(index, f"已上傳 {completed}/{len(parts)} 個分割檔案")
+                if not link or not self.is_uploading:
+                    # 任一分割失敗就取消尚未開始的分割（已開始的分割會上傳完成）
+                    for pending in futures:
+                        pending.cancel()
+                    if not link:
+                        fail_msg = f"❌ 分割檔案 {parts[n].name} 上傳失敗"
+                        self.log(fail_msg)
+        
+        return download_links
+    
+    def upload_single_file(self, file_info, target_folder_id, digests=()):
+        """上傳單個檔案（file_info 含 offset 時只上傳原檔案中的該段範圍）"""
+        with METRICS.stage("上傳中"), METRICS.timed('upload_file'):
+            link = self._upload_single_file(file_info, target_folder_id, digests)
+        METRICS.inc('uploads_completed' if link else 'upload_failures')
+        return link
     
-    def upload_single_file(self, file_info, target_folder_id):
-        """上傳單個檔案"""
+    def _upload_single_file(self, file_info, target_folder_id, digests):
         key = self.api_key.get().strip()
         max_retries = 2
+        event_fields = {'file': file_info.path, 'name': file_info.name, 'part': getattr(file_info, 'part', None)}
         
         for attempt in range(max_retries):
+            status_code = None
+            started = time.perf_counter()
             try:
                 if attempt > 0:
-                    retry_msg = f"🔄 重試上傳 {file_info['name']} (第 {attempt} 次)"
-                    self.root.after(0, lambda msg=retry_msg: self.log(msg))
+                    retry_msg = f"🔄 重試上傳 {file_info.name} (第 {attempt} 次)"
+                    self.log(retry_msg)
+                    METRICS.inc('upload_retries')
+                    METRICS.set_state("等待重試")
                     time.sleep(3)
                 
                 # 第一步：獲取上傳伺服器
-                server_url = f"https://katfile.cloud/api/upload/server?key={quote(key)}"
-                response = self.session.get(server_url, timeout=30, allow_redirects=True)
+                METRICS.set_state("取得上傳伺服器")
+                server_url = f"{KATFILE_API}/upload/server?key={quote(key)}"
+                with METRICS.timed('upload_server'):
+                    response = self.session.get(server_url, timeout=30, allow_redirects=True)
                 
                 if response.status_code != 200:
                     raise Exception(f"獲取上傳伺服器失敗: HTTP {response.status_code}")
@@ -1459,21 +5514,40 @@ class KatFileUploaderEnhanced:
                 upload_url = upload_context['result']
                 sess_id = upload_context['sess_id']
                 
-                with open(file_info['path'], 'rb') as f:
-                    files = {'file_0': (file_info['name'], f, 'application/octet-stream')}
+                if isinstance(file_info, FilePart):
+                    source = ByteRangeReader(file_info.path, file_info.offset, file_info.size)
+                    source_size = len(source)
+                else:
+                    source = open(file_info.path, 'rb')
+                    source_size = os.fstat(source.fileno()).st_size
+                
+                with source:
                     data = {
                         'sess_id': sess_id,
                         'utype': 'prem'
                     }
+                    body = MultipartFileStream(data, 'file_0', file_info.name, source, source_size, digests=digests,
+                                               block_size=self.get_upload_block_size(), on_read=METRICS.add_bytes)
+                    METRICS.set_state("上傳中")
                     
-                    response = self.session.post(
-                        upload_url, 
-                        files=files, 
-                        data=data, 
-                        timeout=600,
-                        allow_redirects=True
-                    )
+                    with METRICS.timed('upload_post'):
+                        response = self.session.post(
+                            upload_url, 
+                            data=body.as_body(), 
+                            headers={'Content-Type': body.content_type},
+                            timeout=600,
+                            allow_redirects=True
+                        )
                     
+                if digests:
+                    file_info.digests = body.hexdigests()
+                
+                status_code = response.status_code
+                METRICS.inc('upload_retries', response_retries(response))
+                self.event_log.emit('upload', 'sent', **event_fields, bytes=source_size, http_status=status_code,
+                                    retries=response_retries(response), attempt=attempt + 1,
+                                    duration=time.perf_counter() - started)
+                
                 if response.status_code != 200:
                     raise Exception(f"上傳失敗: HTTP {response.status_code}")
                     
@@ -1486,78 +5560,98 @@ class KatFileUploaderEnhanced:
                     raise Exception(f"上傳失敗: {file_result.get('file_status', '未知錯誤')}")
                     
                 file_code = file_result['file_code']
+                file_info.file_code = file_code
+                file_info.bytes_sent = source_size
+                file_info.server_size = None
+                self.event_log.emit('upload', 'done', **event_fields, file_code=file_code, bytes=source_size,
+                                    attempt=attempt + 1, duration=time.perf_counter() - started)
                 
                 # 第三步：移動到目標資料夾
                 if target_folder_id != 0:
+                    METRICS.set_state("移動資料夾")
                     try:
-                        move_url = f"https://katfile.cloud/api/file/set_folder?key={quote(key)}&file_code={file_code}&fld_id={target_folder_id}"
-                        move_response = self.session.get(move_url, timeout=30, allow_redirects=True)
+                        move_url = f"{KATFILE_API}/file/set_folder?key={quote(key)}&file_code={file_code}&fld_id={target_folder_id}"
+                        with METRICS.timed('set_folder'):
+                            move_response = self.session.get(move_url, timeout=30, allow_redirects=True)
                         
                         if move_response.status_code != 200:
                             warning_msg = f"⚠️ 移動檔案到資料夾失敗: HTTP {move_response.status_code}"
-                            self.root.after(0, lambda msg=warning_msg: self.log(msg))
+                            self.log(warning_msg)
                     except:
                         warning_msg = f"⚠️ 移動檔案到資料夾時發生錯誤，檔案已上傳到根目錄"
-                        self.root.after(0, lambda msg=warning_msg: self.log(msg))
+                        self.log(warning_msg)
                         
                 # 第四步：獲取直接下載連結
                 direct_link = None
+                METRICS.set_state("取得連結")
+                link_polling_started = time.perf_counter()
                 for retry in range(3):  # 重試3次
+                    link_started = time.perf_counter()
                     try:
-                        direct_url = f"https://katfile.cloud/api/file/direct_link?key={quote(key)}&file_code={file_code}"
-                        self.root.after(0, lambda: self.log(f"🔗 獲取直接下載連結: {direct_url}"))
+                        direct_url = f"{KATFILE_API}/file/direct_link?key={quote(key)}&file_code={file_code}"
+                        self.log(f"🔗 獲取直接下載連結: {file_code}")
                         
                         direct_response = self.session.get(direct_url, timeout=30, allow_redirects=True)
+                        self.event_log.emit('direct_link', 'response', **event_fields, file_code=file_code,
+                                            http_status=direct_response.status_code,
+                                            retries=retry + response_retries(direct_response),
+                                            duration=time.perf_counter() - link_started)
                         
                         if direct_response.status_code == 200:
                             direct_data = direct_response.json()
-                            self.root.after(0, lambda: self.log(f"📄 API回應: {direct_data}"))
+                            self.log(f"📄 API回應: {direct_data}")
                             
                             if direct_data.get('msg') == 'OK' and 'result' in direct_data:
                                 direct_link = direct_data['result']['url']
-                                file_size = direct_data['result'].get('size', 0)
-                                self.root.after(0, lambda: self.log(f"✅ 獲取直接連結成功: {direct_link}"))
-                                self.root.after(0, lambda: self.log(f"📊 檔案大小: {self.format_file_size(file_size)}"))
+                                file_info.server_size = parse_server_size(direct_data['result'].get('size'))
+                                self.log(f"✅ 獲取直接連結成功: {direct_link}")
+                                if file_info.server_size is not None:
+                                    self.log(f"📊 檔案大小: {self.format_file_size(file_info.server_size)}")
                                 break
                             else:
                                 error_msg = f"❌ API錯誤: {direct_data.get('msg', '未知錯誤')}"
-                                self.root.after(0, lambda msg=error_msg: self.log(msg))
+                                self.log(error_msg)
                         else:
                             error_msg = f"❌ HTTP錯誤: {direct_response.status_code}"
-                            self.root.after(0, lambda msg=error_msg: self.log(msg))
+                            self.log(error_msg)
                             
                     except Exception as e:
                         error_msg = f"❌ 獲取直接連結失敗 (嘗試 {retry + 1}/3): {str(e)}"
-                        self.root.after(0, lambda msg=error_msg: self.log(msg))
+                        self.log(error_msg)
                         if retry < 2:  # 不是最後一次重試
+                            METRICS.inc('link_retries')
                             time.sleep(2)  # 等待2秒後重試
                 
+                # 包含重試等待的完整輪詢時間
+                METRICS.observe('direct_link', time.perf_counter() - link_polling_started)
+                
                 # 返回結果
                 if direct_link:
                     return direct_link
                 else:
                     # 如果無法獲取直接連結，返回網頁連結作為備用
-                    webpage_link = f"https://katfile.cloud/{file_code}"
+                    webpage_link = f"{KATFILE_SITE}/{file_code}"
                     warning_msg = f"⚠️ 無法獲取直接下載連結，使用網頁連結: {webpage_link}"
-                    self.root.after(0, lambda msg=warning_msg: self.log(msg))
+                    self.log(warning_msg)
                     return webpage_link
                 
             except Exception as error:
                 error_msg = f"❌ 上傳錯誤 (嘗試 {attempt + 1}/{max_retries}): {str(error)}"
-                self.root.after(0, lambda msg=error_msg: self.log(msg))
+                self.log(error_msg)
+                self.event_log.emit('upload', 'error', **event_fields, http_status=status_code, attempt=attempt + 1,
+                                    error=str(error), duration=time.perf_counter() - started)
                 if attempt == max_retries - 1:
                     return None
                     
         return None
     
     def update_file_status(self, index, status):
-        """更新檔案狀態顯示"""
-        items = self.file_tree.get_children()
-        if index < len(items):
-            item = items[index]
-            current_values = list(self.file_tree.item(item, "values"))
-            current_values[1] = status
-            self.file_tree.item(item, values=current_values)
+        """更新檔案狀態（不在目前頁面的檔案只更新狀態，換頁時才顯示）"""
+        if index < len(self.file_statuses):
+            self.file_statuses[index] = status
+            item = self.file_items.get(index)
+            if item is not None:
+                self.file_tree.set(item, "status", status)
 
 def main():
     root = tk.Tk()
@@ -0,0 +1,47 @@
+"""上傳後校驗：direct_link 沒有回報大小時，不可當成 0 位元組判定為不符"""
+
+import threading
+
+import katfile_uploader_enhanced as app
+
+
+def run_verifier(item, infos):
+    results = []
+    done = threading.Event()
+
+    def on_result(item, status, detail):
+        results.append((status, detail))
+        done.set()
+
+    verifier = app.UploadVerifier(lambda codes: infos, on_result, max_wait=0.01, max_checks=1, retry_delay=0.01)
+    try:
+        verifier.submit(item)
+        assert done.wait(5)
+        assert verifier.wait_idle(5)
+    finally:
+        verifier.stop()
+    return results
+
+
+def test_parse_server_size():
+    assert app.parse_server_size(1024) == 1024
+    assert app.parse_server_size('2048') == 2048
+    assert app.parse_server_size(None) is None
+    assert app.parse_server_size('') is None
+    assert app.parse_server_size('N/A') is None
+
+
+def test_direct_link_without_size_is_unverified_not_mismatch():
+    direct_result = {'url': 'https://example.invalid/file.bin'}  # direct_link 回應中沒有 size
+    item = {'file_code': 'abc123', 'expected_size': 4096,
+            'server_size': app.parse_server_size(direct_result.get('size'))}
+
+    assert run_verifier(item, {}) == [('unknown', "無法取得伺服器檔案資訊")]
+
+
+def test_direct_link_size_still_used_as_fallback():
+    item = {'file_code': 'abc123', 'expected_size': 4096, 'server_size': app.parse_server_size('1000')}
+
+    [(status, detail)] = run_verifier(item, {})
+    assert status == 'mismatch'
+    assert "1000" in detail